@@ -0,0 +1,152 @@
+"""
+Temporal alignment of a distorted sequence to its reference.
+
+Every frame is reduced to a luma signature, the mean of each cell in a
+16x16 grid. Only the luma pages of the memory-mapped files are
+touched, a small fraction of a full comparison.
+
+The start offset is found by sliding the first signatures of the
+distorted sequence along the reference. Then a dynamic program maps
+each distorted frame to a reference frame, monotonically: staying on
+the same reference frame is a repeat, skipping reference frames is a
+drop. The search is limited to a band that follows the best path.
+
+The resulting (reference, distorted) pairs can be given to
+YCbCr.psnr() and YCbCr.ssim().
+"""
+
+from ycbcr import LazyModule, MappedReader
+
+np = LazyModule('numpy')
+
+GRID = 16
+
+
+def signature(yy, grid=GRID):
+    """
+    Mean luma of grid x grid cells, float32 vector
+    """
+    h = yy.shape[0] - yy.shape[0] % grid
+    w = yy.shape[1] - yy.shape[1] % grid
+    cells = yy[:h, :w].reshape(grid, h / grid, grid, w / grid)
+    return cells.mean(axis=(1, 3), dtype=np.float32).reshape(-1)
+
+
+def signatures(yuv, fname=None, grid=GRID):
+    """
+    (n, grid*grid) signatures of all frames in fname
+    (default yuv.filename)
+    """
+    with MappedReader(yuv, fname or yuv.filename) as reader:
+        n = len(reader)
+        sig = np.empty((n, grid * grid), dtype=np.float32)
+        progress = yuv.progress.run(n, 'signature')
+        for i in xrange(n):
+            sig[i] = signature(reader.read(i).yy, grid)
+            progress.update()
+        progress.finish()
+    return sig
+
+
+def _cost(ref, d):
+    """
+    Mean absolute difference between the signatures ref and d
+    """
+    return np.abs(ref - d).mean(axis=-1)
+
+
+def estimate_offset(ref, dist, window=32, length=16):
+    """
+    Reference frame that the first distorted frame corresponds to,
+    searched in 0..window
+    """
+    length = max(min(length, len(dist)), 1)
+    best, offset = None, 0
+    for o in xrange(0, min(window, len(ref) - 1) + 1):
+        n = min(length, len(ref) - o)
+        c = _cost(ref[o:o + n], dist[:n]).mean()
+        if best is None or c < best:
+            best, offset = c, o
+    return offset
+
+
+def align(ref, dist, window=32, drop_cost=1.0, repeat_cost=1.0):
+    """
+    Map each distorted frame onto a reference frame, given their
+    signatures. Returns an int array, one reference index per
+    distorted frame, non-decreasing.
+
+    Matching costs are in luma levels, a dropped reference frame costs
+    drop_cost and a repeated one repeat_cost.
+    """
+    m, n = len(ref), len(dist)
+    if not m or not n:
+        return np.zeros(0, dtype=np.int)
+
+    # first row, skipping into the reference costs like dropping
+    center = estimate_offset(ref, dist, window)
+    lo, hi = max(center - window, 0), min(center + window + 1, m)
+    r = np.arange(lo, hi)
+    D = _cost(ref[lo:hi], dist[0]) + drop_cost * r
+    bands = [(lo, None)]
+
+    for j in xrange(1, n):
+        plo = lo
+        center = plo + int(np.argmin(D)) + 1
+        lo, hi = max(center - window, 0), min(center + window + 1, m)
+        r = np.arange(lo, hi)
+
+        # advance from r' < r: D[r'] + drop_cost * (r - r' - 1)
+        E = D - drop_cost * np.arange(plo, plo + len(D))
+        pm = np.minimum.accumulate(E)
+        arg = np.maximum.accumulate(np.where(E == pm, np.arange(len(E)), 0))
+        k = np.clip(r - 1 - plo, -1, len(D) - 1)
+        adv = np.where(k >= 0, pm[np.maximum(k, 0)] + drop_cost * (r - 1),
+                       np.inf)
+        adv_from = plo + arg[np.maximum(k, 0)]
+
+        # stay on r, a repeat
+        k = r - plo
+        ok = (k >= 0) & (k < len(D))
+        rep = np.where(ok, D[np.clip(k, 0, len(D) - 1)] + repeat_cost, np.inf)
+
+        back = np.where(rep < adv, r, adv_from)
+        D = np.minimum(rep, adv) + _cost(ref[lo:hi], dist[j])
+        bands.append((lo, back))
+
+    # backtrack
+    path = np.empty(n, dtype=np.int)
+    cur = bands[-1][0] + int(np.argmin(D))
+    for j in xrange(n - 1, -1, -1):
+        path[j] = cur
+        lo, back = bands[j]
+        if back is not None:
+            cur = int(back[cur - lo])
+    return path
+
+
+def repeats(path):
+    """
+    Distorted frames that repeat the reference frame before them
+    """
+    return [int(j) + 1 for j in np.flatnonzero(np.diff(path) == 0)]
+
+
+def dropped(path):
+    """
+    Reference frames skipped between the first and the last match
+    """
+    if not len(path):
+        return []
+    used = set(path.tolist())
+    return [i for i in xrange(path[0], path[-1]) if i not in used]
+
+
+def pairs(yuv, window=32, grid=GRID):
+    """
+    Aligned (reference, distorted) frame pairs for yuv.filename and
+    yuv.filename_diff, and the path itself
+    """
+    path = align(signatures(yuv, yuv.filename, grid),
+                 signatures(yuv, yuv.filename_diff, grid), window)
+    return [(int(r), j) for j, r in enumerate(path)], path
@@ -0,0 +1,109 @@
+"""
+Bjontegaard delta rate and delta PSNR between two rate-distortion
+curves, see VCEG-M33.
+
+    BD-rate - average bitrate difference in percent at equal quality,
+              negative means the test needs fewer bits
+    BD-PSNR - average PSNR difference in dB at equal bitrate
+
+Each curve is fitted with a cubic polynomial (lower degree with fewer
+than four points) of PSNR over log10(rate), or the inverse, and the
+difference is integrated over the overlapping interval.
+
+The sequence PSNRs of all encodes are computed in one pass: each
+reference frame is read once and compared against every encode by a
+pool of threads.
+"""
+
+import itertools
+
+from multiprocessing.pool import ThreadPool
+
+from ycbcr import LazyModule, psnr_frame
+
+np = LazyModule('numpy')
+
+PLANES = ('Y', 'Cb', 'Cr', 'BD')
+
+
+def _fit(x, y):
+    degree = min(3, len(x) - 1)
+    return np.polyint(np.polyfit(x, y, degree))
+
+
+def _overlap(a, b):
+    lo = max(min(a), min(b))
+    hi = min(max(a), max(b))
+    if hi <= lo:
+        raise ValueError('rate-distortion curves do not overlap')
+    return lo, hi
+
+
+def bd_psnr(rate1, psnr1, rate2, psnr2):
+    """
+    Average PSNR difference (dB) of curve 2 over curve 1
+    """
+    lr1, lr2 = np.log10(rate1), np.log10(rate2)
+    p1, p2 = _fit(lr1, psnr1), _fit(lr2, psnr2)
+    lo, hi = _overlap(lr1, lr2)
+    int1 = np.polyval(p1, hi) - np.polyval(p1, lo)
+    int2 = np.polyval(p2, hi) - np.polyval(p2, lo)
+    return (int2 - int1) / (hi - lo)
+
+
+def bd_rate(rate1, psnr1, rate2, psnr2):
+    """
+    Average bitrate difference (%) of curve 2 over curve 1
+    """
+    lr1, lr2 = np.log10(rate1), np.log10(rate2)
+    p1, p2 = _fit(psnr1, lr1), _fit(psnr2, lr2)
+    lo, hi = _overlap(psnr1, psnr2)
+    int1 = np.polyval(p1, hi) - np.polyval(p1, lo)
+    int2 = np.polyval(p2, hi) - np.polyval(p2, lo)
+    return (10 ** ((int2 - int1) / (hi - lo)) - 1) * 100
+
+
+def sequence_psnr(yuv, fnames, workers=None):
+    """
+    Average [Y, Cb, Cr, BD] PSNR (as the final line of YCbCr.psnr())
+    of each file in fnames against yuv.filename. The reference is
+    read once, frames are compared concurrently.
+    """
+    readers = [yuv.open(f) for f in fnames]
+    sums = np.zeros((len(fnames), 4))
+    n = 0
+    pool = ThreadPool(workers)
+    try:
+        with yuv.open() as ref:
+            progress = yuv.progress.run(yuv.num_frames, 'bdrate')
+            indices = xrange(yuv.num_frames) if yuv.num_frames is not None \
+                else itertools.count()    # a stream, read to the end
+            for i in indices:
+                try:
+                    frame1 = ref.read(i)
+                    frames = [r.read(i) for r in readers]
+                except EOFError:
+                    break    # the shortest file decides
+                sums += pool.map(lambda f: psnr_frame(frame1, f), frames)
+                n += 1
+                progress.update()
+            progress.finish()
+    finally:
+        pool.close()
+        pool.join()
+        for r in readers:
+            r.close()
+    return sums / max(n, 1)
+
+
+def compare(rates1, psnr1, rates2, psnr2):
+    """
+    {plane: (BD-rate %, BD-PSNR dB)} for the [Y, Cb, Cr, BD] columns
+    of the sequence PSNRs of anchor (1) and test (2)
+    """
+    order1, order2 = np.argsort(rates1), np.argsort(rates2)
+    r1, r2 = np.asarray(rates1, float)[order1], np.asarray(rates2, float)[order2]
+    p1, p2 = np.asarray(psnr1)[order1], np.asarray(psnr2)[order2]
+    return dict((plane, (bd_rate(r1, p1[:, k], r2, p2[:, k]),
+                         bd_psnr(r1, p1[:, k], r2, p2[:, k])))
+                for k, plane in enumerate(PLANES))
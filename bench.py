@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the YCbCr operations on deterministic synthetic content.
+
+Every operation runs in a child process so that the reported peak RSS
+belongs to that operation alone. Results are written as JSON and can be
+compared against an earlier run to flag regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from multiprocessing import Process, Queue
+from Queue import Empty
+
+import numpy as np
+
+from ycbcr import YCbCr, FORMATS
+
+
+SIZES = {
+    'cif': (352, 288),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+OPS = [
+    'convert', 'psnr', 'ssim', 'diff', 'split', 'crop', 'fliplr',
+    'flipud', 'fnum', '8to10', '10to8', 'fr',
+]
+
+POLL = 1.0    # seconds between checks on a child
+
+
+def synthesize(fname, width, height, yuv_format, frames, seed=0, bits=8):
+    """
+    Write a deterministic synthetic sequence, moving gradients plus
+    seeded noise. 10bpp is stored as little-endian 16-bit samples,
+    i.e. the same layout as produced by eight2ten().
+    """
+    rng = np.random.RandomState(seed)
+    fmt = FORMATS[yuv_format](width, height)
+    d = fmt.chroma_div
+    up = fmt.bits - 8 + fmt.shift    # 8-bit content in wider formats
+
+    yy, xx = np.mgrid[0:height, 0:width]
+    cy, cx = np.mgrid[0:height / d.height, 0:width / d.width]
+
+    with open(fname, 'wb') as fd:
+        for i in xrange(frames):
+            luma = (xx * 192 / width + yy * 32 / height + 3 * i) % 220 + 16
+            luma = luma + rng.randint(0, 8, luma.shape)
+            cb = (cx * 64 / cx.shape[1] + 2 * i) % 96 + 80
+            cr = (cy * 64 / cy.shape[0] + 5 * i) % 96 + 80
+
+            data = np.zeros(fmt.get_frame_size(), dtype=np.uint8)
+            for view, p in zip(fmt.get_planes(data), (luma, cb, cr)):
+                view[...] = p << up
+
+            if bits == 10:
+                data = (data.astype('<u2') << 2) | rng.randint(0, 4, data.shape)
+                data = data.astype('<u2')
+            data.tofile(fd)
+
+
+class Case(object):
+    """
+    One benchmark case, an operation applied to a synthetic sequence
+    """
+    def __init__(self, op, size, yuv_format, bits, frames, arg=None):
+        self.op = op
+        self.size = size
+        self.yuv_format = yuv_format
+        self.bits = bits
+        self.frames = frames
+        self.arg = arg
+        self.width, self.height = SIZES[size]
+
+    @property
+    def name(self):
+        if self.arg:
+            return '%s:%s' % (self.op, self.arg)
+        return self.op
+
+    @property
+    def key(self):
+        return '%s/%s/%s/%d' % (self.name, self.size, self.yuv_format,
+                                self.bits)
+
+    def frame_size(self):
+        fs = FORMATS[self.yuv_format](self.width, self.height).get_frame_size()
+        return fs * self.bits / 8 if self.bits > 8 else fs
+
+    def run(self, ref, dist):
+        """
+        Execute the operation, return number of bytes read
+        """
+        kw = dict(width=self.width, height=self.height, filename=ref,
+                  yuv_format_in=self.yuv_format)
+        size = self.frame_size() * self.frames
+
+        if self.op == 'convert':
+            YCbCr(yuv_format_out=self.arg, filename_out='out.yuv', **kw).convert()
+        elif self.op == 'psnr':
+            list(YCbCr(filename_diff=dist, **kw).psnr())
+            size *= 2
+        elif self.op == 'ssim':
+            list(YCbCr(filename_diff=dist, **kw).ssim())
+            size *= 2
+        elif self.op == 'diff':
+            YCbCr(filename_diff=dist, **kw).diff()
+            size *= 2
+        elif self.op == 'split':
+            YCbCr(**kw).split()
+        elif self.op == 'crop':
+            YCbCr(filename_out='out.yuv',
+                  crop_rect=(16, 16, self.width / 2 - 1, self.height / 2 - 1),
+                  **kw).crop()
+        elif self.op == 'fliplr':
+            YCbCr(filename_out='out.yuv', **kw).fliplr()
+        elif self.op == 'flipud':
+            YCbCr(filename_out='out.yuv', **kw).flipud()
+        elif self.op == 'fnum':
+            YCbCr(filename_out='out.yuv', **kw).draw_frame_number()
+        elif self.op == '8to10':
+            YCbCr(filename=ref, filename_out='out.yuv').eight2ten()
+        elif self.op == '10to8':
+            YCbCr(filename=ref, filename_out='out.yuv').ten2eight()
+        elif self.op == 'fr':
+            YCbCr(**kw).change_framerate(60, 30)
+        return size
+
+
+def cases(ops, sizes, formats, bits, frames):
+    """
+    Expand the requested operations into benchmark cases.
+    Only 10to8 consumes 10bpp data, all other operations are 8bpp.
+    """
+    for size in sizes:
+        for f in formats:
+            for b in bits:
+                for op in ops:
+                    if (op == '10to8') != (b == 10):
+                        continue
+                    if op == 'convert':
+                        for fout in sorted(FORMATS):
+                            yield Case(op, size, f, b, frames, fout)
+                    else:
+                        yield Case(op, size, f, b, frames)
+
+
+def _child(case, ref, dist, repeat, queue):
+    """
+    Runs in a separate process. Report best wall-clock time and
+    the peak resident set size (kB) of this process.
+    """
+    sys.stdout = open(os.devnull, 'w')
+    best = None
+    for i in xrange(repeat):
+        t1 = time.time()
+        nbytes = case.run(ref, dist)
+        t2 = time.time()
+        if best is None or t2 - t1 < best:
+            best = t2 - t1
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((best, nbytes, peak))
+
+
+def _wait(p, queue, timeout=None):
+    """
+    Result of child p from queue, or (None, reason) when it exits
+    without one or runs longer than timeout seconds
+    """
+    start = time.time()
+    while True:
+        try:
+            return queue.get(timeout=POLL), None
+        except Empty:
+            pass
+        if not p.is_alive():
+            # the result may have been put just before the exit
+            try:
+                return queue.get(timeout=POLL), None
+            except Empty:
+                return None, 'exit code %s' % p.exitcode
+        if timeout is not None and time.time() - start > timeout:
+            p.terminate()
+            return None, 'timeout after %gs' % timeout
+
+
+def measure(case, ref, dist, repeat, timeout=None):
+    """
+    Time a case in a child process. A child that dies or times out
+    is reported with an error and no timings.
+    """
+    queue = Queue()
+    p = Process(target=_child, args=(case, ref, dist, repeat, queue))
+    p.start()
+    result, error = _wait(p, queue, timeout)
+    p.join()
+
+    r = {
+        'key': case.key,
+        'op': case.name,
+        'size': case.size,
+        'format': case.yuv_format,
+        'bits': case.bits,
+        'frames': case.frames,
+        'error': error,
+        'seconds': None,
+        'fps': None,
+        'mbps': None,
+        'peak_rss_kb': None,
+    }
+    if result is not None:
+        best, nbytes, peak = result
+        r.update({
+            'seconds': best,
+            'fps': case.frames / best if best else float('inf'),
+            'mbps': nbytes / best / 1e6 if best else float('inf'),
+            'peak_rss_kb': peak,
+        })
+    return r
+
+
+def compare(results, baseline, threshold):
+    """
+    Return the cases whose throughput dropped more than
+    threshold (fraction) compared to baseline
+    """
+    old = dict((r['key'], r) for r in baseline['results'])
+    regressions = []
+    for r in results:
+        if r['key'] not in old or r['fps'] is None or \
+                old[r['key']].get('fps') is None:
+            continue
+        ratio = r['fps'] / old[r['key']]['fps']
+        if ratio < 1.0 - threshold:
+            regressions.append((r['key'], old[r['key']]['fps'], r['fps'], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='YCbCr benchmarks on synthetic content',
+        epilog='Be careful with those bits')
+    parser.add_argument('--ops', nargs='+', default=OPS, choices=OPS)
+    parser.add_argument('--sizes', nargs='+', default=['cif'],
+                        choices=sorted(SIZES))
+    parser.add_argument('--formats', nargs='+', default=sorted(FORMATS),
+                        choices=sorted(FORMATS))
+    parser.add_argument('--bits', nargs='+', type=int, default=[8, 10],
+                        choices=[8, 10])
+    parser.add_argument('--frames', type=int, default=10,
+                        help='number of frames in each synthetic sequence')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='run each case n times, keep the fastest')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='fail a case that runs longer than this '
+                             'many seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default='bench.json',
+                        help='write results to this JSON file')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='earlier JSON result to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='flag a regression when fps drops by more '
+                             'than this fraction')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='yuvbench')
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    results = []
+
+    try:
+        os.chdir(tmp)
+        sequences = {}
+        for case in cases(args.ops, args.sizes, args.formats, args.bits,
+                          args.frames):
+            seq = (case.size, case.yuv_format, case.bits)
+            if seq not in sequences:
+                ref = os.path.join(tmp, 'ref_%s_%s_%d.yuv' % seq)
+                dist = os.path.join(tmp, 'dist_%s_%s_%d.yuv' % seq)
+                synthesize(ref, case.width, case.height, case.yuv_format,
+                           args.frames, args.seed, case.bits)
+                synthesize(dist, case.width, case.height, case.yuv_format,
+                           args.frames, args.seed + 1, case.bits)
+                sequences[seq] = (ref, dist)
+
+            r = measure(case, sequences[seq][0], sequences[seq][1],
+                        args.repeat, args.timeout)
+            results.append(r)
+            if r['error'] is not None:
+                print "[FAILED] {:<40} {}".format(r['key'], r['error'])
+                continue
+            print "{:<40} {:>10.2f} fps {:>10.2f} MB/s {:>10d} kB".format(
+                r['key'], r['fps'], r['mbps'], r['peak_rss_kb'])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'node': platform.node(),
+        'time': time.time(),
+        'frames': args.frames,
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(output, 'w') as fd:
+        json.dump(report, fd, indent=2, sort_keys=True)
+    print "Results written to", output
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        regressions = compare(results, baseline, args.threshold)
+        for key, old, new, ratio in regressions:
+            print "[REGRESSION] {:<40} {:>10.2f} -> {:>10.2f} fps ({:.0%})".format(
+                key, old, new, ratio)
+        if regressions:
+            sys.exit(1)
+    if any(r['error'] is not None for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Frame-level editing, see 'ycbcr.py edit'.
+
+The output is described by a frame-list expression, comma separated
+items of the form
+
+    [FILE@]FIRST[-[LAST]][:STEP][*REPEAT]
+
+    12          frame 12
+    0-99        frames 0 to 99, inclusive
+    100-        frame 100 to the end
+    0-99:10     every 10th frame
+    99-0        reversed
+    5*25        frame 5, 25 times
+    0-9*3       frames 0-9, three times
+    1@0-49      frames 0-49 of the second input file
+
+Inputs are numbered from 0 in the order given. All have the format
+and frame size of the first.
+
+Frames are never decoded. The expression is turned into runs of
+frames that are adjacent in one file, and each run is written with
+one copy out of a memory map of that file.
+"""
+
+from ycbcr import LazyModule, open_output, require_file
+import y4m
+
+np = LazyModule('numpy')
+
+
+def _item(item, counts):
+    """
+    (file, frames) of one expression item
+    """
+    src, at, rng = item.rpartition('@')
+    rng, star, repeat = rng.partition('*')
+    rng, colon, step = rng.partition(':')
+    first, dash, last = rng.partition('-')
+    try:
+        f = int(src) if at else 0
+        n = counts[f]
+        step = int(step) if colon else 1
+        repeat = int(repeat) if star else 1
+        first = int(first)
+        last = (int(last) if last else n - 1) if dash else first
+    except (ValueError, IndexError):
+        raise ValueError('bad frame list item "%s"' % item)
+    if step < 1 or repeat < 0 or min(first, last) < 0:
+        raise ValueError('bad frame list item "%s"' % item)
+    if max(first, last) >= n:
+        raise ValueError('"%s": file %d has %d frames' % (item, f, n))
+    if last >= first:
+        frames = range(first, last + 1, step)
+    else:
+        frames = range(first, last - 1, -step)
+    return f, frames * repeat
+
+
+def parse(expr, counts):
+    """
+    List of (file, frame) from a frame-list expression, counts are
+    the number of frames of each input
+    """
+    ret = []
+    for item in expr.split(','):
+        item = item.strip()
+        if item:
+            f, frames = _item(item, counts)
+            ret.extend((f, i) for i in frames)
+    return ret
+
+
+def runs(frames):
+    """
+    Group (file, frame) into (file, first, count) runs of frames that
+    follow each other in the same file
+    """
+    ret = []
+    for f, i in frames:
+        if ret and ret[-1][0] == f and ret[-1][1] + ret[-1][2] == i:
+            ret[-1][2] += 1
+        else:
+            ret.append([f, i, 1])
+    return [tuple(r) for r in ret]
+
+
+def edit(yuv, fnames, expr, filename_out):
+    """
+    Write the frames of fnames (inputs of the format of yuv) selected
+    by expr to filename_out, .y4m for YUV4MPEG2 (planar 8-bit
+    inputs only). Return the number of frames written.
+    """
+    y4m_out = filename_out != '-' and filename_out.lower().endswith('.y4m')
+    if y4m_out and yuv.yuv_format_in not in y4m.CHROMA:
+        raise ValueError('%s frames cannot be copied into y4m, convert '
+                         'to %s first' % (yuv.yuv_format_in,
+                                          y4m.PLANAR[tuple(yuv.chroma_div)]))
+    fs = yuv.frame_size_in
+    offsets = []
+    for fname in fnames:
+        require_file(fname)
+        offsets.append(yuv.frame_offsets(fname))
+    counts = [len(o) if o is not None else yuv.count_frames(f)
+              for f, o in zip(fnames, offsets)]
+    plan = runs(parse(expr, counts))
+    total = sum(n for f, i, n in plan)
+
+    header = None
+    if y4m_out:
+        header = y4m.make_header(yuv.width, yuv.height, yuv.yuv_format_in,
+                                 yuv.headers.get(fnames[0]))
+
+    maps = {}
+    progress = yuv.progress.run(total, 'edit')
+    with open_output(filename_out) as fd:
+        if header is not None:
+            fd.write(header.line())
+        for f, first, n in plan:
+            if f not in maps:
+                maps[f] = np.memmap(fnames[f], dtype=np.uint8, mode='r')
+            mm = maps[f]
+            if offsets[f] is None and header is None:
+                mm[first * fs:(first + n) * fs].tofile(fd)    # one copy
+            else:
+                # y4m frames are apart, FRAME markers in between
+                for i in xrange(first, first + n):
+                    start = i * fs if offsets[f] is None else offsets[f][i]
+                    if header is not None:
+                        fd.write(y4m.FRAME_LINE)
+                    mm[start:start + fs].tofile(fd)
+            progress.update(n)
+    progress.finish()
+    return total
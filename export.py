@@ -0,0 +1,222 @@
+"""
+Still images of frames, see 'ycbcr.py export'.
+
+Frames are written as PNG, PPM (RGB) or PGM (luma only), the type
+follows the extension of the output pattern. Frames are selected by a
+frame list, e.g. '0-99:10,150,200-' (see edit.py), or as the worst n
+by a metric against a reference.
+
+Images are encoded with zlib and struct only. Frames are read from a
+memory map and converted by a pool of threads, numpy and zlib release
+the GIL. A contact sheet of thumbnails is built in the same pass:
+planes are box-filtered down before the colour conversion, so a sheet
+of a whole sequence costs little more than reading its luma.
+"""
+
+import os
+import struct
+import zlib
+
+from multiprocessing.pool import ThreadPool
+
+from ycbcr import LazyModule, ChromaDiv
+import edit
+import rgb
+
+np = LazyModule('numpy')
+
+TYPES = ('png', 'ppm', 'pgm')
+
+PNG_LEVEL = 3    # zlib level, speed over size
+PNG_MAGIC = '\x89PNG\r\n\x1a\n'
+
+
+def image_type(fname):
+    """
+    png, ppm or pgm from the extension of fname
+    """
+    ext = os.path.splitext(fname)[1].lower().lstrip('.')
+    if ext not in TYPES:
+        raise ValueError('%s: not one of .%s' % (fname, ', .'.join(TYPES)))
+    return ext
+
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + \
+        struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def encode_png(img, bits=None):
+    """
+    PNG of a (height, width) grey or (height, width, 3) RGB array,
+    uint8 or uint16 samples. uint16 samples of fewer bits (e.g. 10)
+    are scaled to 16 bits, with an sBIT chunk for the original depth.
+    """
+    h, w = img.shape[:2]
+    channels = img.shape[2] if img.ndim == 3 else 1
+    depth = 16 if img.dtype.itemsize == 2 else 8
+    bits = bits or depth
+    sbit = ''
+    if depth == 16 and bits < 16:
+        img = rgb.scale16(img, bits)
+        sbit = _png_chunk('sBIT', chr(bits) * channels)
+    rows = np.zeros((h, 1 + w * channels * depth / 8), dtype=np.uint8)
+    rows[:, 1:] = img.astype('>u%d' % (depth / 8)).view(np.uint8).reshape(h, -1)
+    ihdr = struct.pack('>IIBBBBB', w, h, depth, 2 if channels == 3 else 0,
+                       0, 0, 0)
+    return PNG_MAGIC + _png_chunk('IHDR', ihdr) + sbit + \
+        _png_chunk('IDAT', zlib.compress(rows.tostring(), PNG_LEVEL)) + \
+        _png_chunk('IEND', '')
+
+
+def encode_pnm(img, maxval=255):
+    """
+    Binary PPM of an RGB array or PGM of a grey one
+    """
+    h, w = img.shape[:2]
+    magic = 'P6' if img.ndim == 3 else 'P5'
+    data = img.astype('>u2' if maxval > 255 else np.uint8).tostring()
+    return '%s\n%d %d\n%d\n' % (magic, w, h, maxval) + data
+
+
+def write_image(fname, img, maxval=255):
+    """
+    Write img as the type given by the extension of fname, samples
+    range 0..maxval
+    """
+    kind = image_type(fname)
+    if kind == 'png':
+        data = encode_png(img, maxval.bit_length())
+    else:
+        data = encode_pnm(img, maxval)
+    with open(fname, 'wb') as fd:
+        fd.write(data)
+
+
+def parse_frames(spec, n):
+    """
+    Frame numbers from a frame list of a file with n frames, e.g.
+    '0-99:10,150,200-', see edit.parse()
+    """
+    return [i for f, i in edit.parse(spec, [n])]
+
+
+def worst(table, column='psnr_y', n=10):
+    """
+    Frames with the n lowest values of column in a metrics table,
+    worst first. Identical frames (nan) are never among them.
+    """
+    values = table[column]
+    ok = np.flatnonzero(np.isfinite(values))
+    order = ok[np.argsort(values[ok], kind='mergesort')][:n]
+    return table['frame'][order].tolist()
+
+
+def _shrink(p, fy, fx):
+    """
+    Box filter p down by fy x fx, a partial last block is dropped
+    """
+    if fy == fx == 1:
+        return p
+    h = p.shape[0] / fy * fy
+    w = p.shape[1] / fx * fx
+    blocks = p[:h, :w].reshape(h / fy, fy, w / fx, fx)
+    return (blocks.sum(axis=(1, 3), dtype=np.int) + fy * fx / 2) / (fy * fx)
+
+
+class Exporter(object):
+    """
+    Converts frames of yuv.filename to images and thumbnails, one
+    Matrix for all of them
+    """
+    def __init__(self, yuv, matrix='601', full_range=False):
+        self.fmt = yuv.reader
+        self.matrix = rgb.Matrix(matrix, full_range, self.fmt.bits)
+        self.dtype = np.uint8 if self.fmt.bits <= 8 else np.uint16
+
+    def planes(self, frame):
+        shift = self.fmt.shift
+        return [p >> shift if shift else p for p in frame.planes]
+
+    def image(self, frame, grey=False):
+        """
+        RGB array of a frame, or its luma when grey
+        """
+        yy, cb, cr = self.planes(frame)
+        if grey:
+            return yy.astype(self.dtype)
+        return rgb.ycbcr2rgb(yy, cb, cr, self.fmt.chroma_div,
+                             bits=self.fmt.bits, m=self.matrix)
+
+    def thumbnail(self, frame, scale):
+        """
+        RGB array of a frame reduced by scale. Chroma is reduced to
+        the thumbnail size directly when scale allows it.
+        """
+        d = self.fmt.chroma_div
+        yy, cb, cr = self.planes(frame)
+        if scale % d.width or scale % d.height:
+            img = self.image(frame)
+            return np.dstack([_shrink(img[..., k], scale, scale)
+                              for k in xrange(3)]).astype(self.dtype)
+        yy = _shrink(yy, scale, scale)
+        cb, cr = [_shrink(c, scale / d.height, scale / d.width)[
+            :yy.shape[0], :yy.shape[1]] for c in (cb, cr)]
+        return rgb.ycbcr2rgb(yy, cb, cr, ChromaDiv(1, 1),
+                             bits=self.fmt.bits, m=self.matrix)
+
+
+def export(yuv, frames, pattern=None, sheet=None, scale=8, columns=8,
+           matrix='601', full_range=False, workers=None):
+    """
+    Write frames (indices) of yuv.filename to pattern % index, and/or
+    a contact sheet of their thumbnails to sheet. Return the names of
+    the images written.
+    """
+    if pattern is not None and '%' not in pattern:
+        raise ValueError('%s: no %%d for the frame number' % pattern)
+    if not frames:
+        return []
+    exporter = Exporter(yuv, matrix, full_range)
+    grey = pattern is not None and image_type(pattern) == 'pgm'
+    maxval = (1 << yuv.reader.bits) - 1
+    if sheet is not None:
+        image_type(sheet)
+        th, tw = yuv.height / scale, yuv.width / scale
+        rows = (len(frames) + columns - 1) / columns
+        canvas = np.zeros((rows * th, min(len(frames), columns) * tw, 3),
+                          dtype=exporter.dtype)
+
+    with yuv.map() as reader:
+        def job(i):
+            frame = reader.read(i)
+            fname = None
+            if pattern is not None:
+                fname = pattern % i
+                write_image(fname, exporter.image(frame, grey), maxval)
+            thumb = None
+            if sheet is not None:
+                thumb = exporter.thumbnail(frame, scale)
+            return fname, thumb
+
+        names = []
+        pool = ThreadPool(workers)
+        try:
+            progress = yuv.progress.run(len(frames), 'export')
+            for k, (fname, thumb) in enumerate(pool.imap(job, frames)):
+                if fname is not None:
+                    names.append(fname)
+                if thumb is not None:
+                    r, c = divmod(k, columns)
+                    canvas[r * th:(r + 1) * th, c * tw:(c + 1) * tw] = \
+                        thumb[:th, :tw]
+                progress.update()
+            progress.finish()
+        finally:
+            pool.close()
+            pool.join()
+
+    if sheet is not None:
+        write_image(sheet, canvas, maxval)
+        names.append(sheet)
+    return names
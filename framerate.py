@@ -0,0 +1,105 @@
+"""
+Rational framerate conversion, see 'ycbcr.py fr'.
+
+Output frame k is shown at time k / fout and lies at position
+p = k * fin / fout of the input, computed exactly with integers.
+
+    drop/repeat - input frame floor(p), frames are copied as they are
+    blend       - frames floor(p) and floor(p) + 1 mixed linearly by
+                  the fraction of p, in 8-bit fixed point
+
+The schedule of all output frames is computed up front, as arrays,
+so any range of the output can be produced independently. Only the
+frames the schedule refers to are read. Blends are computed on whole
+frames (raw samples, padding included), a batch of output frames at a
+time, in 16- or 32-bit integers, in a pool of threads for longer
+outputs. Copies are written straight from the memory map.
+"""
+
+from fractions import Fraction
+
+from ycbcr import LazyModule
+
+np = LazyModule('numpy')
+
+WEIGHT_BITS = 8
+ONE = 1 << WEIGHT_BITS
+
+BATCH = 8    # output frames per blend batch
+POOL_BATCHES = 4    # blends of more batches than this run in threads
+
+
+def parse_rate(s):
+    """
+    Framerate as a Fraction from '25', '29.97', '30000/1001' or the
+    y4m style '30000:1001'
+    """
+    try:
+        rate = Fraction(str(s).replace(':', '/'))
+    except (ValueError, ZeroDivisionError):
+        raise ValueError('bad framerate "%s"' % s)
+    if rate <= 0:
+        raise ValueError('bad framerate "%s"' % s)
+    return rate
+
+
+def format_rate(rate):
+    """
+    '24', '29.97' ... for file names
+    """
+    if rate.denominator == 1:
+        return '%d' % rate.numerator
+    return '%g' % float(rate)
+
+
+def output_count(n_in, fin, fout):
+    """
+    Number of output frames for n_in input frames, all of those whose
+    position falls within the input
+    """
+    num = n_in * fout.numerator * fin.denominator
+    den = fout.denominator * fin.numerator
+    return -(-num // den)
+
+
+def schedule(fin, fout, start, stop, blend=False, n_in=None):
+    """
+    (src, weight) int arrays for output frames start..stop-1. Output
+    frame k is (ONE - weight) * src + weight * (src + 1), weight is 0
+    (a copy of src) unless blending. src is always below n_in, past
+    the last input frame there is nothing to blend with.
+    """
+    k = np.arange(start, stop, dtype=np.int64)
+    num = k * (fin.numerator * fout.denominator)
+    den = fin.denominator * fout.numerator
+    src = num // den
+    if not blend:
+        return src, np.zeros_like(src)
+    weight = ((num % den) * ONE + den // 2) // den
+    # rounded up to all of src + 1: copy that, if it is known to exist,
+    # otherwise blending at weight ONE gives the same
+    carry = weight == ONE
+    if n_in is None:
+        carry[:] = False
+    else:
+        carry &= src + 1 < n_in
+    src[carry] += 1
+    weight[carry] = 0
+    if n_in is not None:
+        weight[src >= n_in - 1] = 0
+    return src, weight
+
+
+def blend(a, b, weight, fmt):
+    """
+    Mix raw frames a and b (arrays of uint8, one row per frame), per
+    row weight/ONE of b, for the samples of format fmt
+    """
+    dtype = '<u%d' % fmt.container
+    wide = np.uint16 if fmt.container == 1 else np.uint32
+    a = a.view(dtype) >> fmt.shift
+    b = b.view(dtype) >> fmt.shift
+    w = weight.reshape(-1, 1).astype(wide)
+    out = (a.astype(wide) * (ONE - w) + b.astype(wide) * w +
+           (ONE >> 1)) >> WEIGHT_BITS
+    return (out.astype(dtype) << fmt.shift).view(np.uint8)
@@ -13,18 +13,96 @@ import wx
 import re
 import numpy as np
 
-from ycbcr import YCbCr
+from ycbcr import YCbCr, FrameCache, FORMATS, block_sse, block_counts, \
+    block_psnr
+from jobs import submit
+from lod import LODLine
+import store
 
 # The recommended way to use wx with mpl is with the WXAgg
 # backend.
 import matplotlib
 matplotlib.use('WXAgg')
+from matplotlib import cm
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_wxagg import \
     FigureCanvasWxAgg as FigCanvas, \
     NavigationToolbar2WxAgg as NavigationToolbar
 
 
+class InspectorFrame(wx.Frame):
+    """
+    Reference, distorted and diff luma of the picked frame, plus a
+    heatmap of the luma PSNR per block
+    """
+    title = 'Frame inspector'
+
+    def __init__(self, parent, block=16):
+        wx.Frame.__init__(self, parent, -1, self.title)
+
+        self.block = block
+        self.fig = Figure((16.0, 3.5), dpi=100)
+        self.canvas = FigCanvas(self, -1, self.fig)
+        self.axes = []
+        titles = ['reference', 'distorted', 'diff',
+                  'PSNR %dx%d' % (block, block)]
+        for i, t in enumerate(titles):
+            ax = self.fig.add_subplot(1, 4, i + 1)
+            ax.set_title(t)
+            ax.get_xaxis().set_visible(False)
+            ax.get_yaxis().set_visible(False)
+            self.axes.append(ax)
+        self.images = None
+        self.heatmap = None
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.canvas, 1, wx.LEFT | wx.TOP | wx.GROW)
+        self.SetSizer(sizer)
+        self.Fit()
+
+        # closing only hides, the parent owns the window
+        self.Bind(wx.EVT_CLOSE, lambda event: self.Hide())
+
+    def show_frames(self, index, ref, dist):
+        """
+        Display Frames ref and dist and their diff (as in YCbCr.diff),
+        in the sample range of their format
+        """
+        fmt = FORMATS[ref.yuv_format]
+        vmax = (1 << fmt.bits) - 1
+        yy1, yy2 = ref.yy >> fmt.shift, dist.yy >> fmt.shift
+        diff = np.clip((1 << (fmt.bits - 1)) -
+                       np.abs(yy1.astype(np.int) - yy2), 0, vmax)
+        planes = (yy1, yy2, diff)
+
+        if self.images is None or \
+                self.images[0].get_array().shape != ref.yy.shape or \
+                self.images[0].get_clim() != (0, vmax):
+            self.images = [ax.imshow(p, cmap=cm.gray, vmin=0, vmax=vmax,
+                                     interpolation='nearest')
+                           for ax, p in zip(self.axes, planes)]
+        else:
+            for im, p in zip(self.images, planes):
+                im.set_data(p)
+
+        # red is bad, identical blocks (nan) are left blank
+        h, w = ref.yy.shape
+        psnr = block_psnr(block_sse(ref.yy, dist.yy, self.block, self.block),
+                          block_counts(h, w, self.block, self.block),
+                          ref.peak)
+        if self.heatmap is None or self.heatmap.get_array().shape != psnr.shape:
+            self.heatmap = self.axes[3].imshow(
+                psnr, cmap=cm.RdYlGn, vmin=20, vmax=50,
+                interpolation='nearest', extent=(0, w, h, 0))
+            self.fig.colorbar(self.heatmap, ax=self.axes[3])
+        else:
+            self.heatmap.set_data(psnr)
+
+        self.SetTitle('%s - frame %d' % (self.title, index))
+        self.canvas.draw_idle()
+        self.Show()
+
+
 class CalcFrame(wx.Frame):
     """
     The main frame of the application
@@ -48,8 +126,25 @@ class CalcFrame(wx.Frame):
                 'psnr-v': 2,
                 'psnr-bd': 3 }
 
+        # algo_map column -> metrics store column
+        self.store_columns = {
+                0: 'psnr_y',
+                1: 'psnr_cb',
+                2: 'psnr_cr',
+                3: 'psnr_bd',
+                None: 'ssim' }
+
         self.yuv_format_list = ['YV12', 'IYUV', 'UYVY', 'YVYU', 'YUY2']
 
+        # Calculation runs in a worker, results are picked up and
+        # plotted by a timer, i.e. redraw at most every redraw_ms
+        self.job = None
+        self.caches = None       # (reference, distorted) FrameCache
+        self.inspector = None
+        self.redraw_ms = 250
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+
         self.create_menu()
         self.create_status_bar()
         self.create_main_panel()
@@ -58,6 +153,9 @@ class CalcFrame(wx.Frame):
         self.menubar = wx.MenuBar()
 
         menu_file = wx.Menu()
+        m_load = menu_file.Append(-1, "&Load metrics\tCtrl-O",
+                                  "Plot a metrics store, no recalculation")
+        self.Bind(wx.EVT_MENU, self.on_load_metrics, m_load)
         m_expt = menu_file.Append(-1, "&Save plot\tCtrl-S", "Save plot to file")
         self.Bind(wx.EVT_MENU, self.on_save_plot, m_expt)
         menu_file.AppendSeparator()
@@ -134,9 +232,12 @@ class CalcFrame(wx.Frame):
         self.b_load_f1 = wx.Button(self.panel, -1, "Load...")
         self.b_load_f2 = wx.Button(self.panel, -1, "Load...")
         self.b_calc = wx.Button(self.panel, -1, "CALC")
+        self.b_cancel = wx.Button(self.panel, -1, "CANCEL")
+        self.b_cancel.Disable()
         self.Bind(wx.EVT_BUTTON, self.on_b_load_f1, self.b_load_f1)
         self.Bind(wx.EVT_BUTTON, self.on_b_load_f2, self.b_load_f2)
         self.Bind(wx.EVT_BUTTON, self.on_b_calc, self.b_calc)
+        self.Bind(wx.EVT_BUTTON, self.on_b_cancel, self.b_cancel)
 
         self.cb_grid = wx.CheckBox(self.panel, -1, "Show Grid",
                                    style=wx.ALIGN_RIGHT)
@@ -171,6 +272,7 @@ class CalcFrame(wx.Frame):
 
         self.hbox3 = wx.BoxSizer(wx.HORIZONTAL)
         self.hbox3.Add(self.b_calc, 0, border=3, flag=flags)
+        self.hbox3.Add(self.b_cancel, 0, border=3, flag=flags)
 
         self.vbox.Add(self.hbox1, 0, flag = wx.ALIGN_LEFT | wx.TOP)
         self.vbox.Add(self.hbox2, 0, flag = wx.ALIGN_LEFT | wx.TOP)
@@ -215,51 +317,101 @@ class CalcFrame(wx.Frame):
             print 'faulty size'
             raise TypeError
 
+        if self.job is not None:
+            self.job.cancel()
+
         y = YCbCr(width=int(w), height=int(h), filename=f1,
-                  yuv_format_in=f, filename_diff=f2, num=20)
-
-        if 'psnr' in a:
-            psnr = [p for p in y.psnr()][:-2]
-            if a != 'psnr-all':
-                ind = np.arange(len(psnr))  # the x locations for the groups
-                self.axes.clear()
-                self.axes.plot(ind, [i[self.algo_map[a]] for i in psnr],
-                               'o-', picker=5)
-
-                self.axes.set_title(os.path.basename(f1) + ' ' + a)
-                self.axes.set_ylabel('dB')
-                self.axes.set_xlabel('frame')
-
-                self.canvas.draw()
-
-            elif a == 'psnr-all':
-                ind = np.arange(len(psnr))  # the x locations for the groups
-                self.axes.clear()
-                self.axes.plot(ind, [i[0] for i in psnr], 'ko-', label='Y', picker=5)
-                self.axes.plot(ind, [i[1] for i in psnr], 'bo-', label='Cb', picker=5)
-                self.axes.plot(ind, [i[2] for i in psnr], 'ro-', label='Cr', picker=5)
-                self.axes.plot(ind, [i[3] for i in psnr], 'mo-', label='BD', picker=5)
-
-                self.axes.set_title(os.path.basename(f1) + ' ' + a)
-                self.axes.legend()
-                self.axes.set_ylabel('dB')
-                self.axes.set_xlabel('frame')
-
-                self.canvas.draw()
-
-        elif 'ssim' in a:
-            ssim = [s for s in y.ssim()][:-2]
-            ind = np.arange(len(ssim))  # the x locations for the groups
-            self.axes.clear()
-            self.axes.plot(ind, ssim, 'o-', picker=5)
-
-            self.axes.set_title(os.path.basename(f1) + ' ' + a)
-            self.axes.set_ylabel('index')
-            self.axes.set_xlabel('frame')
-
-            self.canvas.draw()
+                  yuv_format_in=f, filename_diff=f2)
+
+        self.num_frames = y.num_frames
+
+        # decoded frames for the inspector, 2x256MB
+        if self.caches is not None:
+            for c in self.caches:
+                c.close()
+        self.caches = (FrameCache(y), FrameCache(y, f2))
+        self.frames = []     # per-frame results received so far
+        self.summary = False # True once the per-frame results are done
+        self.average = None
+
+        self.create_lines(a, f1)
+        self.canvas.draw()
+
+        self.job = submit(y, 'ssim' if 'ssim' in a else 'psnr', maxsize=4096)
+        self.b_cancel.Enable()
+        self.timer.Start(self.redraw_ms)
+
+    def create_lines(self, a, f1):
+        """
+        Empty curves for algorithm a
+        """
+        self.axes.clear()
+        if a == 'psnr-all':
+            self.lines = [
+                LODLine(self.axes, [], 'ko-', label='Y', picker=5),
+                LODLine(self.axes, [], 'bo-', label='Cb', picker=5),
+                LODLine(self.axes, [], 'ro-', label='Cr', picker=5),
+                LODLine(self.axes, [], 'mo-', label='BD', picker=5)]
+            self.columns = [0, 1, 2, 3]
+            self.axes.legend()
         else:
-            print '~tilt'
+            self.lines = [LODLine(self.axes, [], 'o-', picker=5)]
+            self.columns = [self.algo_map.get(a)]
+
+        self.axes.set_title(os.path.basename(f1) + ' ' + a)
+        self.axes.set_ylabel('index' if 'ssim' in a else 'dB')
+        self.axes.set_xlabel('frame')
+        self.axes.grid(self.cb_grid.IsChecked())
+
+    def on_b_cancel(self, event):
+        """
+        Stop the calculation, keep what has been plotted
+        """
+        if self.job is not None:
+            self.job.cancel()
+
+    def on_timer(self, event):
+        """
+        Collect the results produced since the last tick and redraw
+        """
+        job = self.job
+        finished = job.done()    # before poll(), nothing can be missed
+
+        new = []
+        for item in job.poll():
+            if self.summary:
+                self.average = item
+            elif isinstance(item, (list, tuple)) and '-' in item or item == '--':
+                self.summary = True
+            else:
+                new.append(item)
+        self.frames.extend(new)
+
+        # the curves are rendered at the level of detail of the zoom,
+        # picking still resolves to single frames. Only the new frames
+        # are added to the pyramids.
+        if new:
+            for line, col in zip(self.lines, self.columns):
+                if col is None:
+                    line.extend(new)
+                else:
+                    line.extend([i[col] for i in new])
+            self.canvas.draw_idle()
+
+        msg = 'frame %d/%d' % (len(self.frames), self.num_frames)
+        if finished:
+            self.timer.Stop()
+            self.b_cancel.Disable()
+            self.job = None
+            try:
+                job.result(0)
+            except Exception as e:
+                msg += ' failed: %s' % e
+            if job.cancelled():
+                msg += ' cancelled'
+            elif self.average is not None:
+                msg += ' average: %s' % self.average
+        self.statusbar.SetStatusText(msg)
 
     def on_cb_grid(self, event):
         """
@@ -277,13 +429,23 @@ class CalcFrame(wx.Frame):
         only a small amount here.
         """
         #box_points = event.artist.get_bbox().get_points()
-        thisline = event.artist
-        xdata, ydata = thisline.get_data()
-        ind = event.ind
+        lines = [l for l in self.lines if l.line is event.artist]
+        if not lines:
+            return
+        index, value = lines[0].pick(event)
 
-        msg = 'x:%d y:%.4f' % (xdata[ind], ydata[ind])
+        msg = 'x:%d y:%.4f' % (index, value)
         self.statusbar.SetStatusText(msg)
 
+        # Show the frames behind the point, random access via the caches
+        if self.caches is None:
+            return
+        ref = self.caches[0].get(index)
+        dist = self.caches[1].get(index)
+        if self.inspector is None:
+            self.inspector = InspectorFrame(self)
+        self.inspector.show_frames(index, ref, dist)
+
 #        msg = "data"
 #
 #        dlg = wx.MessageDialog(
@@ -314,6 +476,55 @@ class CalcFrame(wx.Frame):
             self.canvas.print_figure(path, dpi=self.dpi)
             self.flash_status_message("Saved to %s" % path)
 
+    def on_load_metrics(self, event):
+        """
+        Plot a store written by 'ycbcr.py metrics'. The frames are
+        still inspectable if the sequences are where they were.
+        """
+        dlg = wx.FileDialog(self, "Choose a metrics store", os.getcwd(), "",
+                            "*.npz", wx.OPEN)
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        path = dlg.GetPath()
+        dlg.Destroy()
+
+        if self.job is not None:
+            # the timer would keep plotting its results
+            self.timer.Stop()
+            self.b_cancel.Disable()
+            self.job.cancel()
+            self.job = None
+        table, meta = store.load(path)
+        f1 = meta['reference']['path']
+        f2 = meta['distorted']['path']
+        a = self.algo.GetValue()
+        if a not in self.algo_list:
+            a = 'psnr-y'
+        if a == 'ssim' and not meta['ssim']:
+            a = 'psnr-y'
+
+        self.t_load_f1.SetValue(f1)
+        self.t_load_f2.SetValue(f2)
+        self.t_size.SetValue('%dx%d' % (meta['width'], meta['height']))
+        self.yuv_format.SetValue(meta['yuv_format'])
+        self.algo.SetValue(a)
+
+        if self.caches is not None:
+            for c in self.caches:
+                c.close()
+            self.caches = None
+        if os.path.isfile(f1) and os.path.isfile(f2):
+            y = YCbCr(width=meta['width'], height=meta['height'], filename=f1,
+                      yuv_format_in=meta['yuv_format'], filename_diff=f2)
+            self.caches = (FrameCache(y), FrameCache(y, f2))
+
+        self.create_lines(a, f1)
+        for line, col in zip(self.lines, self.columns):
+            line.set_values(table[self.store_columns[col]])
+        self.canvas.draw_idle()
+        self.statusbar.SetStatusText('%d frames from %s' % (len(table), path))
+
     def on_b_load_f1(self, event):
         """ Open a file"""
         dirname = os.getcwd()
@@ -344,6 +555,12 @@ class CalcFrame(wx.Frame):
         dlg.Destroy()
 
     def on_exit(self, event):
+        if self.job is not None:
+            self.job.cancel()
+        if self.caches is not None:
+            for c in self.caches:
+                c.close()
+        self.timer.Stop()
         self.Destroy()
 
     def on_about(self, event):
@@ -0,0 +1,207 @@
+"""
+Per-frame content hash index.
+
+SHA-1 of every frame and of each of its planes, computed in one
+sequential pass over a memory map by a pool of threads (hashlib
+releases the GIL). The index is kept in a <file>.hash.npz sidecar and
+rebuilt only when the file, its geometry or its format changed.
+
+With the indexes of two sequences, equality, the first differing
+frame, repeated frames and frames missing from a copy are all found
+without reading pixel data again.
+"""
+
+import bisect
+import hashlib
+import os
+
+from multiprocessing.pool import ThreadPool
+
+from ycbcr import LazyModule, MappedReader, require_file
+import store
+
+np = LazyModule('numpy')
+
+VERSION = 2    # of the index, the file container is store.VERSION
+
+DTYPE = [
+    ('frame', '<u4'),
+    ('hash', 'S20'),
+    ('y', 'S20'), ('cb', 'S20'), ('cr', 'S20'),
+]
+
+
+def sidecar(fname):
+    """
+    Index name for a sequence
+    """
+    return fname + '.hash.npz'
+
+
+def _digest(a):
+    return hashlib.sha1(np.ascontiguousarray(a)).digest()
+
+
+def hash_frame(frame):
+    """
+    (frame, Y, Cb, Cr) SHA-1 digests of a Frame
+    """
+    return (_digest(frame.raw), _digest(frame.yy), _digest(frame.cb),
+            _digest(frame.cr))
+
+
+def _meta(yuv, fname):
+    """
+    Staleness key: the file and everything that decides where its
+    frames and planes lie (lists, as they come back from JSON)
+    """
+    st = os.stat(fname)
+    fmt = yuv.reader
+    return {
+        'version': store.VERSION,
+        'index_version': VERSION,
+        'path': os.path.abspath(fname),
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'width': yuv.width,
+        'height': yuv.height,
+        'yuv_format': yuv.yuv_format_in,
+        'planes': list(fmt.planes),
+        'chroma_div': list(fmt.chroma_div),
+        'bits': fmt.bits,
+        'shift': fmt.shift,
+        'container': fmt.container,
+        'pitch_align': fmt.pitch_align,
+        'height_align': fmt.height_align,
+        'frame_size': yuv.frame_size_in,
+    }
+
+
+def build(yuv, fname=None, workers=None, chunk=16):
+    """
+    Index of fname (default yuv.filename) as an array of DTYPE. All
+    complete frames in the file are indexed.
+    """
+    fname = fname or yuv.filename
+    with MappedReader(yuv, fname) as reader:
+        n = len(reader)
+        table = np.zeros(n, dtype=DTYPE)
+        table['frame'] = np.arange(n)
+
+        pool = ThreadPool(workers)
+        try:
+            progress = yuv.progress.run(n, 'index')
+            digests = pool.imap(lambda i: hash_frame(reader.read(i)),
+                                xrange(n), chunk)
+            for i, (h, y, cb, cr) in enumerate(digests):
+                table[i]['hash'] = h
+                table[i]['y'] = y
+                table[i]['cb'] = cb
+                table[i]['cr'] = cr
+                progress.update()
+            progress.finish()
+        finally:
+            pool.close()
+            pool.join()
+    return table
+
+
+def load(yuv, fname=None, workers=None, save=True):
+    """
+    Index of fname from its sidecar, (re)built and saved when missing
+    or stale. Return (table, built), built is True if it was hashed.
+    """
+    fname = fname or yuv.filename
+    require_file(fname)
+    meta = _meta(yuv, fname)
+    path = sidecar(fname)
+
+    if os.path.isfile(path):
+        try:
+            table, old = store.load(path, name='hashes')
+        except (IOError, ValueError, KeyError):
+            old = None
+        if old is not None:
+            old.pop('created', None)
+            if old == meta:
+                return table, False
+
+    table = build(yuv, fname, workers)
+    if save:
+        try:
+            store.save(path, table, dict(meta), name='hashes')
+        except IOError:
+            pass    # read-only location, use it this time only
+    return table, True
+
+
+def identical(a, b):
+    """
+    Boolean per frame, True where a and b are bit-exact. Only the
+    frames present in both are compared.
+    """
+    n = min(len(a), len(b))
+    return a['hash'][:n] == b['hash'][:n]
+
+
+def first_difference(a, b):
+    """
+    Index of the first frame that differs, None if a and b are the
+    same. A sequence that is a prefix of the other differs at the
+    end of the shorter one.
+    """
+    same = identical(a, b)
+    diff = np.flatnonzero(~same)
+    if len(diff):
+        return int(diff[0])
+    if len(a) != len(b):
+        return len(same)
+    return None
+
+
+def planes_differing(a, b, i):
+    """
+    Names of the planes that differ in frame i
+    """
+    return [p for p in ('y', 'cb', 'cr') if a[i][p] != b[i][p]]
+
+
+def repeats(a):
+    """
+    Frames identical to the frame before them
+    """
+    h = a['hash']
+    return [int(i) + 1 for i in np.flatnonzero(h[1:] == h[:-1])]
+
+
+def match(ref, dist):
+    """
+    For each frame of dist the index of an identical frame in ref,
+    -1 if there is none. Searched from the position of the previous
+    match, so repeated content maps to the expected occurrence.
+    """
+    where = {}
+    for i, h in enumerate(ref['hash']):
+        where.setdefault(h, []).append(i)
+
+    ret = np.empty(len(dist), dtype=np.int)
+    last = -1
+    for j, h in enumerate(dist['hash']):
+        cands = where.get(h, ())
+        k = bisect.bisect_right(cands, last)
+        if k < len(cands):
+            last = cands[k]
+            ret[j] = last
+        elif cands:
+            ret[j] = cands[-1]
+        else:
+            ret[j] = -1
+    return ret
+
+
+def dropped(ref, dist):
+    """
+    Frames of ref that do not occur in dist
+    """
+    found = set(match(ref, dist))
+    return [i for i in xrange(len(ref)) if i not in found]
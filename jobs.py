@@ -0,0 +1,203 @@
+"""
+Non-blocking metric and transform jobs.
+
+A Job runs one YCbCr-method (psnr, ssim, convert, crop, ...) in a
+worker thread, so the caller's event loop is never blocked. The numpy
+and scipy work releases the GIL, many jobs can run concurrently.
+
+    job = submit(yuv, 'psnr')
+    for result in job:        # blocking iteration, or
+        ...
+    results = job.poll()      # non-blocking, for timers/event loops
+
+Per-frame results are handed over through a bounded queue, a job that
+runs ahead of its consumer waits (backpressure). cancel() takes effect
+between two frames.
+"""
+
+import copy
+import sys
+import threading
+import types
+import Queue
+
+from progress import Progress
+
+
+class Cancelled(Exception):
+    """
+    Raised inside the worker when the job has been cancelled
+    """
+
+
+class _Watch(Progress):
+    """
+    Wraps the progress of the job's YCbCr. Every loop in YCbCr reports
+    each frame, which makes it the place to check for cancellation.
+    """
+    def __init__(self, job, inner):
+        self.job = job
+        self.inner = inner
+
+    def start(self, total=None, label=''):
+        self.inner.start(total, label)
+
+    def run(self, total=None, label=''):
+        return _Watch(self.job, self.inner.run(total, label))
+
+    def update(self, n=1):
+        if self.job.cancelled():
+            raise Cancelled()
+        self.inner.update(n)
+
+    def finish(self):
+        self.inner.finish()
+
+
+_DONE = object()
+
+
+class Job(object):
+    """
+    One method of a YCbCr running in a worker thread.
+    The YCbCr is shallow-copied, it can be shared between jobs.
+    """
+    def __init__(self, yuv, method, args=(), kwargs=None, maxsize=8):
+        self.method = method
+        self.value = None
+        self._exc_info = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._queue = Queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+        yuv = copy.copy(yuv)
+        yuv.progress = _Watch(self, yuv.progress)
+        func = getattr(yuv, method)
+
+        self._thread = threading.Thread(target=self._run,
+                                        args=(func, args, kwargs or {}))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            ret = func(*args, **kwargs)
+            if isinstance(ret, types.GeneratorType):
+                try:
+                    for item in ret:
+                        self._put(item)
+                finally:
+                    ret.close()
+            else:
+                self.value = ret
+        except Cancelled:
+            pass
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+            try:
+                self._queue.put_nowait(_DONE)
+            except Queue.Full:
+                pass    # consumer notices via _done
+            with self._lock:
+                callbacks, self._callbacks = self._callbacks, []
+            for cb in callbacks:
+                cb(self)
+
+    def _put(self, item):
+        """
+        Blocks while the queue is full, unless cancelled
+        """
+        while True:
+            if self._cancel.is_set():
+                raise Cancelled()
+            try:
+                self._queue.put(item, timeout=0.05)
+                return
+            except Queue.Full:
+                pass
+
+    def __iter__(self):
+        """
+        Blocking iteration over the per-frame results
+        """
+        while True:
+            try:
+                item = self._queue.get(timeout=0.05)
+            except Queue.Empty:
+                if self._done.is_set() and self._queue.empty():
+                    break
+                continue
+            if item is _DONE:
+                break
+            yield item
+        self._raise()
+
+    def poll(self):
+        """
+        Non-blocking, return the results available right now
+        """
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not _DONE:
+                items.append(item)
+        return items
+
+    def cancel(self):
+        """
+        Ask the worker to stop at the next frame boundary
+        """
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the worker, return True if it has finished
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the worker and return the method's return value.
+        Re-raises an exception from the worker.
+        """
+        if not self.wait(timeout):
+            raise RuntimeError('job %s still running' % self.method)
+        self._raise()
+        return self.value
+
+    def add_done_callback(self, fn):
+        """
+        fn(job) is called from the worker thread when the job has
+        finished, immediately if it already has
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _raise(self):
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+
+def submit(yuv, method, *args, **kwargs):
+    """
+    Start yuv.method(*args, **kwargs) in a worker, return the Job
+    """
+    maxsize = kwargs.pop('maxsize', 8)
+    return Job(yuv, method, args, kwargs, maxsize)
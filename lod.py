@@ -0,0 +1,219 @@
+"""
+Level-of-detail plotting of long per-frame metric curves.
+
+Pyramid keeps min/max/mean of a per-frame array at levels of 1, 2, 4,
+... frames per point. LODLine draws a curve on a matplotlib Axes at
+the level that matches the visible range: the mean as a line with the
+min/max envelope as a band. Zooming in re-renders with more detail,
+down to the individual frames. Picking always resolves to a frame of
+the full-resolution data.
+"""
+
+from ycbcr import LazyModule
+
+np = LazyModule('numpy')
+
+
+class Pyramid(object):
+    """
+    min/max/mean over blocks of 2**level frames. nan (identical frames
+    in PSNR) and inf are ignored by all three.
+
+    Frames can be appended with extend(), only the blocks they fall in
+    are recomputed. Storage grows by doubling, unused entries hold the
+    neutral nan, nan, 0, 0 so a partial block needs no special case.
+    """
+    def __init__(self, values=()):
+        self.n = 0
+        self._values = np.zeros(0)
+        self._levels = [self._empty(0)]
+        self.extend(values)
+
+    @staticmethod
+    def _empty(size):
+        return (np.full(size, np.nan), np.full(size, np.nan),
+                np.zeros(size), np.zeros(size, dtype=np.int))
+
+    def _grow(self, n):
+        """
+        Capacity for at least n frames, a power of two
+        """
+        cap = max(len(self._values), 1)
+        while cap < n:
+            cap *= 2
+        if cap == len(self._values):
+            return
+        values = np.full(cap, np.nan)
+        values[:self.n] = self._values[:self.n]
+        levels = []
+        for level in xrange(cap.bit_length()):
+            new = self._empty(cap >> level)
+            if level < len(self._levels):
+                for a, b in zip(new, self._levels[level]):
+                    a[:len(b)] = b
+            levels.append(new)
+        self._values = values
+        self._levels = levels
+
+    def extend(self, values):
+        """
+        Append frames
+        """
+        values = np.asarray(values, dtype=np.float)
+        i0, i1 = self.n, self.n + len(values)
+        if i1 == i0:
+            return
+        self._grow(i1)
+        self._values[i0:i1] = values
+
+        finite = np.isfinite(values)
+        mn, mx, s, c = self._levels[0]
+        mn[i0:i1] = mx[i0:i1] = np.where(finite, values, np.nan)
+        s[i0:i1] = np.where(finite, values, 0.0)
+        c[i0:i1] = finite
+
+        for prev, level in zip(self._levels, self._levels[1:]):
+            i0, i1 = i0 // 2, (i1 + 1) // 2
+            a = slice(2 * i0, 2 * i1, 2)
+            b = slice(2 * i0 + 1, 2 * i1, 2)
+            np.fmin(prev[0][a], prev[0][b], out=level[0][i0:i1])
+            np.fmax(prev[1][a], prev[1][b], out=level[1][i0:i1])
+            np.add(prev[2][a], prev[2][b], out=level[2][i0:i1])
+            np.add(prev[3][a], prev[3][b], out=level[3][i0:i1])
+        self.n += len(values)
+
+    @property
+    def values(self):
+        return self._values[:self.n]
+
+    @property
+    def levels(self):
+        """
+        (min, max, sum, count) per level, down to a single block
+        """
+        ret = []
+        size = self.n
+        for level in self._levels:
+            ret.append(tuple(a[:size] for a in level))
+            if size <= 1:
+                break
+            size = (size + 1) // 2
+        return ret
+
+    def __len__(self):
+        return self.n
+
+    def level_for(self, x0, x1, max_points):
+        """
+        Coarsest level needed to show frames x0..x1 with at most
+        max_points points
+        """
+        span = max(x1 - x0, 1)
+        level = 0
+        while level < len(self.levels) - 1 and span / 2.0 ** level > max_points:
+            level += 1
+        return level
+
+    def view(self, x0, x1, max_points=2000):
+        """
+        Return (x, min, max, mean, level) covering frames x0..x1.
+        x is the centre of each block.
+        """
+        level = self.level_for(x0, x1, max_points)
+        step = 2 ** level
+        mn, mx, s, c = self.levels[level]
+        i0 = max(int(x0) // step - 1, 0)
+        i1 = min(int(x1) // step + 2, len(mn))
+
+        x = np.arange(i0, i1) * step + (step - 1) / 2.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s[i0:i1] / c[i0:i1]
+        if level == 0:
+            mean = self.values[i0:i1]
+        return x, mn[i0:i1], mx[i0:i1], mean, level
+
+
+class LODLine(object):
+    """
+    One per-frame metric on a matplotlib Axes, re-rendered at the
+    right level of detail whenever the x-limits change
+    """
+    def __init__(self, axes, values, fmt='o-', max_points=2000, **kwargs):
+        self.axes = axes
+        self.max_points = max_points
+        self.line, = axes.plot([], [], fmt, **kwargs)
+        self.marker = self.line.get_marker()
+        self.band = None
+        self.busy = False
+        self.cid = axes.callbacks.connect('xlim_changed', self.update)
+        self.set_values(values)
+
+    def set_values(self, values):
+        """
+        New data, e.g. a stored table
+        """
+        self.pyramid = Pyramid(values)
+        self.update(full=True)
+
+    def extend(self, values):
+        """
+        More frames, e.g. from a running calculation
+        """
+        self.pyramid.extend(values)
+        self.update(full=True)
+
+    def update(self, axes=None, full=False):
+        """
+        Re-render for the current x-limits, or the whole curve
+        """
+        # adding the band autoscales, which changes the x-limits again
+        if self.busy:
+            return
+        self.busy = True
+        try:
+            self._render(full)
+        finally:
+            self.busy = False
+
+    def _render(self, full):
+        if full:
+            # the line starts out empty, grow the data limits ourselves
+            x, mn, mx, mean, level = self.pyramid.view(0, len(self.pyramid),
+                                                       self.max_points)
+            xy = np.concatenate([np.column_stack((x, y)) for y in (mean, mn, mx)])
+            xy = xy[np.isfinite(xy).all(axis=1)]
+            if len(xy):
+                self.axes.update_datalim(xy)
+                self.axes.autoscale_view()
+
+        x0, x1 = self.axes.get_xlim()
+        x, mn, mx, mean, level = self.pyramid.view(x0, x1, self.max_points)
+
+        self.line.set_data(x, mean)
+        self.line.set_marker(self.marker if level == 0 else '')
+
+        if self.band is not None:
+            self.band.remove()
+            self.band = None
+        if level > 0:
+            self.band = self.axes.fill_between(
+                x, mn, mx, color=self.line.get_color(), alpha=0.25,
+                linewidth=0)
+
+    def pick(self, event):
+        """
+        (frame, value) of the full-resolution data for a pick_event
+        on this line, the frame nearest to the mouse pointer
+        """
+        n = len(self.pyramid)
+        x = event.mouseevent.xdata
+        if x is None:
+            x = self.line.get_xdata()[event.ind[0]]
+        i = min(max(int(round(x)), 0), n - 1)
+        return i, self.pyramid.values[i]
+
+    def remove(self):
+        self.axes.callbacks.disconnect(self.cid)
+        self.line.remove()
+        if self.band is not None:
+            self.band.remove()
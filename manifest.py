@@ -0,0 +1,249 @@
+"""
+Manifest-driven batch comparison, see 'ycbcr.py batch'.
+
+A manifest lists reference/distorted pairs, as JSON
+
+    [{"reference": "ref.yuv", "distorted": "enc_qp22.yuv",
+      "width": 352, "height": 288, "format": "YV12",
+      "metrics": ["psnr", "ssim"]}, ...]
+
+or as CSV with the same column names (metrics separated by spaces).
+"output" is optional, the default is the distorted file's
+.metrics.npz sidecar.
+
+Pairs sharing a reference are handled together by one worker process,
+which reads each reference frame once for all its distorted files.
+Every pair ends up in its own metrics store (store.py), written
+atomically. Pairs whose store matches the current inputs are skipped,
+so an interrupted run resumes where it stopped.
+"""
+
+import csv
+import json
+import os
+import sys
+
+from multiprocessing import Pool
+
+from ycbcr import YCbCr, LazyModule, METRICS_DTYPE, metrics_row
+import store
+
+np = LazyModule('numpy')
+
+METRICS = ('psnr', 'ssim')
+
+
+def read(fname):
+    """
+    List of jobs (dicts) from a JSON or CSV manifest. Relative paths
+    are relative to the manifest.
+    """
+    with open(fname, 'rb') as fd:
+        if fname.lower().endswith('.csv'):
+            jobs = list(csv.DictReader(fd))
+        else:
+            jobs = json.load(fd)
+            if isinstance(jobs, dict):
+                jobs = jobs['jobs']
+
+    base = os.path.dirname(os.path.abspath(fname))
+    ret = []
+    for n, j in enumerate(jobs):
+        try:
+            metrics = j.get('metrics') or ['psnr']
+            if isinstance(metrics, basestring):
+                metrics = metrics.replace(',', ' ').split()
+            job = {
+                'reference': os.path.join(base, j['reference']),
+                'distorted': os.path.join(base, j['distorted']),
+                'width': int(j['width']),
+                'height': int(j['height']),
+                'format': j['format'],
+                'metrics': sorted(set(metrics)),
+            }
+        except (KeyError, ValueError) as e:
+            raise ValueError('%s: job %d: %s' % (fname, n, e))
+        for m in job['metrics']:
+            if m not in METRICS:
+                raise ValueError('%s: job %d: unknown metric "%s"' %
+                                 (fname, n, m))
+        job['output'] = os.path.join(base, j.get('output') or
+                                     store.sidecar(job['distorted']))
+        ret.append(job)
+    return ret
+
+
+def _yuv(job):
+    return YCbCr(width=job['width'], height=job['height'],
+                 filename=job['reference'], filename_diff=job['distorted'],
+                 yuv_format_in=job['format'])
+
+
+def _inputs(meta):
+    return (meta['reference']['size'], meta['reference']['mtime'],
+            meta['distorted']['size'], meta['distorted']['mtime'],
+            meta['width'], meta['height'], meta['yuv_format'])
+
+
+def done(job):
+    """
+    True if the job's store exists and was computed from the current
+    inputs with at least the requested metrics
+    """
+    if not os.path.isfile(job['output']):
+        return False
+    try:
+        table, meta = store.load(job['output'])
+    except (IOError, ValueError, KeyError):
+        return False
+
+    try:
+        ref = os.stat(job['reference'])
+        dist = os.stat(job['distorted'])
+    except OSError:
+        return False    # run it, the job reports the error
+    now = (ref.st_size, ref.st_mtime, dist.st_size, dist.st_mtime,
+           job['width'], job['height'], job['format'])
+    if _inputs(meta) != now:
+        return False
+    return meta['ssim'] or 'ssim' not in job['metrics']
+
+
+def groups(jobs, size=8):
+    """
+    Split jobs into groups that share a reference (and geometry),
+    at most size jobs each
+    """
+    by_ref = {}
+    for job in jobs:
+        key = (os.path.abspath(job['reference']), job['width'],
+               job['height'], job['format'])
+        by_ref.setdefault(key, []).append(job)
+
+    for key in sorted(by_ref):
+        group = by_ref[key]
+        for i in xrange(0, len(group), size):
+            yield group[i:i + size]
+
+
+def _error(e):
+    return '%s: %s' % (type(e).__name__, e)
+
+
+def run_group(group):
+    """
+    Runs in a worker process. Compute all jobs of a group, reading
+    each reference frame once. Return [(job, averages or error)], an
+    error fails only its own job (all of them for the reference).
+    """
+    yuvs = []
+    ret = []
+    for job in group:
+        try:
+            yuvs.append((job, _yuv(job)))
+        except Exception as e:
+            ret.append((job, _error(e)))
+    if not yuvs:
+        return ret
+
+    tables = [np.zeros(yuv.num_frames, dtype=METRICS_DTYPE)
+              for job, yuv in yuvs]
+    for t in tables:
+        t['ssim'] = np.nan
+    ssim = ['ssim' in job['metrics'] for job, yuv in yuvs]
+    errors = [None] * len(yuvs)
+    readers = [None] * len(yuvs)
+    n = max(len(t) for t in tables)
+
+    first = yuvs[0][1]
+    try:
+        for k, (job, yuv) in enumerate(yuvs):
+            try:
+                readers[k] = yuv.open(yuv.filename_diff)
+            except Exception as e:
+                errors[k] = _error(e)
+        with first.open() as ref:
+            for i in xrange(n):
+                live = [k for k in xrange(len(yuvs))
+                        if errors[k] is None and i < len(tables[k])]
+                if not live:
+                    break
+                frame1 = ref.read(i)
+                for k in live:
+                    try:
+                        metrics_row(tables[k][i], frame1, readers[k].read(i),
+                                    ssim[k])
+                    except Exception as e:
+                        errors[k] = _error(e)
+    except Exception as e:
+        # the reference failed, so did every job still running
+        errors = [err or _error(e) for err in errors]
+    finally:
+        for r in readers:
+            if r is not None:
+                r.close()
+
+    for (job, yuv), table, s, err in zip(yuvs, tables, ssim, errors):
+        if err is not None:
+            ret.append((job, err))
+            continue
+        try:
+            meta = store.make_meta(yuv, s)
+            meta['metrics'] = job['metrics']
+            tmp = job['output'] + '.tmp'
+            store.save(tmp, table, meta)
+            os.rename(tmp, job['output'])
+        except Exception as e:
+            ret.append((job, _error(e)))
+            continue
+        ret.append((job, averages(table)))
+    return ret
+
+
+def averages(table):
+    """
+    Mean of each PSNR/SSIM column
+    """
+    return dict((c, float(np.mean(table[c])) if len(table) else None)
+                for c in ('psnr_y', 'psnr_cb', 'psnr_cr', 'psnr_bd', 'ssim'))
+
+
+def run(jobs, workers=None, group_size=8, force=False, progress=None):
+    """
+    Compute all jobs not already done. Yields (job, averages) as the
+    groups complete, averages is an error message for failed jobs and
+    None for skipped ones.
+    """
+    todo = []
+    for job in jobs:
+        if not force and done(job):
+            yield job, None
+        else:
+            todo.append(job)
+    if not todo:
+        return
+
+    pending = list(groups(todo, group_size))
+    if progress is not None:
+        progress = progress.run(len(todo), 'batch')
+
+    if workers == 1:
+        results = (run_group(g) for g in pending)
+        pool = None
+    else:
+        pool = Pool(workers)
+        results = pool.imap_unordered(run_group, pending)
+    try:
+        for result in results:
+            for job, avg in result:
+                if progress is not None:
+                    progress.update()
+                yield job, avg
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if progress is not None:
+        progress.finish()
@@ -4,26 +4,26 @@ import sys
 from pylab import *
 import matplotlib.pyplot as plt
 import numpy
-from ycbcr import YCbCr
+from ycbcr import YCbCr, psnr_frame, ssim_plane
 
-def load_data(yuv, f):
-    for luma in yuv.get_luma(f): break
-    n = numpy.array(luma, dtype=numpy.uint8)
-    img = numpy.reshape(n, (Y.height, Y.width))
-
-    return img
+def load_frame(yuv, f, index):
+    """
+    Random access to one frame, nothing before it is read
+    """
+    with yuv.map(f) as reader:
+        return reader.read(index)
 
 def usage(me):
     """
     """
-    print "%s filename1, filename2 width height format" % me
+    print "%s filename1, filename2 width height format [frame]" % me
     sys.exit(0)
 
 if __name__ == '__main__':
 
     FMT = ['IYUV', 'UYVY', 'YV12', 'YVYU']
 
-    if len(sys.argv) != 6:
+    if len(sys.argv) not in (6, 7):
         usage(sys.argv[0])
 
     fname1 = sys.argv[1]
@@ -34,15 +34,18 @@ if __name__ == '__main__':
         fmt = sys.argv[5]
     else:
         usage(sys.argv[0])
+    index = int(sys.argv[6]) if len(sys.argv) == 7 else 0
 
     Y = YCbCr(width=w, height=h, filename=fname1,
               yuv_format_in=fmt, filename_diff=fname2)
 
-    data1 = load_data(Y, fname1)
-    data2 = load_data(Y, fname2)
+    frame1 = load_frame(Y, fname1, index)
+    frame2 = load_frame(Y, fname2, index)
+    data1 = frame1.yy
+    data2 = frame2.yy
 
-    psnr = Y.psnr().next()[0]
-    ssim = Y.ssim().next()
+    psnr = psnr_frame(frame1, frame2)[0]
+    ssim = ssim_plane(frame1.yy, frame2.yy, frame1.peak)
 
     # First subplot
     figure()
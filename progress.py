@@ -0,0 +1,172 @@
+"""
+Progress reporting for the per-frame loops in ycbcr.py.
+
+Output is rate-limited: update() is cheap and only every `interval`
+seconds something is written and flushed. The reporter given by
+get_progress() is a template, each operation counts on its own copy
+from run().
+
+    quiet - nothing at all
+    dots  - one '.' per processed frame, flushed at most every interval
+    bar   - single-line progress bar with frames/s and ETA, for a TTY
+    json  - one JSON object per line, for machine consumption
+"""
+
+import json
+import sys
+import time
+
+
+class Progress(object):
+    """
+    Base class, also the quiet reporter
+    """
+    def __init__(self, stream=None, interval=0.5):
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self.start()
+
+    def start(self, total=None, label=''):
+        """
+        Begin a new run of total frames (None if unknown)
+        """
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.t0 = time.time()
+        self.last = self.t0
+
+    def run(self, total=None, label=''):
+        """
+        A new reporter of the same kind and stream, started for one
+        operation, so operations running at the same time (threads,
+        a server) keep their own counts
+        """
+        progress = self.__class__(self.stream, self.interval)
+        progress.start(total, label)
+        return progress
+
+    def update(self, n=1):
+        """
+        n more frames processed
+        """
+        self.done += n
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.emit(now)
+
+    def finish(self):
+        """
+        Run completed
+        """
+        self.emit(time.time(), final=True)
+
+    def fps(self, now):
+        elapsed = now - self.t0
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, now):
+        """
+        Estimated seconds left, None if unknown
+        """
+        fps = self.fps(now)
+        if not self.total or not fps:
+            return None
+        return max(self.total - self.done, 0) / fps
+
+    def emit(self, now, final=False):
+        pass
+
+
+class Quiet(Progress):
+    """
+    No output
+    """
+    def update(self, n=1):
+        self.done += n
+
+    def finish(self):
+        pass
+
+
+class Dots(Progress):
+    """
+    Classic '.' per frame, but written in batches
+    """
+    def start(self, total=None, label=''):
+        Progress.start(self, total, label)
+        self.written = 0
+
+    def emit(self, now, final=False):
+        self.stream.write('.' * (self.done - self.written))
+        self.written = self.done
+        self.stream.flush()
+
+
+class Bar(Progress):
+    """
+    Single-line bar, redrawn in place
+    """
+    width = 30
+
+    def emit(self, now, final=False):
+        fps = self.fps(now)
+        eta = self.eta(now)
+        if self.total:
+            fill = self.width * min(self.done, self.total) / self.total
+            bar = '[' + '#' * fill + ' ' * (self.width - fill) + ']'
+            count = '%d/%d' % (self.done, self.total)
+        else:
+            bar = ''
+            count = '%d' % self.done
+        if final:
+            tail = '%.1fs' % (now - self.t0)
+        elif eta is not None:
+            tail = 'ETA %d:%02d' % divmod(int(eta), 60)
+        else:
+            tail = ''
+        line = '%s %s %s %.1f fps %s' % (self.label, bar, count, fps, tail)
+        self.stream.write('\r' + line.strip())
+        if final:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+class JsonLines(Progress):
+    """
+    One JSON record per emitted update
+    """
+    def emit(self, now, final=False):
+        record = {
+            'event': 'finish' if final else 'progress',
+            'label': self.label,
+            'done': self.done,
+            'total': self.total,
+            'elapsed': round(now - self.t0, 3),
+            'fps': round(self.fps(now), 3),
+            'eta': self.eta(now),
+        }
+        self.stream.write(json.dumps(record, sort_keys=True) + '\n')
+        self.stream.flush()
+
+
+MODES = {
+    'quiet': Quiet,
+    'dots': Dots,
+    'bar': Bar,
+    'json': JsonLines,
+}
+
+
+def get_progress(mode='auto', stream=None, interval=0.5):
+    """
+    Factory, 'auto' selects a bar on a TTY and dots otherwise
+    """
+    stream = stream if stream is not None else sys.stderr
+    if mode == 'auto':
+        isatty = getattr(stream, 'isatty', None)
+        mode = 'bar' if isatty and isatty() else 'dots'
+    if mode not in MODES:
+        raise NameError('Progress mode not supported! "%s"' % mode)
+    return MODES[mode](stream, interval)
@@ -0,0 +1,225 @@
+"""
+YCbCr <-> RGB conversion of whole planes.
+
+The matrices of BT.601, BT.709 and BT.2020 (non-constant luminance),
+for limited ('video', 16-235 at 8 bits) or full range YCbCr. RGB is
+always full range with the bit depth of the YCbCr format.
+
+Coefficients are scaled to fixed point once, per matrix, range and
+depth. A conversion is then three integer multiply-adds per output
+sample over int32 arrays, rounded and clipped, with no float math per
+pixel. Chroma is up-sampled (repeated) to luma size before the matrix,
+and averaged back down after it, with resample_plane().
+
+Raw RGB files are packed rows of RGB (or BGR) triplets, one byte per
+sample at 8 bits, 16-bit little endian above that: the rgb24/bgr24 and
+rgb48le/bgr48le of ffmpeg. 16-bit files use the full 16-bit range,
+e.g. 10-bit samples are scaled up when written and down when read.
+"""
+
+from ycbcr import (LazyModule, ChromaDiv, FORMATS, is_stream, open_stream,
+                   open_output, resample_plane)
+
+np = LazyModule('numpy')
+
+# Kr, Kb
+MATRICES = {
+    '601': (0.299, 0.114),
+    '709': (0.2126, 0.0722),
+    '2020': (0.2627, 0.0593),
+}
+
+ORDERS = ('rgb', 'bgr')
+
+SHIFT = 16    # fractional bits of the fixed-point coefficients
+
+FULL = ChromaDiv(1, 1)
+
+
+class Matrix(object):
+    """
+    Fixed-point coefficients for one matrix, range and bit depth.
+
+        forward - RGB -> YCbCr, 3x3 integers
+        inverse - YCbCr (offsets removed) -> RGB, 3x3 integers
+        offsets - Y, Cb, Cr offsets in samples
+    """
+    def __init__(self, matrix='601', full_range=False, bits=8):
+        try:
+            kr, kb = MATRICES[matrix]
+        except KeyError:
+            raise ValueError('unknown matrix "%s"' % matrix)
+        kg = 1 - kr - kb
+        m = np.array([
+            [kr, kg, kb],
+            [-kr / (2 * (1 - kb)), -kg / (2 * (1 - kb)), 0.5],
+            [0.5, -kg / (2 * (1 - kr)), -kb / (2 * (1 - kr))],
+        ])
+
+        peak = (1 << bits) - 1
+        scale = 1 << (bits - 8)
+        if full_range:
+            ys = cs = 1.0
+            y_off = 0
+        else:
+            ys = 219.0 * scale / peak
+            cs = 224.0 * scale / peak
+            y_off = 16 * scale
+        m *= [[ys], [cs], [cs]]
+
+        self.bits = bits
+        self.peak = peak
+        self.offsets = (y_off, 1 << (bits - 1), 1 << (bits - 1))
+        self.forward = np.round(m * (1 << SHIFT)).astype(int)
+        self.inverse = np.round(np.linalg.inv(m) * (1 << SHIFT)).astype(int)
+        # legal YCbCr range
+        self.low = 0 if full_range else y_off
+        self.ymax = peak if full_range else 235 * scale
+        self.cmax = peak if full_range else 240 * scale
+
+
+def _apply(coef, planes, offset, lo, hi):
+    """
+    sum(coef[j] * planes[j]) in fixed point, rounded, plus offset,
+    clipped to [lo, hi]. Zero coefficients are skipped.
+    """
+    acc = np.full(planes[0].shape, (offset << SHIFT) + (1 << (SHIFT - 1)),
+                  dtype=np.int32)
+    for c, p in zip(coef, planes):
+        if c:
+            acc += c * p
+    acc >>= SHIFT
+    return np.clip(acc, lo, hi, out=acc)
+
+
+def ycbcr2rgb(yy, cb, cr, chroma_div=ChromaDiv(2, 2), matrix='601',
+              full_range=False, bits=8, m=None):
+    """
+    (height, width, 3) RGB array from Y, Cb and Cr planes of bits
+    bits (no container shift), uint8 at 8 bits, uint16 above
+    """
+    m = m or Matrix(matrix, full_range, bits)
+    y_off, c_off, _ = m.offsets
+    src = (yy.astype(np.int32) - y_off,
+           (resample_plane(cb, chroma_div, FULL) - c_off).astype(np.int32),
+           (resample_plane(cr, chroma_div, FULL) - c_off).astype(np.int32))
+    dtype = np.uint8 if bits <= 8 else np.uint16
+    rgb = np.empty(yy.shape + (3,), dtype=dtype)
+    for k in xrange(3):
+        rgb[..., k] = _apply(m.inverse[k], src, 0, 0, m.peak)
+    return rgb
+
+
+def rgb2ycbcr(rgb, chroma_div=ChromaDiv(2, 2), matrix='601',
+              full_range=False, bits=8, m=None):
+    """
+    Y, Cb and Cr planes (int32, no container shift) from a
+    (height, width, 3) RGB array, chroma averaged down to chroma_div
+    """
+    m = m or Matrix(matrix, full_range, bits)
+    src = [rgb[..., k].astype(np.int32) for k in xrange(3)]
+    yy = _apply(m.forward[0], src, m.offsets[0], m.low, m.ymax)
+    cb, cr = [resample_plane(_apply(m.forward[k], src, m.offsets[k],
+                                    m.low, m.cmax), FULL, chroma_div)
+              for k in (1, 2)]
+    return yy, cb, cr
+
+
+def _sample_dtype(bits):
+    return np.dtype(np.uint8 if bits <= 8 else '<u2')
+
+
+def scale16(a, bits):
+    """
+    Samples of bits bits (9..16) scaled to the full 16-bit range, the
+    top bits repeated into the bottom
+    """
+    v = a.astype(np.uint16)
+    if bits >= 16:
+        return v
+    return (v << (16 - bits)) | (v >> (2 * bits - 16))
+
+
+def unscale16(a, bits):
+    """
+    16-bit samples to bits bits, rounded
+    """
+    if bits >= 16:
+        return a
+    peak = (1 << bits) - 1
+    return (a.astype(np.int32) * peak + 32767) // 65535
+
+
+def frame_size(width, height, bits=8):
+    """
+    Bytes per frame of a raw RGB file
+    """
+    return width * height * 3 * _sample_dtype(bits).itemsize
+
+
+def _order(rgb, order):
+    if order not in ORDERS:
+        raise ValueError('unknown sample order "%s"' % order)
+    return rgb[..., ::-1] if order == 'bgr' else rgb
+
+
+def export_rgb(yuv, matrix='601', full_range=False, order='rgb'):
+    """
+    Write all frames of yuv.filename as raw RGB to yuv.filename_out,
+    8-bit formats as rgb24, deeper ones as rgb48le
+    """
+    fmt = yuv.reader
+    m = Matrix(matrix, full_range, fmt.bits)
+    dtype = _sample_dtype(fmt.bits)
+    progress = yuv.progress.run(yuv.num_frames, 'rgb')
+    with yuv.open() as reader, open_output(yuv.filename_out) as fd:
+        for frame in reader:
+            yy, cb, cr = [p >> fmt.shift if fmt.shift else p
+                          for p in frame.planes]
+            rgb = ycbcr2rgb(yy, cb, cr, fmt.chroma_div, m=m, bits=fmt.bits)
+            if fmt.bits > 8:
+                rgb = scale16(rgb, fmt.bits)
+            _order(rgb, order).astype(dtype).tofile(fd)
+            progress.update()
+    progress.finish()
+
+
+def import_rgb(filename, width, height, yuv_format_out, filename_out,
+               matrix='601', full_range=False, order='rgb', num=None,
+               progress=None):
+    """
+    Convert a raw RGB file (or stream) to yuv_format_out, 8-bit RGB
+    for 8-bit formats, 16-bit for deeper ones. Return the number of
+    frames written.
+    """
+    fmt = FORMATS[yuv_format_out](width, height)
+    m = Matrix(matrix, full_range, fmt.bits)
+    dtype = _sample_dtype(fmt.bits)
+    size_in = frame_size(width, height, fmt.bits)
+    size_out = fmt.get_frame_size()
+
+    fd = open_stream(filename) if is_stream(filename) else \
+        open(filename, 'rb')
+    n = 0
+    if progress is not None:
+        progress = progress.run(num, 'rgb')
+    with fd, open_output(filename_out) as fd_out:
+        while num is None or n < num:
+            data = fd.read(size_in)
+            if len(data) != size_in:
+                break
+            rgb = np.frombuffer(data, dtype=dtype).reshape(height, width, 3)
+            if fmt.bits > 8:
+                rgb = unscale16(rgb, fmt.bits)
+            planes = rgb2ycbcr(_order(rgb, order), fmt.chroma_div, m=m,
+                               bits=fmt.bits)
+            out = np.zeros(size_out, dtype=np.uint8)
+            for view, plane in zip(fmt.get_planes(out), planes):
+                view[...] = plane << fmt.shift
+            out.tofile(fd_out)
+            n += 1
+            if progress is not None:
+                progress.update()
+    if progress is not None:
+        progress.finish()
+    return n
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+"""
+Long-running local metrics service around YCbCr.
+
+Sequences are kept memory-mapped in an LRU pool, so repeated queries
+over the same files neither re-import nor re-read anything. Per-frame
+results are cached, and concurrent requests for the same frame share
+one computation.
+
+All requests are GET with query parameters. Every sequence is given by
+file, width, height and format (ref/dist for the two-file metrics).
+
+    /psnr?ref=a.yuv&dist=b.yuv&width=352&height=288&format=YV12&start=0&stop=10
+    /ssim?ref=...&dist=...                      same parameters as psnr
+    /stats?file=a.yuv&width=...&frame=3         min/max/mean/std per plane
+    /crop?file=a.yuv&width=...&frame=3&rect=0,0,15,15
+                                                raw planar Y|Cb|Cr bytes
+    /pool                                       open sequences
+
+Serves HTTP on a TCP port, or on a Unix socket with --unix.
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import math
+import os
+import SocketServer
+import sys
+import threading
+import urlparse
+
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+from ycbcr import YCbCr, psnr_frame, ssim_plane
+
+
+Key = namedtuple('Key', 'path mtime size width height yuv_format')
+
+
+class Pool(object):
+    """
+    LRU pool of memory-mapped sequences. Readers are counted while in
+    use, one evicted while a request still reads it is closed when
+    that request is done.
+    """
+    def __init__(self, size=64):
+        self.size = size
+        self.lock = threading.Lock()
+        self.seqs = OrderedDict()
+        self.users = {}    # reader -> requests using it
+        self.evicted = set()
+
+    def key(self, fname, width, height, yuv_format):
+        path = os.path.abspath(fname)
+        st = os.stat(path)
+        return Key(path, st.st_mtime, st.st_size, width, height, yuv_format)
+
+    def get(self, fname, width, height, yuv_format):
+        """
+        Return (key, MappedReader), mapping the file if needed.
+        A file that changed on disk is mapped again. Every get() must
+        be followed by a release() of the reader, see use().
+        """
+        key = self.key(fname, width, height, yuv_format)
+        with self.lock:
+            if key in self.seqs:
+                reader = self.seqs.pop(key)
+                self.seqs[key] = reader
+                self.users[reader] += 1
+                return key, reader
+
+        yuv = YCbCr(width=width, height=height, filename=key.path,
+                    yuv_format_in=yuv_format)
+        reader = yuv.map()
+
+        with self.lock:
+            old = self.seqs.pop(key, None)
+            if old is not None:
+                self.__evict(old)    # mapped concurrently
+            self.seqs[key] = reader
+            self.users[reader] = 1
+            while len(self.seqs) > self.size:
+                self.__evict(self.seqs.popitem(last=False)[1])
+        return key, reader
+
+    def release(self, reader):
+        with self.lock:
+            self.users[reader] -= 1
+            if reader in self.evicted:
+                self.__evict(reader)
+
+    @contextmanager
+    def use(self, fname, width, height, yuv_format):
+        key, reader = self.get(fname, width, height, yuv_format)
+        try:
+            yield key, reader
+        finally:
+            self.release(reader)
+
+    def __evict(self, reader):
+        # called with the lock held
+        if self.users[reader]:
+            self.evicted.add(reader)
+            return
+        del self.users[reader]
+        self.evicted.discard(reader)
+        reader.close()
+
+    def keys(self):
+        with self.lock:
+            return list(self.seqs)
+
+
+class _Pending(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Batcher(object):
+    """
+    Bounded LRU of computed values. Concurrent requests for the same
+    key share one computation instead of each doing their own.
+    """
+    def __init__(self, size=1 << 20):
+        self.size = size
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+        self.pending = {}
+
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.values:
+                value = self.values.pop(key)
+                self.values[key] = value
+                return value
+            p = self.pending.get(key)
+            owner = p is None
+            if owner:
+                p = self.pending[key] = _Pending()
+
+        if not owner:
+            p.event.wait()
+            if p.error is not None:
+                raise p.error
+            return p.value
+
+        try:
+            p.value = compute()
+        except Exception as e:
+            p.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+                if p.error is None:
+                    self.values[key] = p.value
+                    while len(self.values) > self.size:
+                        self.values.popitem(last=False)
+            p.event.set()
+        return p.value
+
+
+def _finite(v):
+    """
+    v with nan and inf (identical frames) as None, which JSON has
+    """
+    if isinstance(v, (list, tuple)):
+        return [_finite(x) for x in v]
+    v = float(v)
+    return None if math.isinf(v) or math.isnan(v) else v
+
+
+class Service(object):
+    """
+    The queries, independent of the transport
+    """
+    def __init__(self, pool_size=64, cache_size=1 << 20):
+        self.pool = Pool(pool_size)
+        self.cache = Batcher(cache_size)
+
+    def _seq(self, q, name='file'):
+        return self.pool.use(q[name], int(q['width']), int(q['height']),
+                             q['format'])
+
+    def _range(self, q, n):
+        start = int(q.get('start', 0))
+        stop = min(int(q.get('stop', n)), n)
+        if not 0 <= start < max(n, 1):
+            raise IndexError('start %d out of range, %d frames' % (start, n))
+        return xrange(start, stop)
+
+    def _metric(self, q, name, func):
+        with self._seq(q, 'ref') as (k1, r1), \
+                self._seq(q, 'dist') as (k2, r2):
+            frames = self._range(q, min(len(r1), len(r2)))
+            values = [self.cache.get((name, k1, k2, i),
+                                     lambda i=i: func(r1.read(i), r2.read(i)))
+                      for i in frames]
+        return {'frames': list(frames), 'values': _finite(values)}
+
+    def psnr(self, q):
+        return self._metric(q, 'psnr', psnr_frame)
+
+    def ssim(self, q):
+        return self._metric(q, 'ssim', lambda f1, f2: ssim_plane(f1.yy, f2.yy, f1.peak))
+
+    def stats(self, q):
+        def compute(reader, i):
+            frame = reader.read(i)
+            return [{'min': int(p.min()), 'max': int(p.max()),
+                     'mean': float(p.mean()), 'std': float(p.std())}
+                    for p in frame.planes]
+
+        with self._seq(q) as (key, reader):
+            frames = self._range(q, len(reader))
+            if 'frame' in q:
+                frames = [int(q['frame'])]
+            values = [self.cache.get(('stats', key, i),
+                                     lambda i=i: compute(reader, i))
+                      for i in frames]
+        return {'frames': list(frames),
+                'planes': ['Y', 'Cb', 'Cr'],
+                'values': values}
+
+    def crop(self, q):
+        """
+        Cropped planes of one frame, as raw planar bytes
+        """
+        with self._seq(q) as (key, reader):
+            frame = reader.read(int(q['frame']))
+            xs, ys, xe, ye = map(int, q['rect'].split(','))
+            d = reader.fmt.chroma_div
+            planes = [frame.yy[ys:ye + 1, xs:xe + 1],
+                      frame.cb[ys / d.height:ye / d.height + 1,
+                               xs / d.width:xe / d.width + 1],
+                      frame.cr[ys / d.height:ye / d.height + 1,
+                               xs / d.width:xe / d.width + 1]]
+            return ''.join(p.tostring() for p in planes)
+
+    def pool_info(self, q):
+        return {'sequences': [k._asdict() for k in self.pool.keys()]}
+
+    routes = {
+        '/psnr': 'psnr',
+        '/ssim': 'ssim',
+        '/stats': 'stats',
+        '/crop': 'crop',
+        '/pool': 'pool_info',
+    }
+
+    def handle(self, path, q):
+        """
+        (status, content type, body) for GET path?q, errors as 400
+        (bad query) or 404 (unknown query, missing file)
+        """
+        if path not in self.routes:
+            return 404, None, 'unknown query %s' % path
+        try:
+            ret = getattr(self, self.routes[path])(q)
+        except (KeyError, ValueError, IndexError, NameError) as e:
+            return 400, None, '%s: %s' % (type(e).__name__, e)
+        except (IOError, OSError) as e:
+            return 404, None, str(e)
+        if isinstance(ret, str):
+            return 200, 'application/octet-stream', ret
+        return 200, 'application/json', json.dumps(ret)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Maps GET /<query> onto Service
+    """
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        q = dict(urlparse.parse_qsl(url.query))
+        status, ctype, body = self.server.service.handle(url.path, q)
+        if status != 200:
+            return self.send_error(status, body)
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no (host, port)
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        sys.stderr.write("%s - - [%s] %s\n" % (self.address_string(),
+                                                self.log_date_time_string(),
+                                                format % args))
+
+
+class TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='YCbCr metrics server',
+        epilog='Be careful with those bits')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('--unix', type=str, default=None,
+                        help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--pool', type=int, default=64,
+                        help='max number of memory-mapped sequences')
+    parser.add_argument('--cache', type=int, default=1 << 20,
+                        help='max number of cached per-frame results')
+    args = parser.parse_args()
+
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        server = UnixServer(args.unix, Handler)
+        where = args.unix
+    else:
+        server = TCPServer((args.host, args.port), Handler)
+        where = '%s:%d' % (args.host, args.port)
+    server.service = Service(args.pool, args.cache)
+
+    print >> sys.stderr, "Serving on", where
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix:
+            os.unlink(args.unix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+Columnar per-frame metrics store.
+
+A store is an uncompressed .npz with two members:
+
+    metrics - structured array, one row per frame, see METRICS_DTYPE
+    meta    - JSON string: input files, geometry, format, parameters
+
+Loading memory-maps the metrics member straight out of the .npz, so
+opening even a 1M-frame result costs next to nothing; rows are paged
+in when used. Stores can be exported as CSV or JSON.
+"""
+
+import argparse
+import csv
+import json
+import os
+import struct
+import sys
+import time
+import zipfile
+
+from ycbcr import LazyModule, METRICS_DTYPE, is_stream
+
+np = LazyModule('numpy')
+
+VERSION = 1
+
+
+def sidecar(fname):
+    """
+    Default store name for a distorted sequence
+    """
+    return fname + '.metrics.npz'
+
+
+def make_meta(yuv, ssim=True):
+    """
+    Describe the inputs and parameters of a YCbCr.metrics() run
+    """
+    def describe(fname):
+        if is_stream(fname):
+            return {'path': fname, 'size': None, 'mtime': None}
+        st = os.stat(fname)
+        return {'path': os.path.abspath(fname), 'size': st.st_size,
+                'mtime': st.st_mtime}
+
+    return {
+        'version': VERSION,
+        'reference': describe(yuv.filename),
+        'distorted': describe(yuv.filename_diff),
+        'width': yuv.width,
+        'height': yuv.height,
+        'yuv_format': yuv.yuv_format_in,
+        'num_frames': yuv.num_frames,
+        'ssim': ssim,
+        'created': time.time(),
+    }
+
+
+def save(fname, table, meta, name='metrics'):
+    """
+    Write table (METRICS_DTYPE) and meta to fname. Other tables, e.g.
+    the hash index, are stored under another name.
+    """
+    with open(fname, 'wb') as fd:
+        np.savez(fd, meta=np.array(json.dumps(meta)), **{name: table})
+
+
+def _mmap_member(fname, name):
+    """
+    Memory-map an uncompressed .npy member of a .npz, None if that
+    is not possible
+    """
+    with zipfile.ZipFile(fname) as z:
+        info = z.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    fmt = np.lib.format
+    with open(fname, 'rb') as fd:
+        # local file header, fixed part is 30 bytes
+        fd.seek(info.header_offset)
+        header = fd.read(30)
+        n, m = struct.unpack('<HH', header[26:30])
+        fd.seek(info.header_offset + 30 + n + m)
+
+        version = fmt.read_magic(fd)
+        if version == (1, 0):
+            shape, fortran, dtype = fmt.read_array_header_1_0(fd)
+        else:
+            shape, fortran, dtype = fmt.read_array_header_2_0(fd)
+        offset = fd.tell()
+
+    if dtype.hasobject or not shape[0]:
+        return None
+    return np.memmap(fname, dtype=dtype, mode='r', shape=shape,
+                     offset=offset, order='F' if fortran else 'C')
+
+
+def load(fname, mmap=True, name='metrics'):
+    """
+    Return (table, meta). The table is read-only and memory-mapped
+    unless mmap is False.
+    """
+    data = np.load(fname)
+    try:
+        meta = json.loads(str(data['meta']))
+        table = _mmap_member(fname, name) if mmap else None
+        if table is None:
+            table = data[name]
+    finally:
+        data.close()
+
+    if meta.get('version', 0) > VERSION:
+        raise ValueError('%s: store version %s not supported' %
+                         (fname, meta['version']))
+    return table, meta
+
+
+def _value(v):
+    """
+    numpy scalar -> python, nan -> None
+    """
+    v = v.item()
+    if isinstance(v, float) and v != v:
+        return None
+    return v
+
+
+def write_csv(table, fd):
+    """
+    One line per frame, header line with the column names
+    """
+    w = csv.writer(fd, lineterminator='\n')
+    w.writerow(table.dtype.names)
+    for row in table:
+        w.writerow([repr(v) if isinstance(v, float) else v
+                    for v in row.tolist()])
+
+
+def write_json(table, meta, fd):
+    """
+    {"meta": {...}, "columns": {"frame": [...], ...}}, nan as null
+    """
+    columns = dict((name, [_value(v) for v in table[name]])
+                   for name in table.dtype.names)
+    json.dump({'meta': meta, 'columns': columns}, fd, sort_keys=True)
+    fd.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export a per-frame metrics store',
+        epilog='Be careful with those bits')
+    parser.add_argument('store', type=str, help='.npz written by metrics')
+    parser.add_argument('format', type=str, choices=['csv', 'json', 'meta'])
+    parser.add_argument('output', type=str, nargs='?', default='-',
+                        help="file to write to, '-' for stdout")
+    args = parser.parse_args()
+
+    table, meta = load(args.store)
+    fd = sys.stdout if args.output == '-' else open(args.output, 'wb')
+    try:
+        if args.format == 'csv':
+            write_csv(table, fd)
+        elif args.format == 'json':
+            write_json(table, meta, fd)
+        else:
+            json.dump(meta, fd, indent=2, sort_keys=True)
+            fd.write('\n')
+    finally:
+        if fd is not sys.stdout:
+            fd.close()
+
+if __name__ == '__main__':
+    main()
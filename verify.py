@@ -3,8 +3,20 @@
 import unittest
 import hashlib
 import math
+import json
 
-from ycbcr import YCbCr
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+from ycbcr import YCbCr, Profiler, FrameCache, block_sum, block_counts
+from progress import get_progress
+from jobs import submit
+from lod import Pyramid
+import store
+import hashindex
+import align
+import manifest
+import bdrate
 
 
 SIZE_420 = 152064    # CIF w*h*3/2
@@ -157,6 +169,10 @@ class TestYCbCrFunctions(unittest.TestCase):
         ret = get_sha1('test_10.yuv', SIZE_420 * 2)
         self.assertEqual(ret, '9cbade807771aa135f7f90b07e4bb510273b4e4f')
 
+        # no format given, a .y4m name must not fail
+        a = YCbCr(filename='foreman_cif_frame_0.yuv', filename_out='slask.y4m')
+        self.assertEqual(a.yuv_format_out, 'YV12')
+
     def test_11(self):
         """
         10bpp -> 8bpp
@@ -310,5 +326,670 @@ class TestYCbCrFunctions(unittest.TestCase):
 
         self.assertEqual(ret, 'e24ac66dc32cff5dff16297dfaab761ab962143c')
 
+    def test_22(self):
+        """
+        profiling, per-stage timing does not alter the result
+        """
+        p = Profiler()
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12',
+                  yuv_format_out='UYVY', filename_out=OUT, profiler=p)
+        a.convert()
+
+        ret = get_sha1(OUT, SIZE_422)
+
+        self.assertEqual(ret, 'f50fc0500b217256a87c7cd1e867da0c49c51ace')
+        r = p.report()['stages']
+        self.assertEqual(r['read']['calls'], 1)
+        self.assertEqual(r['read']['bytes'], SIZE_420)
+        self.assertEqual(r['write']['bytes'], SIZE_422)
+        self.assertEqual(r['resample']['calls'], 1)
+
+    def test_23(self):
+        """
+        progress, json-lines
+        """
+        stream = StringIO()
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12',
+                  filename_out=OUT, progress=get_progress('json', stream))
+        a.flipud()
+
+        ret = json.loads(stream.getvalue().splitlines()[-1])
+
+        self.assertEqual(ret['event'], 'finish')
+        self.assertEqual(ret['label'], 'flipud')
+        self.assertEqual(ret['done'], 1)
+        self.assertEqual(ret['total'], 1)
+
+        # operations running at the same time count on their own
+        a.filename_diff = 'foreman_cif_frame_1.yuv'
+        stream.truncate(0)
+        psnr, ssim = a.psnr(), a.ssim()
+        psnr.next()
+        ssim.next()
+        list(psnr)
+        list(ssim)
+        ret = [json.loads(l) for l in stream.getvalue().splitlines()]
+        self.assertEqual([(r['label'], r['done']) for r in ret],
+                         [('psnr', 1), ('ssim', 1)])
+
+    def test_24(self):
+        """
+        Frame, immutable 2D views
+        """
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='NV12')
+
+        frame = a.frames().next()
+
+        self.assertEqual(frame.index, 0)
+        self.assertEqual(frame.yy.shape, (288, 352))
+        self.assertEqual(frame.cb.shape, (144, 176))
+        self.assertEqual(frame.cr.shape, (144, 176))
+        self.assertTrue(frame.cb.base is frame.raw)
+        self.assertRaises(AttributeError, setattr, frame, 'index', 1)
+        self.assertRaises(ValueError, frame.yy.fill, 0)
+
+    def test_25(self):
+        """
+        one instance, interleaved generators and concurrent threads
+        """
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_diff='foreman_cif_frame_1.yuv')
+
+        luma = a.get_luma()
+        psnr = a.psnr()
+        first = luma.next()
+        ret = psnr.next()
+        self.assertEqual(ret[0], 27.68336995961328)
+        self.assertEqual(first[0], a.frames().next().yy[0, 0])
+
+        pool = ThreadPool(4)
+        ret = pool.map(lambda f: list(f()), [a.psnr, a.ssim, a.psnr, a.ssim])
+        pool.close()
+        self.assertEqual(ret[0], ret[2])
+        self.assertEqual(ret[1], ret[3])
+        self.assertEqual(ret[0][0][0], 27.68336995961328)
+
+    def test_26(self):
+        """
+        jobs, non-blocking psnr and transform, cancellation
+        """
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_diff='foreman_cif_frame_1.yuv',
+                  filename_out=OUT)
+
+        ret = list(submit(a, 'psnr'))
+        self.assertEqual(ret[0][0], 27.68336995961328)
+        self.assertEqual(len(ret), 3)
+
+        job = submit(a, 'flipud')
+        job.result(timeout=10)
+        self.assertEqual(get_sha1(OUT, SIZE_420),
+                         '9052c6e03d7e4b8b2ec5d80aa17e9585b9b2a672')
+
+        job = submit(a, 'psnr', maxsize=1)
+        job.cancel()
+        self.assertTrue(job.wait(timeout=10))
+        self.assertTrue(job.cancelled())
+
+    def test_27(self):
+        """
+        decoded-frame cache, random access and size bound
+        """
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12')
+        c = FrameCache(a, max_bytes=SIZE_420)
+
+        frame = c.get(0)
+
+        self.assertTrue(c.get(0) is frame)
+        self.assertEqual(frame.yy[0, 0], a.frames().next().yy[0, 0])
+        self.assertEqual(c.nbytes, SIZE_420)
+        self.assertRaises(IndexError, a.map().read, 1)
+        c.close()
+
+    def test_28(self):
+        """
+        level-of-detail pyramid, nan ignored
+        """
+        p = Pyramid([1.0, 5.0, float('nan'), 3.0, 2.0])
+
+        x, mn, mx, mean, level = p.view(0, 5, max_points=2)
+
+        self.assertEqual(level, 2)
+        self.assertEqual(list(x), [1.5, 5.5])
+        self.assertEqual(list(mn), [1.0, 2.0])
+        self.assertEqual(list(mx), [5.0, 2.0])
+        self.assertEqual(list(mean), [3.0, 2.0])
+        self.assertEqual(p.view(0, 5)[4], 0)
+
+        # appended a few frames at a time, as from a running job
+        q = Pyramid()
+        for v in ([1.0], [5.0, float('nan')], [], [3.0, 2.0]):
+            q.extend(v)
+        self.assertEqual(len(q), 5)
+        self.assertEqual(len(q.levels), len(p.levels))
+        for a, b in zip(q.levels, p.levels):
+            for u, v in zip(a, b):
+                self.assertEqual(repr(u.tolist()), repr(v.tolist()))
+
+    def test_29(self):
+        """
+        metrics store, same values as psnr/ssim, save and load
+        """
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_diff='foreman_cif_frame_1.yuv')
+        table = a.metrics()
+        store.save('slask.npz', table, store.make_meta(a))
+        t, meta = store.load('slask.npz')
+
+        self.assertEqual(list(t[0])[4:8], list(a.psnr())[0])
+        self.assertEqual(t['ssim'][0], list(a.ssim())[0])
+        self.assertEqual(t.tolist(), table.tolist())
+        self.assertEqual(meta['num_frames'], 1)
+
+        out = StringIO()
+        store.write_csv(t, out)
+        self.assertTrue(out.getvalue().startswith('frame,sse_y,'))
+
+    def test_30(self):
+        """
+        hash index, first difference and identical frames skipped
+        """
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_diff='foreman_cif_frame_1.yuv')
+        h0 = hashindex.build(a)
+        h1 = hashindex.build(a, 'foreman_cif_frame_1.yuv')
+
+        self.assertEqual(h0[0]['hash'].encode('hex'),
+                         get_sha1('foreman_cif_frame_0.yuv', SIZE_420))
+        self.assertEqual(hashindex.first_difference(h0, h0), None)
+        self.assertEqual(hashindex.first_difference(h0, h1), 0)
+        self.assertEqual(hashindex.planes_differing(h0, h1, 0),
+                         ['y', 'cb', 'cr'])
+
+        ret = list(a.psnr(same=[True]))
+        self.assertTrue(math.isnan(ret[0][0]))
+
+        # the sidecar is rebuilt when the frame layout changes
+        import os
+        import shutil
+        import tempfile
+        fname = os.path.join(tempfile.mkdtemp(), 'foreman.yuv')
+        shutil.copy('foreman_cif_frame_0.yuv', fname)
+        a.filename = fname
+        self.assertTrue(hashindex.load(a)[1])
+        self.assertFalse(hashindex.load(a)[1])
+        b = YCbCr(width=352, height=288, filename=fname,
+                  yuv_format_in='YV12', pitch_align=64)
+        self.assertTrue(hashindex.load(b)[1])
+        shutil.rmtree(os.path.dirname(fname))
+
+    def test_31(self):
+        """
+        temporal alignment, offset, drops and repeats
+        """
+        import numpy as np
+        rng = np.random.RandomState(0)
+        ref = rng.uniform(0, 255, (60, 256)).astype(np.float32)
+        idx = [3, 4, 5, 5, 6, 9, 10] + range(11, 40)
+        dist = ref[idx] + rng.uniform(-1, 1, (len(idx), 256))
+
+        path = align.align(ref, dist, window=8)
+
+        self.assertEqual(list(path), idx)
+        self.assertEqual(align.repeats(path), [3])
+        self.assertEqual(align.dropped(path), [7, 8])
+
+    def test_32(self):
+        """
+        per-block maps, partial edge blocks, sums match the frame
+        """
+        import numpy as np
+        x = np.arange(12 * 10).reshape(12, 10)
+
+        self.assertEqual(block_sum(x, 4, 5).tolist(),
+                         x.reshape(3, 4, 2, 5).sum(axis=(1, 3)).tolist())
+        self.assertEqual(block_sum(x, 8, 8).sum(), x.sum())
+        self.assertEqual(block_counts(12, 10, 8, 8).tolist(),
+                         [[64, 16], [32, 8]])
+
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_diff='foreman_cif_frame_1.yuv')
+        t = a.blocks(64, ssim=False)
+        self.assertEqual(t['sse_y'].shape, (1, 5, 6))
+        self.assertEqual(t['sse_cr'][0].sum(), a.metrics(False)['sse_cr'][0])
+
+    def test_33(self):
+        """
+        manifest batch, same results as metrics, resumed
+        """
+        with open('slask.json', 'w') as fd:
+            json.dump([{'reference': 'foreman_cif_frame_0.yuv',
+                        'distorted': 'foreman_cif_frame_1.yuv',
+                        'width': 352, 'height': 288, 'format': 'YV12',
+                        'metrics': 'psnr,ssim', 'output': 'slask.npz'}], fd)
+        jobs = manifest.read('slask.json')
+
+        ret = list(manifest.run(jobs, workers=1, force=True))
+        table, meta = store.load('slask.npz')
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_diff='foreman_cif_frame_1.yuv')
+
+        self.assertEqual(table.tolist(), a.metrics().tolist())
+        self.assertEqual(ret[0][1]['ssim'], table['ssim'][0])
+        self.assertEqual(list(manifest.run(jobs, workers=1)), [(jobs[0], None)])
+
+        # failing jobs fail alone, also when they share the reference
+        import tempfile
+        bad = [dict(jobs[0], distorted=tempfile.mkdtemp(), output='slask1.npz'),
+               dict(jobs[0], distorted='missing.yuv', output='slask1.npz')]
+        ret = list(manifest.run(jobs + bad, workers=1, force=True))
+        self.assertEqual(len(ret), 3)
+        errors = [avg for job, avg in ret if isinstance(avg, basestring)]
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(e.startswith(('IOError', 'OSError'))
+                            for e in errors), errors)
+        self.assertFalse(manifest.done(bad[1]))
+
+    def test_34(self):
+        """
+        Bjontegaard deltas of shifted curves
+        """
+        rate = [100.0, 200.0, 400.0, 800.0]
+        psnr = [30.0, 33.0, 36.5, 39.0]
+
+        self.assertAlmostEqual(
+            bdrate.bd_rate(rate, psnr, [r * 0.9 for r in rate], psnr), -10.0)
+        self.assertAlmostEqual(
+            bdrate.bd_psnr(rate, psnr, rate, [p + 0.5 for p in psnr]), 0.5)
+        self.assertRaises(ValueError, bdrate.bd_psnr, rate, psnr,
+                          [r * 10 for r in rate], psnr)
+
+        # the reference as a stream, read until it ends
+        import os
+        import tempfile
+        import threading
+        fifo = os.path.join(tempfile.mkdtemp(), 'ref.yuv')
+        os.mkfifo(fifo)
+        def feed():
+            with open(fifo, 'wb') as fd:
+                fd.write(open('foreman_cif_frame_0.yuv', 'rb').read())
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        a = YCbCr(width=352, height=288, filename=fifo, yuv_format_in='YV12')
+        ret = bdrate.sequence_psnr(a, ['foreman_cif_frame_1.yuv'])
+        feeder.join()
+        os.remove(fifo)
+        os.rmdir(os.path.dirname(fifo))
+        self.assertEqual(len(ret), 1)
+        self.assertAlmostEqual(ret[0][0], 27.68336995961328)
+
+    def test_35(self):
+        """
+        y4m, FRAME parameters, partial last frame, write and read back
+        """
+        f0 = open('foreman_cif_frame_0.yuv', 'rb').read()
+        f1 = open('foreman_cif_frame_1.yuv', 'rb').read()
+        with open('slask.y4m', 'wb') as fd:
+            fd.write('YUV4MPEG2 W352 H288 F30000:1001 Ip A1:1 C420jpeg\n')
+            fd.write('FRAME Ixyz\n' + f0 + 'FRAME\n' + f1 + 'FRAME\n' + f0[:99])
+
+        a = YCbCr(filename='slask.y4m')
+        self.assertEqual((a.width, a.height, a.yuv_format_in, a.num_frames),
+                         (352, 288, 'YV12', 2))
+        with a.map() as m:
+            self.assertEqual(m.read(1).raw.tostring(), f1)
+
+        a = YCbCr(filename='slask.y4m', filename_out='slask1.y4m')
+        a.convert()
+        b = YCbCr(filename='slask1.y4m', yuv_format_in='YV12',
+                  filename_diff='foreman_cif_frame_0.yuv')
+        self.assertEqual(b.headers['slask1.y4m'].params,
+                         ['F30000:1001', 'Ip', 'A1:1'])
+        self.assertEqual(b.metrics(False)['sse_y'].tolist(), [0])
+
+    def test_36(self):
+        """
+        FIFO input, unknown length, short pipe reads
+        """
+        import os
+        import tempfile
+        import threading
+        data = open('foreman_cif_frame_1.yuv', 'rb').read() * 3
+        fifo = os.path.join(tempfile.mkdtemp(), 'fifo')
+        os.mkfifo(fifo)
+
+        def writer():
+            with open(fifo, 'wb', 0) as fd:
+                for i in xrange(0, len(data), 40000):
+                    fd.write(data[i:i + 40000])
+        t = threading.Thread(target=writer)
+        t.start()
+
+        a = YCbCr(width=352, height=288, filename=fifo, yuv_format_in='YV12')
+        self.assertEqual(a.num_frames, None)
+        ret = [f.raw.tostring() for f in a.frames()]
+        t.join()
+        os.remove(fifo)
+
+        self.assertEqual(len(ret), 3)
+        self.assertTrue(''.join(ret) == data)
+
+    def test_37(self):
+        """
+        padded NV12, P010 peak, NV21/I444 round trip
+        """
+        import numpy as np
+        f0 = open('foreman_cif_frame_0.yuv', 'rb').read()
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', yuv_format_out='NV12',
+                  filename_out='slask.yuv')
+        a.convert()
+        tight = open('slask.yuv', 'rb').read()
+
+        a = YCbCr(width=352, height=288, filename='slask.yuv',
+                  yuv_format_in='NV12', pitch_align=128, height_align=64)
+        self.assertEqual(a.reader.get_geometry()[0][1:3], (384, 288))
+        self.assertEqual(a.frame_size_in, 384 * 320 * 3 / 2)
+        buf = np.zeros(a.frame_size_in, np.uint8)
+        src = np.frombuffer(tight, np.uint8)
+        y, u, v = a.reader.get_planes(buf)
+        y[:] = src[:352 * 288].reshape(288, 352)
+        uv = src[352 * 288:].reshape(144, 352)
+        u[:], v[:] = uv[:, 0::2], uv[:, 1::2]
+        buf.tofile('slask1.yuv')
+        a = YCbCr(width=352, height=288, filename='slask1.yuv',
+                  yuv_format_in='NV12', yuv_format_out='NV12',
+                  filename_out='slask.yuv', pitch_align=128, height_align=64)
+        self.assertEqual(a.num_frames, 1)
+        with a.map() as m:
+            f = m.read(0)
+            self.assertTrue((f.yy == y).all() and (f.cb == u).all() and
+                            (f.cr == v).all())
+        a.convert()    # the output is not padded
+        self.assertTrue(open('slask.yuv', 'rb').read() == tight)
+
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', yuv_format_out='P010',
+                  filename_out='slask.yuv')
+        a.convert()
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_1.yuv',
+                  yuv_format_in='YV12', yuv_format_out='P010',
+                  filename_out='slask1.yuv')
+        a.convert()
+        b = YCbCr(width=352, height=288, filename='slask.yuv',
+                  yuv_format_in='P010', filename_diff='slask1.yuv')
+        ref = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                    yuv_format_in='YV12',
+                    filename_diff='foreman_cif_frame_1.yuv')
+        p10, p8 = list(b.psnr())[0], list(ref.psnr())[0]
+        # 8-bit content scaled by 4, against 1023 instead of 4 * 255
+        gain = 20 * math.log10(1023 / 1020.0)
+        for x, y in zip(p10, p8):
+            self.assertAlmostEqual(x, y + gain, 3)
+
+        # diff in P010 samples, the same picture as in 8 bits
+        import os
+        import numpy as np
+        b.diff()
+        ref.diff()
+        d10 = np.fromfile('slask_slask1_diff.yuv', '<u2')
+        d8 = np.fromfile('foreman_cif_frame_0_foreman_cif_frame_1_diff.yuv',
+                         np.uint8)
+        self.assertEqual(list(d10 >> 8), list(d8))
+        self.assertEqual(d10[-1], 512 << 6)
+        os.remove('slask_slask1_diff.yuv')
+
+        for fmt in ('NV21', 'I444'):
+            a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                      yuv_format_in='YV12', yuv_format_out=fmt,
+                      filename_out='slask.yuv')
+            a.convert()
+            a = YCbCr(width=352, height=288, filename='slask.yuv',
+                      yuv_format_in=fmt, yuv_format_out='YV12',
+                      filename_out='slask1.yuv')
+            a.convert()
+            self.assertTrue(open('slask1.yuv', 'rb').read() == f0)
+
+    def test_38(self):
+        """
+        RGB <-> YCbCr, reference values and a round trip
+        """
+        import os
+        import numpy as np
+        import rgb
+        px = np.array([[[255, 255, 255], [0, 0, 0], [255, 0, 0], [0, 0, 255]]])
+        yy, cb, cr = rgb.rgb2ycbcr(px, rgb.FULL)
+        self.assertEqual(yy.tolist(), [[235, 16, 81, 41]])
+        self.assertEqual(cb.tolist(), [[128, 128, 90, 240]])
+        self.assertEqual(cr.tolist(), [[128, 128, 240, 110]])
+        yy, cb, cr = rgb.rgb2ycbcr(px, rgb.FULL, '709', True)
+        self.assertEqual(yy.tolist(), [[255, 0, 54, 18]])
+        back = rgb.ycbcr2rgb(yy, cb, cr, rgb.FULL, '709', True)
+        self.assertTrue(np.abs(back - px).max() <= 1)
+
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_out='slask.rgb')
+        rgb.export_rgb(a, '2020')
+        self.assertEqual(os.path.getsize('slask.rgb'), 352 * 288 * 3)
+        self.assertEqual(rgb.import_rgb('slask.rgb', 352, 288, 'YV12',
+                                        'slask.yuv', '2020'), 1)
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', filename_diff='slask.yuv')
+        self.assertTrue(list(a.psnr())[0][0] > 45)
+
+        # rgb48le uses the full 16-bit range, 10-bit samples scaled
+        v = np.arange(1024)
+        self.assertEqual(rgb.unscale16(rgb.scale16(v, 10), 10).tolist(),
+                         v.tolist())
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', yuv_format_out='P010',
+                  filename_out='slask1.yuv')
+        a.convert()
+        a = YCbCr(width=352, height=288, filename='slask1.yuv',
+                  yuv_format_in='P010', filename_out='slask.rgb')
+        rgb.export_rgb(a)
+        rgb48 = np.fromfile('slask.rgb', '<u2')
+        self.assertEqual(len(rgb48), 352 * 288 * 3)
+        self.assertTrue(rgb48.max() > 60000)
+        rgb.import_rgb('slask.rgb', 352, 288, 'P010', 'slask.yuv')
+        a = YCbCr(width=352, height=288, filename='slask1.yuv',
+                  yuv_format_in='P010', filename_diff='slask.yuv')
+        self.assertTrue(list(a.psnr())[0][0] > 45)
+        os.remove('slask.rgb')
+
+    def test_39(self):
+        """
+        export: frame lists, PNG/PPM encoding, contact sheet
+        """
+        import os
+        import struct
+        import zlib
+        import tempfile
+        import numpy as np
+        import export
+        import rgb
+        self.assertEqual(export.parse_frames('0-9:4,12,15-', 17),
+                         [0, 4, 8, 12, 15, 16])
+        self.assertRaises(ValueError, export.parse_frames, '3-x', 10)
+
+        img = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+        data = export.encode_png(img)
+        self.assertEqual(data[:8], export.PNG_MAGIC)
+        w, h, depth, kind = struct.unpack('>IIBB', data[16:26])
+        self.assertEqual((w, h, depth, kind), (3, 2, 8, 2))
+        n = struct.unpack('>I', data[33:37])[0]
+        rows = np.frombuffer(zlib.decompress(data[41:41 + n]), np.uint8)
+        self.assertEqual(rows.reshape(2, 10)[:, 1:].tolist(),
+                         img.reshape(2, 9).tolist())
+        self.assertEqual(export.encode_pnm(img[..., 0], 1023)[:12],
+                         'P5\n3 2\n1023\n')
+
+        d = tempfile.mkdtemp()
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12')
+        names = export.export(a, [0], os.path.join(d, 'f%d.ppm'),
+                              os.path.join(d, 'sheet.ppm'), scale=4)
+        self.assertEqual(len(names), 2)
+        ppm = open(names[0], 'rb').read()
+        self.assertTrue(ppm.startswith('P6\n352 288\n255\n'))
+        self.assertEqual(len(ppm), 15 + 352 * 288 * 3)
+        sheet = open(names[1], 'rb').read()
+        self.assertTrue(sheet.startswith('P6\n88 72\n255\n'))
+        # the thumbnail is the box-filtered frame
+        full = np.frombuffer(ppm[15:], np.uint8).reshape(288, 352, 3)
+        thumb = np.frombuffer(sheet[13:], np.uint8).reshape(72, 88, 3)
+        box = full.reshape(72, 4, 88, 4, 3).mean(axis=(1, 3))
+        self.assertTrue(np.abs(box - thumb).mean() < 2)
+
+        # 10 bits fill the 16-bit PNG range, sBIT keeps the depth
+        a = YCbCr(width=352, height=288, filename='foreman_cif_frame_0.yuv',
+                  yuv_format_in='YV12', yuv_format_out='P010',
+                  filename_out='slask.yuv')
+        a.convert()
+        a = YCbCr(width=352, height=288, filename='slask.yuv',
+                  yuv_format_in='P010')
+        name = export.export(a, [0], os.path.join(d, 'p%d.png'))[0]
+        data = open(name, 'rb').read()
+        self.assertEqual(struct.unpack('>IIB', data[16:25])[2], 16)
+        self.assertEqual(data[37:41] + data[41:44], 'sBIT\x0a\x0a\x0a')
+        n = struct.unpack('>I', data[48:52])[0]
+        rows = np.frombuffer(zlib.decompress(data[56:56 + n]), np.uint8)
+        png = rows.reshape(288, -1)[:, 1:].copy().view('>u2')
+        png = png.reshape(288, 352, 3).astype(int)
+        self.assertEqual(png.max() >> 8, full.max())
+        self.assertTrue(np.abs((png >> 8) - full).max() <= 1)
+        self.assertEqual(rgb.scale16(np.array([0, 512, 1023]), 10).tolist(),
+                         [0, 32800, 65535])
+
+    def test_40(self):
+        """
+        edit: frame-list expressions, runs, several inputs
+        """
+        import os
+        import edit
+        counts = [10, 3]
+        self.assertEqual(edit.parse('2-4,1@1*2,9-7,0-6:3', counts),
+                         [(0, 2), (0, 3), (0, 4), (1, 1), (1, 1),
+                          (0, 9), (0, 8), (0, 7), (0, 0), (0, 3), (0, 6)])
+        self.assertEqual(edit.parse('1@1-', counts), [(1, 1), (1, 2)])
+        self.assertRaises(ValueError, edit.parse, '10', counts)
+        self.assertRaises(ValueError, edit.parse, '2@0', counts)
+        self.assertEqual(edit.runs(edit.parse('0-4,5,7,1@0-1', counts)),
+                         [(0, 0, 6), (0, 7, 1), (1, 0, 2)])
+
+        f0 = open('foreman_cif_frame_0.yuv', 'rb').read()
+        f1 = open('foreman_cif_frame_1.yuv', 'rb').read()
+        with open('slask1.yuv', 'wb') as fd:
+            fd.write(f0 + f1)
+        a = YCbCr(width=352, height=288, filename='slask1.yuv',
+                  yuv_format_in='YV12')
+        n = edit.edit(a, ['slask1.yuv', 'foreman_cif_frame_0.yuv'],
+                      '1-0,1@0*2', 'slask.yuv')
+        self.assertEqual(n, 4)
+        self.assertTrue(open('slask.yuv', 'rb').read() == f1 + f0 + f0 + f0)
+
+        # packed frames have no y4m layout, nothing is written
+        a = YCbCr(width=352, height=288, filename='slask1.yuv',
+                  yuv_format_in='UYVY')
+        self.assertRaises(ValueError, edit.edit, a, ['slask1.yuv'], '0',
+                          'slask2.y4m')
+        self.assertFalse(os.path.exists('slask2.y4m'))
+
+    def test_41(self):
+        """
+        rational framerate conversion, schedule and blending
+        """
+        import numpy as np
+        import framerate
+        from fractions import Fraction
+        r = framerate.parse_rate
+        self.assertEqual(r('30000:1001'), Fraction(30000, 1001))
+        self.assertEqual(r('29.97'), Fraction(2997, 100))
+        self.assertRaises(ValueError, r, '0')
+
+        # 60 -> 24 is not every 2nd frame
+        src, w = framerate.schedule(r(60), r(24), 0, 5)
+        self.assertEqual(src.tolist(), [0, 2, 5, 7, 10])
+        self.assertEqual(framerate.output_count(10, r(60), r(24)), 4)
+        src, w = framerate.schedule(r(24), r(60), 0, 5, blend=True)
+        self.assertEqual(src.tolist(), [0, 0, 0, 1, 1])
+        self.assertEqual(w.tolist(), [0, 102, 205, 51, 154])
+
+        with open('slask1.yuv', 'wb') as fd:
+            for k in xrange(4):
+                fd.write(chr(40 * k) * (352 * 288 * 3 / 2))
+        a = YCbCr(width=352, height=288, filename='slask1.yuv',
+                  yuv_format_in='YV12', filename_out='slask.yuv')
+        a.change_framerate(1, 2, blend=True, workers=2)
+        out = np.fromfile('slask.yuv', np.uint8).reshape(-1, a.frame_size_out)
+        self.assertTrue((out == out[:, :1]).all())
+        self.assertEqual(out[:, 0].tolist(), [0, 20, 40, 60, 80, 100, 120, 120])
+
+        # n + 1 -> n: rounding up never reaches past the last frame
+        src, w = framerate.schedule(r(601), r(600), 0, 600, True, 600)
+        self.assertTrue(src.max() < 600)
+        frames = np.arange(600, dtype=np.uint8).repeat(384)
+        frames.tofile('slask1.yuv')
+        a = YCbCr(width=16, height=16, filename='slask1.yuv',
+                  yuv_format_in='YV12', filename_out='slask.yuv')
+        a.change_framerate(601, 600, blend=True)
+        out = np.fromfile('slask.yuv', np.uint8).reshape(-1, 384)
+        self.assertEqual(len(out), 600)
+        self.assertEqual(out[-1, 0], 599 % 256)
+
+    def test_42(self):
+        """
+        server: psnr, ssim, identical frames as null, bad ranges
+        """
+        import json
+        import server
+        service = server.Service(pool_size=1)
+        q = {'ref': 'foreman_cif_frame_0.yuv',
+             'dist': 'foreman_cif_frame_1.yuv',
+             'width': '352', 'height': '288', 'format': 'YV12'}
+        status, ctype, body = service.handle('/psnr', q)
+        self.assertEqual((status, ctype), (200, 'application/json'))
+        ret = json.loads(body)
+        self.assertEqual(ret['frames'], [0])
+        ref = YCbCr(width=352, height=288, filename=q['ref'],
+                    yuv_format_in='YV12', filename_diff=q['dist'])
+        for x, y in zip(ret['values'][0], list(ref.psnr())[0]):
+            self.assertAlmostEqual(x, y)
+
+        status, ctype, body = service.handle('/ssim', q)
+        self.assertEqual(status, 200)
+        self.assertAlmostEqual(json.loads(body)['values'][0],
+                               list(ref.ssim())[0])
+
+        same = dict(q, dist=q['ref'])
+        status, ctype, body = service.handle('/psnr', same)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['values'], [[None] * 4])
+
+        for path, extra in (('/psnr', {'start': '5'}),
+                            ('/stats', {'frame': '9', 'file': q['ref']}),
+                            ('/psnr', {'width': 'x'})):
+            self.assertEqual(service.handle(path, dict(q, **extra))[0], 400)
+        self.assertEqual(service.handle('/nope', q)[0], 404)
+
+        # the pool holds one sequence, evicted readers in use stay open
+        with service.pool.use(q['ref'], 352, 288, 'YV12') as (k, r):
+            service.handle('/stats', dict(q, file=q['dist'], frame='0'))
+            self.assertEqual(len(r.read(0).raw), r.frame_size_in)
+        self.assertTrue(r.mm is None)
+
+    def test_43(self):
+        """
+        lazy module, imported once, attributes cached on the stand-in
+        """
+        from ycbcr import LazyModule
+        m = LazyModule('json')
+        self.assertEqual(m.dumps([1]), '[1]')
+        self.assertTrue(m.__dict__['dumps'] is json.dumps)
+
 if __name__ == '__main__':
     unittest.main()
@@ -9,9 +9,14 @@ import argparse
 import time
 import os
 
-import numpy as np
-import matplotlib.pyplot as plt
-from ycbcr import YCbCr
+from multiprocessing import Pool
+
+from ycbcr import YCbCr, LazyModule, formats
+from lod import LODLine
+import store
+
+# imported on first use, keeps --help and argument errors fast
+plt = LazyModule('matplotlib.pyplot')
 
 def create_title_string(title, subtitle):
     """
@@ -23,110 +28,138 @@ def create_title_string(title, subtitle):
         'VS.',
         " ".join([os.path.basename(i) for i in subtitle]))
 
-def plot_psnr(arg):
+def _curve(task):
     """
-    PSNR
+    Runs in a worker process, the per-frame values for one
+    distorted file. col picks one value out of psnr's lists.
     """
-    t, st = vars(arg)['filename'], vars(arg)['filename_diff']
-    for f in st:
-        vars(arg)['filename_diff']=f
-        yuv = YCbCr(**vars(arg))
-
-        psnr = [p[3] for p in yuv.psnr()]
-
-        N = len(psnr[:-2])
-        ind = np.arange(N)  # the x locations for the groups
+    i, kw, metric, col = task
+    yuv = YCbCr(**kw)
+    values = list(getattr(yuv, metric)())[:-2]
+    if col is not None:
+        values = [v[col] for v in values]
+    return i, values
+
+def _curves(arg, metric, col=None):
+    """
+    Generator, yields (index, filename, values) for each file in
+    filename_diff, in the order they finish
+    """
+    kw = dict(vars(arg))
+    for k in ('func', 'jobs', 'save'):
+        kw.pop(k, None)
+    files = arg.filename_diff
+    tasks = [(i, dict(kw, filename_diff=f), metric, col)
+             for i, f in enumerate(files)]
+
+    if arg.jobs == 1 or len(tasks) == 1:
+        results = (_curve(t) for t in tasks)
+        for i, values in results:
+            yield i, files[i], values
+        return
+
+    pool = Pool(arg.jobs)
+    try:
+        for i, values in pool.imap_unordered(_curve, tasks):
+            yield i, files[i], values
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _plot_curves(arg, metric, col, label, ylabel):
+    """
+    One curve per distorted file, each drawn as soon as it is ready.
+    Colour and legend follow the position on the command line, not
+    the order of completion.
+    """
+    t, st = arg.filename, arg.filename_diff
+    plt.title(create_title_string(t, st))
+    plt.ylabel(ylabel)
+    plt.xlabel('frame')
+    plt.grid(True)
 
+    ax = plt.gca()
+    lines = {}
+    for i, f, values in _curves(arg, metric, col):
         # To get a uniq identifier
-        plt.plot(ind, psnr[:-2], 'o-',label=f[-10:-8])
+        lines[i] = LODLine(ax, values, 'o-', label=label(f),
+                           color='C%d' % (i % 10)).line
+        plt.legend(handles=[lines[k] for k in sorted(lines)])
+        if not arg.save:
+            plt.pause(0.001)
 
-        del yuv
+    _show(arg)
 
-    plt.legend()
-    plt.title(create_title_string(t, st))
-    plt.ylabel('weighted dB')
-    plt.xlabel('frame')
-    plt.grid(True)
+def _show(arg):
+    """
+    Display the figure, or write it to --save
+    """
+    if arg.save:
+        plt.savefig(arg.save)
+    else:
+        plt.show()
 
-    plt.show()
+def plot_psnr(arg):
+    """
+    PSNR
+    """
+    _plot_curves(arg, 'psnr', 3, lambda f: f[-10:-8], 'weighted dB')
 
 def plot_wpsnr(arg):
     """
     Weighted PSNR
     BD-PSNR
     """
-    t, st = vars(arg)['filename'], vars(arg)['filename_diff']
-    for f in st:
-        vars(arg)['filename_diff']=f
-        yuv = YCbCr(**vars(arg))
-
-        psnr = [p[0] for p in yuv.psnr()]
-
-        N = len(psnr[:-2])
-        ind = np.arange(N)  # the x locations for the groups
-
-        # To get a uniq identifier
-        plt.plot(ind, psnr[:-2], 'o-',label=f[-8:-4])
-
-        del yuv
-
-    plt.legend()
-    plt.title(create_title_string(t, st))
-    plt.ylabel('weighted dB')
-    plt.xlabel('frame')
-    plt.grid(True)
-
-    plt.show()
+    _plot_curves(arg, 'psnr', 0, lambda f: f[-8:-4], 'weighted dB')
 
 def plot_psnr_all(arg):
     """
     PSNR, all planes
     """
-    yuv = YCbCr(**vars(arg))
-
-    psnr = [p for p in yuv.psnr()]
-
-    N = len(psnr)
-    ind = np.arange(N)  # the x locations for the groups
+    arg.filename_diff = arg.filename_diff[:1]
+    i, f, psnr = next(_curves(arg, 'psnr'))
 
     plt.figure()
-    plt.title(create_title_string(arg))
-    plt.plot(ind, [i[0] for i in psnr], 'ko-', label='Y')
-    plt.plot(ind, [i[1] for i in psnr], 'bo-', label='Cb')
-    plt.plot(ind, [i[2] for i in psnr], 'ro-', label='Cr')
-    plt.plot(ind, [i[3] for i in psnr], 'mo-', label='Frame')
+    plt.title(create_title_string(arg.filename, [f]))
+    ax = plt.gca()
+    LODLine(ax, [i[0] for i in psnr], 'ko-', label='Y')
+    LODLine(ax, [i[1] for i in psnr], 'bo-', label='Cb')
+    LODLine(ax, [i[2] for i in psnr], 'ro-', label='Cr')
+    LODLine(ax, [i[3] for i in psnr], 'mo-', label='Frame')
     plt.legend()
     plt.ylabel('dB')
     plt.xlabel('frame')
     plt.grid(True)
 
-    plt.show()
+    _show(arg)
 
 def plot_ssim(arg):
     """
     SSIM
     """
-    t, st = vars(arg)['filename'], vars(arg)['filename_diff']
-    for f in st:
-        vars(arg)['filename_diff']=f
-        yuv = YCbCr(**vars(arg))
-
-        ssim = [s for s in yuv.ssim()][:-2]
-
-        N = len(ssim)
-        ind = np.arange(N)
+    _plot_curves(arg, 'ssim', None, lambda f: f[-8:-4], 'Index')
 
-        plt.plot(ind, ssim, 'o-',label=f[-8:-4])
-
-        del yuv
+def plot_store(arg):
+    """
+    Curves from metrics stores, nothing is recomputed
+    """
+    ax = plt.gca()
+    refs, dists = [], []
+    for i, f in enumerate(arg.stores):
+        table, meta = store.load(f)
+        refs.append(meta['reference']['path'])
+        dists.append(meta['distorted']['path'])
+        LODLine(ax, table[arg.column], 'o-',
+                label=os.path.basename(dists[-1]), color='C%d' % (i % 10))
 
     plt.legend()
-    plt.title(create_title_string(t, st))
-    plt.ylabel('Index')
+    plt.title(create_title_string(refs[0], dists))
+    plt.ylabel('index' if arg.column == 'ssim' else arg.column)
     plt.xlabel('frame')
     plt.grid(True)
 
-    plt.show()
+    _show(arg)
 
 def main():
     """
@@ -147,7 +180,7 @@ def main():
     parent_parser.add_argument('height', type=int)
     parent_parser.add_argument(
         'yuv_format_in', type=str,
-        choices=['IYUV', 'UYVY', 'YV12', 'YVYU', 'YUY2', '422'],
+        choices=formats(),
         help='valid input-formats')
     parent_parser.add_argument(
             'filename_diff', type=str,
@@ -157,6 +190,17 @@ def main():
         type=int,
         default=None,
         help='number of frames to process [0..n-1]')
+    parent_parser.add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help='number of worker processes, default one per CPU')
+    parent_parser.add_argument(
+        '--save',
+        type=str,
+        default=None,
+        help='write the plot to this file instead of showing it, '
+             'needs no display')
 
     # create parser for the 'psnr' command
     parser_psnr = subparsers.add_parser(
@@ -186,9 +230,29 @@ def main():
         parents=[parent_parser])
     parser_psnr.set_defaults(func=plot_ssim)
 
+    # create parser for the 'store' command
+    parser_store = subparsers.add_parser(
+        'store',
+        help='Plot metrics stores written by ycbcr.py metrics')
+    parser_store.add_argument('stores', type=str, nargs='+',
+                              help='.npz files')
+    parser_store.add_argument(
+        '--column', type=str, default='psnr_y',
+        choices=['psnr_y', 'psnr_cb', 'psnr_cr', 'psnr_bd', 'ssim',
+                 'sse_y', 'sse_cb', 'sse_cr'])
+    parser_store.add_argument('--save', type=str, default=None,
+                              help='write the plot to this file')
+    parser_store.set_defaults(func=plot_store)
+
     # let parse_args() do the job of calling the appropriate function
     # after argument parsing is complete
     args = parser.parse_args()
+
+    if args.save:
+        # before pyplot is imported, no display needed
+        import matplotlib
+        matplotlib.use('Agg')
+
     t1 = time.clock()
     args.func(args)
     t2 = time.clock()
@@ -0,0 +1,171 @@
+"""
+YUV4MPEG2 (.y4m) container, as written by ffmpeg, x264 or mjpegtools.
+
+    YUV4MPEG2 W352 H288 F30000:1001 Ip A1:1 C420jpeg\\n
+    FRAME\\n
+    <Y plane><Cb plane><Cr plane>
+    FRAME\\n
+    ...
+
+The stream header is parsed once. FRAME lines may carry parameters,
+so frames are not at fixed positions: one scan over the markers gives
+the offset of every frame's data, after that frames are read at random
+like from a raw file.
+
+8-bit 4:2:0, 4:2:2 and 4:4:4 are planar Y|Cb|Cr, i.e. the YV12, 422
+and I444 formats. Only the standard library is used, 'ycbcr.py info' stays fast.
+"""
+
+import os
+
+MAGIC = 'YUV4MPEG2'
+FRAME = 'FRAME'
+FRAME_LINE = 'FRAME\n'
+MAX_LINE = 4096
+
+# colour space tag -> format
+COLORSPACES = {
+    '420jpeg': 'YV12',
+    '420paldv': 'YV12',
+    '420mpeg2': 'YV12',
+    '420': 'YV12',
+    '422': '422',
+    '444': 'I444',
+}
+
+# format -> colour space tag written for it
+CHROMA = {
+    'YV12': '420jpeg',
+    '422': '422',
+    'I444': '444',
+}
+
+# chroma subsampling -> format written for it
+PLANAR = {
+    (2, 2): 'YV12',
+    (2, 1): '422',
+    (1, 1): 'I444',
+}
+
+DEFAULT_PARAMS = ['F25:1']
+
+
+class Header(object):
+    """
+    Stream header. params are the tags besides W, H and C, e.g.
+    frame rate and interlacing, kept as they are.
+    """
+    def __init__(self, width, height, colorspace='420jpeg', params=None,
+                 size=0):
+        self.width = width
+        self.height = height
+        self.colorspace = colorspace
+        self.params = list(params if params is not None else DEFAULT_PARAMS)
+        self.size = size    # bytes, including the newline
+
+    @property
+    def yuv_format(self):
+        try:
+            return COLORSPACES[self.colorspace]
+        except KeyError:
+            raise ValueError('y4m colour space "%s" not supported' %
+                             self.colorspace)
+
+    def line(self):
+        tags = ['W%d' % self.width, 'H%d' % self.height] + self.params + \
+            ['C' + self.colorspace]
+        return ' '.join([MAGIC] + tags) + '\n'
+
+    def __repr__(self):
+        return '<Header %s>' % self.line().strip()
+
+
+def is_y4m(fname):
+    """
+    True for a .y4m name or a file starting with the y4m magic
+    """
+    if fname.lower().endswith('.y4m'):
+        return True
+    try:
+        with open(fname, 'rb') as fd:
+            return fd.read(len(MAGIC) + 1) == MAGIC + ' '
+    except IOError:
+        return False
+
+
+def parse_header(line):
+    """
+    Header from the first line of a stream, newline included
+    """
+    if not line.endswith('\n'):
+        raise ValueError('y4m header not terminated')
+    tags = line.split()
+    if not tags or tags[0] != MAGIC:
+        raise ValueError('not a YUV4MPEG2 stream')
+
+    width = height = None
+    colorspace = '420jpeg'    # the default when there is no C tag
+    params = []
+    for tag in tags[1:]:
+        key, value = tag[0], tag[1:]
+        if key == 'W':
+            width = int(value)
+        elif key == 'H':
+            height = int(value)
+        elif key == 'C':
+            colorspace = value
+        else:
+            params.append(tag)
+    if not width or not height:
+        raise ValueError('y4m header without frame size')
+    return Header(width, height, colorspace, params, len(line))
+
+
+def read_header(fname):
+    """
+    Parse the header of fname
+    """
+    with open(fname, 'rb') as fd:
+        try:
+            return parse_header(fd.readline(MAX_LINE))
+        except ValueError as e:
+            raise ValueError('%s: %s' % (fname, e))
+
+
+def frame_offsets(fname, header, frame_size):
+    """
+    Byte offset of the data of each complete frame, a trailing partial
+    frame is ignored like in raw files
+    """
+    offsets = []
+    with open(fname, 'rb') as fd:
+        end = os.fstat(fd.fileno()).st_size
+        pos = header.size
+        while pos < end:
+            fd.seek(pos)
+            line = fd.readline(MAX_LINE)
+            if not line.startswith(FRAME) or not line.endswith('\n'):
+                raise ValueError('%s: no FRAME marker at byte %d' %
+                                 (fname, pos))
+            pos += len(line)
+            if pos + frame_size > end:
+                break
+            offsets.append(pos)
+            pos += frame_size
+    return offsets
+
+
+def make_header(width, height, yuv_format, like=None):
+    """
+    Header for writing frames of yuv_format, keeping the frame rate and
+    other parameters of the input header like (if any)
+    """
+    if yuv_format not in CHROMA:
+        raise ValueError('format "%s" cannot be stored in y4m' % yuv_format)
+    if like is None:
+        return Header(width, height, CHROMA[yuv_format])
+    colorspace = like.colorspace
+    if COLORSPACES.get(colorspace) != yuv_format:
+        colorspace = CHROMA[yuv_format]
+    return Header(width, height, colorspace, like.params)
+
@@ -5,216 +5,315 @@ Tools for working with YCbCr data.
 """
 
 import argparse
+import importlib
+import io
+import itertools
+import stat
+import threading
 import time
 import sys
 import os
+import Queue
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
 
-import numpy as np
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
-class Y:
+class LazyModule(object):
     """
-    BASE
+    Stand-in for a module, imported on first attribute access.
+    Keeps start-up fast for commands that never touch frame data.
+    Attributes are cached on the instance, so __getattr__ runs once
+    per name and later lookups cost as much as on the module.
     """
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
-        self.wh = self.width * self.height
-        self.div = namedtuple('chroma_div', 'width height')
+    def __init__(self, name):
+        self._name = name
+        self._module = None
 
-    def get_420_partitioning(self, width=None, height=None):
-        if not width:
-            wh = self.wh
-        else:
-            wh = width * height
-        # start-stop
-        #       y  y   cb  cb      cr      cr
-        return (0, wh, wh, wh/4*5, wh/4*5, wh/2*3)
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        setattr(self, attr, value)
+        return value
 
-    def get_422_partitioning(self, width=None, height=None):
-        if not width:
-            wh = self.wh
-        else:
-            wh = width * height
-        # start-stop
-        #       y  y   cb  cb      cr      cr
-        return (0, wh, wh, wh/2*3, wh/2*3, wh*2)
+np = LazyModule('numpy')
 
+from progress import Quiet, get_progress, MODES
+import y4m
 
-class YV12(Y):
+
+ChromaDiv = namedtuple('chroma_div', 'width height')
+
+
+def _align(n, k):
+    return (n + k - 1) / k * k
+
+
+class Y:
     """
-    YV12
+    BASE
+
+    A format is described by its class attributes:
+
+        planes     - planes in memory order, each the sample pattern
+                     repeating along a row: 'Y', 'UV' for interleaved
+                     chroma, 'YUYV' for packed 4:2:2
+        chroma_div - chroma subsampling, divisors w.r.t. luma-size
+        bits       - significant bits per sample
+        shift      - position of the lowest of those bits
+        container  - bytes per sample, 2 is little endian
+
+    An instance adds the geometry. Rows may be padded to a pitch of
+    pitch_align bytes and planes to a multiple of height_align luma
+    rows, as hardware decoders do; get_planes() reads such frames in
+    place through strided views.
     """
-    def __init__(self, width, height):
-        Y.__init__(self, width, height)
+    planes = ('Y', 'U', 'V')
+    chroma_div = ChromaDiv(2, 2)
+    bits = 8
+    shift = 0
+    container = 1
+
+    def __init__(self, width, height, pitch_align=1, height_align=1):
+        self.width = width
+        self.height = height
+        self.wh = self.width * self.height
+        self.pitch_align = pitch_align
+        self.height_align = height_align
 
-        # width, height
-        self.chroma_div = self.div(2, 2)  # Chroma divisor w.r.t luma-size
+    @property
+    def peak(self):
+        """
+        Largest sample value
+        """
+        return ((1 << self.bits) - 1) << self.shift
 
-    def get_frame_size(self, width=None, height=None):
+    def get_geometry(self, width=None, height=None):
+        """
+        (offset, pitch, rows, samples per row) of each plane, in bytes
+        and samples
+        """
         if not width:
             width = self.width
             height = self.height
-        return (width * height * 3 / 2)
+        d = self.chroma_div
+        ret = []
+        offset = 0
+        for pattern in self.planes:
+            luma = 'Y' in pattern
+            samples = sum(width if c == 'Y' else width / d.width
+                          for c in set(pattern))
+            rows = height if luma else height / d.height
+            pitch = _align(samples * self.container, self.pitch_align)
+            align = self.height_align if luma else \
+                max(self.height_align / d.height, 1)
+            ret.append((offset, pitch, rows, samples))
+            offset += pitch * _align(rows, align)
+        return ret
+
+    def get_frame_size(self, width=None, height=None):
+        offset, pitch, rows, samples = self.get_geometry(width, height)[-1]
+        d = 1 if 'Y' in self.planes[-1] else self.chroma_div.height
+        return offset + pitch * _align(rows, max(self.height_align / d, 1))
+
+    def get_planes(self, raw, width=None, height=None):
+        """
+        return 2D views (no copies) of the Y, Cb and Cr planes in raw
+        """
+        dtype = '<u%d' % self.container
+        views = {}
+        for pattern, (offset, pitch, rows, samples) in zip(
+                self.planes, self.get_geometry(width, height)):
+            rows_ = raw[offset:offset + pitch * rows].reshape(rows, pitch)
+            rows_ = rows_.view(dtype)[:, :samples]
+            for c in set(pattern):
+                pos = [i for i, s in enumerate(pattern) if s == c]
+                step = len(pattern) / len(pos)
+                views[c] = rows_[:, pos[0]::step]
+        return views['Y'], views['U'], views['V']
 
     def get_layout(self, width=None, height=None):
         """
-        return a tuple of slice-objects
-        Y|U|V
+        return a tuple of slice-objects into a frame, one per Y, Cb
+        and Cr. Only for 8-bit formats without padding.
         """
-        p = self.get_420_partitioning(width, height)
-        return (slice(p[0], p[1]),    # start-stop for luma
-                slice(p[2], p[3]),    # start-stop for chroma
-                slice(p[4], p[5]))    # start-stop for chroma
+        geometry = self.get_geometry(width, height)
+        if self.container != 1 or \
+           any(pitch != samples for offset, pitch, rows, samples in geometry):
+            raise ValueError('%s: no flat layout' % type(self).__name__)
+        layout = {}
+        for pattern, (offset, pitch, rows, samples) in zip(self.planes,
+                                                           geometry):
+            for c in set(pattern):
+                pos = [i for i, s in enumerate(pattern) if s == c]
+                step = len(pattern) / len(pos)
+                layout[c] = slice(offset + pos[0], offset + pitch * rows, step)
+        return layout['Y'], layout['U'], layout['V']
 
 
-class IYUV(Y):
+class YV12(Y):
     """
-    IYUV
+    YV12
+    Y|U|V
     """
-    def __init__(self, width, height):
-        Y.__init__(self, width, height)
-        self.chroma_div = self.div(2, 2)
+    planes = ('Y', 'U', 'V')
 
-    def get_frame_size(self, width=None, height=None):
-        if not width:
-            width = self.width
-            height = self.height
-        return (width * height * 3 / 2)
 
-    def get_layout(self, width=None, height=None):
-        """
-        Y|V|U
-        """
-        p = self.get_420_partitioning(width, height)
-        return (slice(p[0], p[1]),
-                slice(p[4], p[5]),
-                slice(p[2], p[3]))
+class IYUV(Y):
+    """
+    IYUV
+    Y|V|U
+    """
+    planes = ('Y', 'V', 'U')
 
 
 class NV12(Y):
     """
     NV12
+    Y|U0|V0|U1|V1...
     """
-    def __init__(self, width, height):
-        Y.__init__(self, width, height)
+    planes = ('Y', 'UV')
 
-        # width, height
-        self.chroma_div = self.div(2, 2)  # Chroma divisor w.r.t luma-size
 
-    def get_frame_size(self, width=None, height=None):
-        if not width:
-            width = self.width
-            height = self.height
-        return (width * height * 3 / 2)
-
-    def get_layout(self, width=None, height=None):
-        """
-        return a tuple of slice-objects
-        Y|U0|V0|U1|V1...
-        """
-        p = self.get_420_partitioning(width, height)
-        return (slice(p[0],   p[1]),       # start-stop for luma
-                slice(p[2],   p[5], 2),    # start-stop for chroma
-                slice(p[2]+1, p[5], 2))    # start-stop for chroma
+class NV21(Y):
+    """
+    NV21
+    Y|V0|U0|V1|U1...
+    """
+    planes = ('Y', 'VU')
 
 
 class UYVY(Y):
     """
     UYVY
+    U0|Y0|V0|Y1
     """
-    def __init__(self, width, height):
-        Y.__init__(self, width, height)
-        self.chroma_div = self.div(2, 1)
-
-    def get_frame_size(self, width=None, height=None):
-        if not width:
-            width = self.width
-            height = self.height
-        return (width * height * 2)
-
-    def get_layout(self, width=None, height=None):
-        """
-        U0|Y0|V0|Y1
-        """
-        fs = self.get_frame_size(width, height)
-        return (slice(1, fs, 2),
-                slice(0, fs, 4),
-                slice(2, fs, 4))
+    planes = ('UYVY',)
+    chroma_div = ChromaDiv(2, 1)
 
 
 class YVYU(Y):
     """
     YVYU
+    Y0|V0|Y1|U0
     """
-    def __init__(self, width, height):
-        Y.__init__(self, width, height)
-        self.chroma_div = self.div(2, 1)
-
-    def get_frame_size(self, width=None, height=None):
-        if not width:
-            width = self.width
-            height = self.height
-        return (width * height * 2)
-
-    def get_layout(self, width=None, height=None):
-        """
-        Y0|V0|Y1|U0
-        """
-        fs = self.get_frame_size(width, height)
-        return (slice(0, fs, 2),
-                slice(3, fs, 4),
-                slice(1, fs, 4))
+    planes = ('YVYU',)
+    chroma_div = ChromaDiv(2, 1)
 
 
 class YUY2(Y):
     """
     YUY2
+    Y0|U0|Y1|V0
     """
-    def __init__(self, width, height):
-        Y.__init__(self, width, height)
-        self.chroma_div = self.div(2, 1)
-
-    def get_frame_size(self, width=None, height=None):
-        if not width:
-            width = self.width
-            height = self.height
-        return (width * height * 2)
-
-    def get_layout(self, width=None, height=None):
-        """
-        Y0|U0|Y1|V0
-        """
-        fs = self.get_frame_size(width, height)
-        return (slice(0, fs, 2),
-                slice(1, fs, 4),
-                slice(3, fs, 4))
+    planes = ('YUYV',)
+    chroma_div = ChromaDiv(2, 1)
 
 
 class Y422(Y):
     """
     422
+    Y|U|V
     """
-    def __init__(self, width, height):
-        Y.__init__(self, width, height)
-        self.chroma_div = self.div(2, 1)
+    planes = ('Y', 'U', 'V')
+    chroma_div = ChromaDiv(2, 1)
 
-    def get_frame_size(self, width=None, height=None):
-        if not width:
-            width = self.width
-            height = self.height
-        return (width * height * 2)
 
-    def get_layout(self, width=None, height=None):
-        """
-        Y|U|V
-        """
-        p = self.get_422_partitioning(width, height)
-        return (slice(p[0], p[1]),
-                slice(p[2], p[3]),
-                slice(p[4], p[5]))
+class NV16(Y):
+    """
+    NV16
+    Y|U0|V0|U1|V1..., 4:2:2
+    """
+    planes = ('Y', 'UV')
+    chroma_div = ChromaDiv(2, 1)
+
+
+class I444(Y):
+    """
+    I444
+    Y|U|V, no subsampling
+    """
+    planes = ('Y', 'U', 'V')
+    chroma_div = ChromaDiv(1, 1)
+
+
+class P010(Y):
+    """
+    P010
+    Y|U0|V0|U1|V1..., 10 bits in the top of 16-bit little endian
+    """
+    planes = ('Y', 'UV')
+    bits = 10
+    shift = 6
+    container = 2
+
+
+# Reader/Writer
+FORMATS = {
+    'YV12': YV12,
+    'IYUV': IYUV,
+    'NV12': NV12,
+    'NV21': NV21,
+    'UYVY': UYVY,
+    'YVYU': YVYU,
+    'YUY2': YUY2,
+    '422': Y422,
+    'NV16': NV16,
+    'I444': I444,
+    'P010': P010,
+}
+
+
+def formats(chroma_div=None):
+    """
+    Names of the formats, or of those with the given subsampling
+    """
+    return sorted(name for name, fmt in FORMATS.items()
+                  if chroma_div is None or fmt.chroma_div == chroma_div)
+
+
+class Frame(object):
+    """
+    One decoded frame, immutable.
+
+    yy, cb and cr are read-only 2D views into raw, which is owned by
+    this frame alone. Reading the next frame never modifies it, so
+    there is no need for defensive copies. peak is the largest sample
+    value of the format, 255 for 8 bits.
+    """
+    __slots__ = ('index', 'yuv_format', 'raw', 'yy', 'cb', 'cr', 'peak')
+
+    def __init__(self, index, yuv_format, raw, fmt):
+        raw.flags.writeable = False
+        yy, cb, cr = fmt.get_planes(raw)
+        init = object.__setattr__
+        init(self, 'index', index)
+        init(self, 'yuv_format', yuv_format)
+        init(self, 'raw', raw)
+        init(self, 'peak', fmt.peak)
+        init(self, 'yy', yy)
+        init(self, 'cb', cb)
+        init(self, 'cr', cr)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Frame is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Frame is immutable')
+
+    @property
+    def planes(self):
+        return self.yy, self.cb, self.cr
+
+    def __repr__(self):
+        return '<Frame %d %s %dx%d>' % (self.index, self.yuv_format,
+                                       self.yy.shape[1], self.yy.shape[0])
 
 
 class Font:
@@ -248,6 +347,633 @@ class Font:
             print
 
 
+class Profiler:
+    """
+    Opt-in instrumentation. Records time and bytes moved for every
+    call to a stage (read, resample, transform, metric, write).
+    Each call corresponds to one frame.
+    """
+    def __init__(self):
+        self.calls = {}    # stage -> [(seconds, bytes), ...]
+        self.start = time.time()
+
+    def add(self, stage, seconds, nbytes=0):
+        self.calls.setdefault(stage, []).append((seconds, nbytes))
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        t = time.time()
+        yield
+        self.add(name, time.time() - t, nbytes)
+
+    def peak_memory(self):
+        """
+        Peak resident set size in kB, None if not available
+        """
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def report(self):
+        """
+        Return a dict with totals per stage and per-frame timings
+        """
+        stages = {}
+        for name, calls in self.calls.items():
+            seconds = sum(c[0] for c in calls)
+            nbytes = sum(c[1] for c in calls)
+            stages[name] = {
+                'calls': len(calls),
+                'seconds': seconds,
+                'mean': seconds / len(calls),
+                'max': max(c[0] for c in calls),
+                'bytes': nbytes,
+                'mbps': nbytes / seconds / 1e6 if seconds and nbytes else None,
+                'per_frame': [c[0] for c in calls],
+            }
+        return {
+            'wall': time.time() - self.start,
+            'peak_rss_kb': self.peak_memory(),
+            'stages': stages,
+        }
+
+    def dump(self, fname):
+        """
+        Write report to fname, CSV if the extension is .csv, else JSON
+        """
+        if os.path.splitext(fname)[1].lower() == '.csv':
+            import csv
+            with open(fname, 'wb') as fd:
+                w = csv.writer(fd)
+                w.writerow(['stage', 'frame', 'seconds', 'bytes'])
+                for name in sorted(self.calls):
+                    for i, (sec, nbytes) in enumerate(self.calls[name]):
+                        w.writerow([name, i, sec, nbytes])
+        else:
+            import json
+            with open(fname, 'w') as fd:
+                json.dump(self.report(), fd, indent=2, sort_keys=True)
+
+
+class _NoStage:
+    """
+    Stand-in for Profiler.stage() when profiling is disabled
+    """
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_STAGE = _NoStage()
+
+
+def _profiled(stage, size=None):
+    """
+    Decorator, time a method as stage if a profiler is attached.
+    Bytes moved per call is taken from attribute size, or if size
+    is callable, size(self, *args).
+    """
+    def decorate(method):
+        def wrapper(self, *args, **kwargs):
+            prof = self.profiler
+            if prof is None:
+                return method(self, *args, **kwargs)
+            t = time.time()
+            ret = method(self, *args, **kwargs)
+            if callable(size):
+                nbytes = size(self, *args)
+            else:
+                nbytes = getattr(self, size) if size else 0
+            prof.add(stage, time.time() - t, nbytes)
+            return ret
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorate
+
+
+def psnr_plane(a, b, peak=255):
+    """
+    PSNR between two planes, nan if identical
+    """
+    m = ((a.astype(np.int) - b) ** 2).mean()
+    if m == 0:
+        return float("nan")
+
+    return 10 * np.log10(peak ** 2 / m)
+
+
+def sse_plane(a, b):
+    """
+    Sum of squared errors between two planes
+    """
+    d = a.astype(np.int) - b
+    return int((d * d).sum())
+
+
+def psnr_sse(sse, n, peak=255):
+    """
+    PSNR from the SSE over n samples, nan if identical
+    """
+    if sse == 0:
+        return float("nan")
+
+    return 10 * np.log10(peak ** 2 / (sse / float(n)))
+
+
+# One row per frame, see YCbCr.metrics() and store.py
+METRICS_DTYPE = [
+    ('frame', '<u4'),
+    ('sse_y', '<u8'), ('sse_cb', '<u8'), ('sse_cr', '<u8'),
+    ('psnr_y', '<f8'), ('psnr_cb', '<f8'), ('psnr_cr', '<f8'),
+    ('psnr_bd', '<f8'),
+    ('ssim', '<f8'),
+]
+
+
+def metrics_row(row, frame1, frame2, ssim=True):
+    """
+    Fill one METRICS_DTYPE row from two Frames
+    """
+    row['frame'] = frame1.index
+    psnr = []
+    for p, a, b in zip(('y', 'cb', 'cr'), frame1.planes, frame2.planes):
+        sse = sse_plane(a, b)
+        row['sse_' + p] = sse
+        row['psnr_' + p] = psnr_sse(sse, a.size, frame1.peak)
+        psnr.append(row['psnr_' + p])
+    row['psnr_bd'] = (6 * psnr[0] + psnr[1] + psnr[2]) / 8.0
+    if ssim:
+        row['ssim'] = ssim_plane(frame1.yy, frame2.yy, frame1.peak)
+
+
+def psnr_frame(frame1, frame2):
+    """
+    [Y, Cb, Cr, BD] PSNR between two Frames, see YCbCr.psnr()
+    """
+    yy = psnr_plane(frame1.yy, frame2.yy, frame1.peak)
+    cb = psnr_plane(frame1.cb, frame2.cb, frame1.peak)
+    cr = psnr_plane(frame1.cr, frame2.cr, frame1.peak)
+    return [yy, cb, cr, (6 * yy + cb + cr) / 8.0]
+
+
+_GAUSSIAN_KERNEL = []
+
+
+def _gaussian_kernel():
+    """
+    11x11 Gaussian kernel for SSIM, built once
+    """
+    if _GAUSSIAN_KERNEL:
+        return _GAUSSIAN_KERNEL[0]
+
+    from numpy.ma.core import exp
+    from scipy.constants.constants import pi
+
+    #Variables for Gaussian kernel definition
+    gaussian_kernel_sigma = 1.5
+    gaussian_kernel_width = 11
+    gaussian_kernel = np.zeros((gaussian_kernel_width, gaussian_kernel_width))
+
+    #Fill Gaussian kernel
+    for i in range(gaussian_kernel_width):
+        for j in range(gaussian_kernel_width):
+            gaussian_kernel[i, j] = \
+                (1 / (2 * pi * (gaussian_kernel_sigma ** 2))) *\
+                exp(-(((i-5)**2)+((j-5)**2))/(2*(gaussian_kernel_sigma**2)))
+
+    _GAUSSIAN_KERNEL.append(gaussian_kernel)
+    return gaussian_kernel
+
+
+def ssim_map(img_mat_1, img_mat_2, peak=255):
+    """
+    Per-sample SSIM between two 2D planes, see ssim_plane()
+    """
+    import scipy.ndimage
+
+    gaussian_kernel = _gaussian_kernel()
+
+    #Convert image matrices to double precision (like in the Matlab version)
+    img_mat_1 = img_mat_1.astype(np.float)
+    img_mat_2 = img_mat_2.astype(np.float)
+
+    #Squares of input matrices
+    img_mat_1_sq = img_mat_1 ** 2
+    img_mat_2_sq = img_mat_2 ** 2
+    img_mat_12 = img_mat_1 * img_mat_2
+
+    #Means obtained by Gaussian filtering of inputs
+    img_mat_mu_1 = scipy.ndimage.filters.convolve(img_mat_1, gaussian_kernel)
+    img_mat_mu_2 = scipy.ndimage.filters.convolve(img_mat_2, gaussian_kernel)
+
+    #Squares of means
+    img_mat_mu_1_sq = img_mat_mu_1 ** 2
+    img_mat_mu_2_sq = img_mat_mu_2 ** 2
+    img_mat_mu_12 = img_mat_mu_1 * img_mat_mu_2
+
+    #Variances obtained by Gaussian filtering of inputs' squares
+    img_mat_sigma_1_sq = scipy.ndimage.filters.convolve(img_mat_1_sq, gaussian_kernel)
+    img_mat_sigma_2_sq = scipy.ndimage.filters.convolve(img_mat_2_sq, gaussian_kernel)
+
+    #Covariance
+    img_mat_sigma_12 = scipy.ndimage.filters.convolve(img_mat_12, gaussian_kernel)
+
+    #Centered squares of variances
+    img_mat_sigma_1_sq = img_mat_sigma_1_sq - img_mat_mu_1_sq
+    img_mat_sigma_2_sq = img_mat_sigma_2_sq - img_mat_mu_2_sq
+    img_mat_sigma_12 = img_mat_sigma_12 - img_mat_mu_12
+
+    #c1/c2 constants
+    #First use: manual fitting
+    c_1 = 6.5025
+    c_2 = 58.5225
+
+    #Second use: change k1,k2 & c1,c2 depend on L (width of color map)
+    l = peak
+    k_1 = 0.01
+    c_1 = (k_1 * l) ** 2
+    k_2 = 0.03
+    c_2 = (k_2 * l) ** 2
+
+    #Numerator of SSIM
+    num_ssim = (2 * img_mat_mu_12 + c_1) * (2 * img_mat_sigma_12 + c_2)
+    #Denominator of SSIM
+    den_ssim = (img_mat_mu_1_sq + img_mat_mu_2_sq + c_1) *\
+        (img_mat_sigma_1_sq + img_mat_sigma_2_sq + c_2)
+    #SSIM
+    return num_ssim / den_ssim
+
+
+def ssim_plane(img_mat_1, img_mat_2, peak=255):
+    """
+    SSIM between two 2D planes, see YCbCr.ssim()
+    """
+    return np.average(ssim_map(img_mat_1, img_mat_2, peak))
+
+
+def block_sum(x, bh, bw):
+    """
+    Sums over bh x bw blocks of a 2D array. Partial blocks at the
+    right and bottom edge are summed as they are.
+    """
+    h, w = x.shape
+    if h % bh == 0 and w % bw == 0:
+        return x.reshape(h / bh, bh, w / bw, bw).sum(axis=(1, 3))
+    x = np.add.reduceat(x, np.arange(0, h, bh), axis=0)
+    return np.add.reduceat(x, np.arange(0, w, bw), axis=1)
+
+
+def block_counts(h, w, bh, bw):
+    """
+    Number of samples in each block, see block_sum()
+    """
+    rows = np.minimum(bh, h - np.arange(0, h, bh))
+    cols = np.minimum(bw, w - np.arange(0, w, bw))
+    return np.outer(rows, cols)
+
+
+def block_sse(a, b, bh, bw):
+    """
+    Sum of squared errors per block
+    """
+    d = a.astype(np.int) - b
+    return block_sum(d * d, bh, bw)
+
+
+def resample_plane(plane, src, dst):
+    """
+    Chroma plane from subsampling src to dst (chroma_div), samples
+    are repeated or averaged (rounded)
+    """
+    p = plane.astype(np.int)
+    for axis, a, b in ((0, src.height, dst.height), (1, src.width, dst.width)):
+        if b < a:
+            p = p.repeat(a / b, axis=axis)
+        elif b > a:
+            k = b / a
+            n = p.shape[axis] / k
+            p = p.take(np.arange(n * k), axis=axis)
+            shape = list(p.shape)
+            shape[axis:axis + 1] = [n, k]
+            p = (p.reshape(shape).sum(axis=axis + 1) + k / 2) / k
+    return p
+
+
+def convert_depth(plane, src, dst):
+    """
+    Samples of format src as samples of format dst: scaled to the
+    bits of dst (rounded) and moved to its shift
+    """
+    if (src.bits, src.shift) == (dst.bits, dst.shift):
+        return plane
+    p = plane.astype(np.int) >> src.shift
+    d = dst.bits - src.bits
+    if d > 0:
+        p = p << d
+    elif d < 0:
+        p = np.minimum((p + (1 << (-d - 1))) >> -d, (1 << dst.bits) - 1)
+    return p << dst.shift
+
+
+def block_psnr(sse, counts, peak=255):
+    """
+    PSNR per block from block_sse(), nan where identical
+    """
+    sse = np.asarray(sse, dtype=np.float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = 10 * np.log10(float(peak) ** 2 * counts / sse)
+    p[sse == 0] = np.nan
+    return p
+
+
+STREAM_BUFFER = 1 << 22    # bytes, pipe reads and chunked copies
+
+
+def is_stream(fname):
+    """
+    True for '-' (stdin/stdout) and anything that is not a regular
+    file, e.g. a FIFO. Streams are read once, front to back.
+    """
+    if fname == '-':
+        return True
+    try:
+        return not stat.S_ISREG(os.stat(fname).st_mode)
+    except OSError:
+        return False
+
+
+def require_file(fname):
+    """
+    Raise ValueError for a stream, where random access is needed
+    """
+    if is_stream(fname):
+        raise ValueError('%s: needs a regular file, not a stream' % fname)
+
+
+def open_stream(fname):
+    """
+    Buffered binary reader for stdin ('-') or a FIFO. read(n) returns
+    exactly n bytes unless at EOF, however the pipe splits the data.
+    """
+    if fname == '-':
+        return io.open(sys.stdin.fileno(), 'rb', buffering=STREAM_BUFFER,
+                       closefd=False)
+    return io.open(fname, 'rb', buffering=STREAM_BUFFER)
+
+
+@contextmanager
+def open_output(fname):
+    """
+    File to write to, '-' is stdout
+    """
+    if fname == '-':
+        yield sys.__stdout__
+        sys.__stdout__.flush()
+    else:
+        with open(fname, 'wb') as fd:
+            yield fd
+
+
+def _stem(fname):
+    """
+    Base name without extension, for names of derived files
+    """
+    if fname == '-':
+        return 'stdin'
+    return os.path.splitext(os.path.basename(fname))[0]
+
+
+def _rows(blank, n, table=None):
+    """
+    Table of at least n rows, new rows are copies of the one-row array
+    blank. With n None (a stream) a small table is started, it is
+    grown by doubling as frames arrive.
+    """
+    if table is None:
+        return np.repeat(blank, n if n is not None else 64)
+    if n <= len(table):
+        return table
+    return np.concatenate([table, np.repeat(blank, max(n, 2 * len(table)) -
+                                            len(table))])
+
+
+class FrameReader(object):
+    """
+    Reads Frames from one file. Holds all decode state (file position,
+    frame counter), so any number of readers can be active on the same
+    YCbCr at once, e.g. one per generator or per thread. In y4m files
+    every frame is read at its offset, past the FRAME marker.
+
+    A stream (stdin or a FIFO) is read front to back, once. Seeking
+    forward skips frames, backward is an error.
+    """
+    def __init__(self, yuv, filename):
+        self.yuv_format = yuv.yuv_format_in
+        self.fmt = yuv.reader
+        self.frame_size_in = yuv.frame_size_in
+        self.num_frames = yuv.num_frames
+        self.profiler = yuv.profiler
+        self.stream = yuv.streams.pop(filename, None)
+        if self.stream is None and is_stream(filename):
+            raise IOError('%s: a stream can only be read once' % filename)
+        if self.stream is not None:
+            self.y4m = filename in yuv.headers
+            self.fd = self.stream
+            self.offsets = None
+        else:
+            self.offsets = yuv.frame_offsets(filename)
+            self.fd = open(filename, 'rb')
+        self.index = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __iter__(self):
+        while self.num_frames is None or self.index < self.num_frames:
+            try:
+                frame = self.read()
+            except EOFError:
+                return    # a stream ended
+            yield frame
+
+    def close(self):
+        self.fd.close()
+
+    @_profiled('read', 'frame_size_in')
+    def read(self, index=None):
+        """
+        Read the next frame, or frame index if given
+        """
+        if self.stream is not None:
+            return self.__read_stream(index)
+        if self.offsets is not None:
+            if index is not None:
+                self.index = index
+            if self.index >= len(self.offsets):
+                raise EOFError('frame %d: short read' % self.index)
+            self.fd.seek(self.offsets[self.index])
+        elif index is not None and index != self.index:
+            self.fd.seek(index * self.frame_size_in)
+            self.index = index
+        raw = np.fromfile(self.fd, dtype=np.uint8, count=self.frame_size_in)
+        if raw.size != self.frame_size_in:
+            raise EOFError('frame %d: short read' % self.index)
+        frame = Frame(self.index, self.yuv_format, raw, self.fmt)
+        self.index += 1
+        return frame
+
+    def __read_stream(self, index):
+        if index is not None and index < self.index:
+            raise IOError('frame %d: cannot seek back in a stream' % index)
+        while True:
+            if self.y4m:
+                line = self.stream.readline(y4m.MAX_LINE)
+                if not line:
+                    raise EOFError('frame %d: end of stream' % self.index)
+                if not line.startswith(y4m.FRAME):
+                    raise ValueError('frame %d: no FRAME marker' % self.index)
+            data = self.stream.read(self.frame_size_in)
+            if len(data) != self.frame_size_in:
+                raise EOFError('frame %d: short read' % self.index)
+            if index is None or index == self.index:
+                break
+            self.index += 1    # skip forward
+        raw = np.frombuffer(data, dtype=np.uint8)
+        frame = Frame(self.index, self.yuv_format, raw, self.fmt)
+        self.index += 1
+        return frame
+
+
+class MappedReader(object):
+    """
+    Random access to the frames of a file through one read-only
+    memory map. Frames are zero-copy views into the map, pages are
+    only read when a plane is touched.
+    """
+    def __init__(self, yuv, filename):
+        self.filename = filename
+        self.yuv_format = yuv.yuv_format_in
+        self.fmt = yuv.reader
+        self.frame_size_in = yuv.frame_size_in
+        self.profiler = yuv.profiler
+        require_file(filename)
+        self.offsets = yuv.frame_offsets(filename)
+        self.mm = np.memmap(filename, dtype=np.uint8, mode='r')
+        if self.offsets is not None:
+            self.num_frames = len(self.offsets)
+        else:
+            self.num_frames = len(self.mm) / self.frame_size_in
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.num_frames
+
+    def __iter__(self):
+        for i in xrange(self.num_frames):
+            yield self.read(i)
+
+    def close(self):
+        self.mm = None
+
+    @_profiled('read', 'frame_size_in')
+    def read(self, index):
+        """
+        Frame index
+        """
+        if not 0 <= index < self.num_frames:
+            raise IndexError('frame %d out of range' % index)
+        fs = self.frame_size_in
+        start = index * fs if self.offsets is None else self.offsets[index]
+        return Frame(index, self.yuv_format, self.mm[start:start + fs],
+                     self.fmt)
+
+
+class FrameCache(object):
+    """
+    Size-bounded LRU of decoded frames from one file, random access.
+    The neighbours of a requested frame are read in the background,
+    so stepping back and forth stays interactive.
+    """
+    def __init__(self, yuv, alt_fname=False, max_bytes=256 << 20, prefetch=2):
+        self.reader = yuv.open(alt_fname)
+        self.num_frames = yuv.num_frames
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+        self.nbytes = 0
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()           # protects frames/nbytes
+        self.read_lock = threading.Lock()      # protects reader
+        self.todo = Queue.LifoQueue()          # latest request first
+        self.thread = threading.Thread(target=self.__prefetcher)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, index):
+        with self.lock:
+            return index in self.frames
+
+    def get(self, index):
+        """
+        Frame index, from cache or read now
+        """
+        frame = self.__get(index)
+        for i in range(1, self.prefetch + 1):
+            for j in (index + i, index - i):
+                if 0 <= j < self.num_frames:
+                    self.todo.put(j)
+        return frame
+
+    def __get(self, index):
+        with self.lock:
+            if index in self.frames:
+                frame = self.frames.pop(index)
+                self.frames[index] = frame
+                return frame
+
+        with self.read_lock:
+            frame = self.reader.read(index)
+
+        with self.lock:
+            if index not in self.frames:
+                self.frames[index] = frame
+                self.nbytes += frame.raw.nbytes
+            while self.nbytes > self.max_bytes and len(self.frames) > 1:
+                self.nbytes -= self.frames.popitem(last=False)[1].raw.nbytes
+        return frame
+
+    def __prefetcher(self):
+        while True:
+            index = self.todo.get()
+            if index is None:
+                break
+            if index not in self:
+                try:
+                    self.__get(index)
+                except (EOFError, ValueError):
+                    pass
+
+    def close(self):
+        self.todo.put(None)
+        self.thread.join()
+        with self.read_lock:
+            self.reader.close()
+
+
 class YCbCr:
     """
     Tools to work with raw video in YCbCr format.
@@ -268,6 +994,13 @@ class YCbCr:
 
         http://www.libsdl.org/
         http://www.libsdl.org/docs/html/sdloverlay.html
+
+    Also supported, see FORMATS:
+
+        {NV21, 422, NV16, I444, P010}
+
+    P010 has 10 bits per sample in the top of 16, all other formats
+    8 bits.
     """
     def __init__(
         self,
@@ -280,33 +1013,58 @@ class YCbCr:
         filename_diff=None,
         crop_rect=None,
         num=None,
-        func=None):
+        func=None,
+        profiler=None,
+        progress=None,
+        pitch_align=1,
+        height_align=1):
 
-        self.supported_420 = [
-            'YV12',
-            'IYUV',
-            'NV12',
-        ]
-
-        self.supported_422 = [
-            'UYVY',
-            'YVYU',
-            'YUY2',
-            '422',
-        ]
+        self.supported_420 = formats((2, 2))
+        self.supported_422 = formats((2, 1))
+        self.supported_444 = formats((1, 1))
 
         self.supported_extra = [
             None,
         ]
 
-        if yuv_format_in not in self.supported_420 + self.supported_422 + \
-           self.supported_extra:
+        # Streams (stdin, FIFOs) are opened once, here, to look for a
+        # y4m header. Their length is unknown until EOF.
+        if filename == filename_diff == '-':
+            raise ValueError('only one input can be read from stdin')
+        self.streams = {}
+        for f in (filename, filename_diff):
+            if f and is_stream(f):
+                self.streams[f] = open_stream(f)
+
+        # YUV4MPEG2 inputs, the stream header decides geometry and format
+        self.headers = {}
+        self.offsets = {}
+        for f in (filename, filename_diff):
+            if f in self.streams:
+                stream = self.streams[f]
+                if stream.peek(len(y4m.MAGIC)).startswith(y4m.MAGIC):
+                    self.headers[f] = y4m.parse_header(
+                        stream.readline(y4m.MAX_LINE))
+            elif f and y4m.is_y4m(f):
+                self.headers[f] = y4m.read_header(f)
+        if filename in self.headers:
+            width, height, yuv_format_in = self.__from_header(
+                filename, width, height, yuv_format_in)
+
+        if yuv_format_in not in formats() + self.supported_extra:
             raise NameError('Format not supported! "%s"' % yuv_format_in)
 
-        if yuv_format_out not in self.supported_420 + self.supported_422 + \
-           self.supported_extra:
+        if yuv_format_out not in formats() + self.supported_extra:
             raise NameError('Format not supported! "%s"' % yuv_format_out)
 
+        # YUV4MPEG2 output is 8-bit planar, keep the chroma subsampling,
+        # 4:2:0 when there is no format (e.g. 8to10)
+        self.y4m_out = bool(filename_out) and \
+            filename_out.lower().endswith('.y4m')
+        if self.y4m_out:
+            fmt = FORMATS.get(yuv_format_out or yuv_format_in, FORMATS['YV12'])
+            yuv_format_out = y4m.PLANAR[tuple(fmt.chroma_div)]
+
         self.filename = filename
         self.filename_out = filename_out
         self.filename_diff = filename_diff
@@ -314,51 +1072,39 @@ class YCbCr:
         self.height = height
         self.yuv_format_in = yuv_format_in
         self.yuv_format_out = yuv_format_out
+        self.profiler = profiler
+        self.progress = progress if progress is not None else Quiet()
 
         if crop_rect:
             rect = namedtuple('rect', 'xs ys xe ye')
             self.crop_rect = rect(*crop_rect)
 
-        self.yy = None
-        self.cb = None
-        self.cr = None
-
-        # Reader/Writer
-        RW = {
-            'YV12': YV12,
-            'IYUV': IYUV,
-            'NV12': NV12,
-            'UYVY': UYVY,
-            'YVYU': YVYU,
-            'YUY2': YUY2,
-            '422': Y422,
-        }
-
         # Setup
         if self.yuv_format_in:  # we need a reader and and a writer just
                                 # to make sure
-            self.reader = RW[self.yuv_format_in](self.width, self.height)
-            self.writer = RW[self.yuv_format_in](self.width, self.height)
+            self.reader = FORMATS[self.yuv_format_in](
+                self.width, self.height, pitch_align, height_align)
+            self.writer = FORMATS[self.yuv_format_in](
+                self.width, self.height, pitch_align, height_align)
             self.frame_size_in = self.reader.get_frame_size()
             self.frame_size_out = self.reader.get_frame_size()
 
-            # If file-sizes differ, just process the smaller ammount of frames
-            n1 = os.path.getsize(self.filename) / self.frame_size_in
+            # If file-sizes differ, just process the smaller ammount of frames,
+            # streams are read until they end
+            n1 = self.count_frames(self.filename)
             n2 = n1
             if self.filename_diff:
-                n2 = os.path.getsize(self.filename_diff) / self.frame_size_in
+                n2 = self.count_frames(self.filename_diff)
 
-            self.num_frames = min(n1, n2)
+            known = [n for n in (n1, n2) if n is not None]
+            self.num_frames = min(known) if known else None
 
-            self.layout_in = self.reader.get_layout()
-            self.layout_out = self.reader.get_layout()
             self.frame_size_out = self.frame_size_in
             self.chroma_div = self.reader.chroma_div
 
         if self.yuv_format_out:
-            self.writer = RW[self.yuv_format_out](self.width, self.height)
+            self.writer = FORMATS[self.yuv_format_out](self.width, self.height)
             self.frame_size_out = self.writer.get_frame_size()
-            self.layout_out = self.writer.get_layout()
 
         # 8bpp -> 10bpp, 10->8 dito; special handling
         if yuv_format_in is not None:
@@ -367,25 +1113,74 @@ class YCbCr:
 
         # How many frames to process
         if num:
-            if num <= self.num_frames:
+            if self.num_frames is None or num <= self.num_frames:
                 self.num_frames = num
 
+    def __from_header(self, fname, width, height, yuv_format_in):
+        """
+        Geometry and format of a y4m input, width and height may be
+        given as 0
+        """
+        header = self.headers[fname]
+        if width and (width, height) != (header.width, header.height):
+            raise ValueError('%s: y4m header says %dx%d, not %dx%d' % (
+                fname, header.width, header.height, width, height))
+        if yuv_format_in and yuv_format_in != header.yuv_format:
+            print >> sys.stderr, "[WARNING] - y4m input is %s, not %s" % (
+                header.yuv_format, yuv_format_in)
+        return header.width, header.height, header.yuv_format
+
+    def frame_offsets(self, fname):
+        """
+        Offsets of the frame data in a y4m file, None for raw files
+        and streams. The FRAME markers are scanned once per file.
+        """
+        if fname not in self.offsets:
+            stream = fname in self.streams or is_stream(fname)
+            header = self.headers.get(fname)
+            if header is None and not stream and y4m.is_y4m(fname):
+                header = self.headers[fname] = y4m.read_header(fname)
+            if header is not None and \
+               (header.width, header.height, header.yuv_format) != \
+               (self.width, self.height, self.yuv_format_in):
+                raise ValueError('%s: y4m header %dx%d %s does not match' %
+                                 (fname, header.width, header.height,
+                                  header.yuv_format))
+            if header is None or stream:
+                self.offsets[fname] = None
+            else:
+                self.offsets[fname] = y4m.frame_offsets(
+                    fname, header, self.frame_size_in)
+        return self.offsets[fname]
+
+    def count_frames(self, fname):
+        """
+        Number of complete frames in fname, None for a stream
+        """
+        offsets = self.frame_offsets(fname)
+        if offsets is not None:
+            return len(offsets)
+        if fname in self.streams or is_stream(fname):
+            return None
+        return os.path.getsize(fname) / self.frame_size_in
+
+    def _indices(self):
+        """
+        Frame numbers to process, open-ended for streams. Loops stop
+        at the first EOFError.
+        """
+        if self.num_frames is None:
+            return itertools.count()
+        return xrange(self.num_frames)
+
     def show(self):
         """
         Display basic info.
         """
-        print
-        print "Filename (in):", self.filename
-        print "Filename (out):", self.filename_out
-        print "Format (in):", self.yuv_format_in
-        print "Format (out):", self.yuv_format_out
-        print "Width:", self.width
-        print "Height:", self.height
-        print "Filesize (bytes):", os.stat(self.filename)[6]
-        print "Num frames:", os.path.getsize(self.filename) / self.frame_size_in
-        print "Size of 1 frame (in) (bytes):", self.frame_size_in
-        print "Size of 1 frame (out) (bytes):", self.frame_size_out
-        print
+        _show(self.filename, self.filename_out, self.yuv_format_in,
+              self.yuv_format_out, self.width, self.height,
+              self.frame_size_in, self.frame_size_out,
+              self.count_frames(self.filename))
 
     def convert(self):
         """
@@ -393,76 +1188,87 @@ class YCbCr:
         4:2:0 to 4:2:2 interpolation and 4:2:2 to 4:2:0
         subsampling when necessary.
         """
-        self.__execute()
+        self.__execute(label='convert')
 
     def diff(self):
         """
-        Produces a YV12 file containing the luma-difference between
-        two files.
+        Produces a YV12 file (P010 for P010 input) containing the
+        luma-difference between two files.
         """
-        base1 = os.path.basename(self.filename)
-        base2 = os.path.basename(self.filename_diff)
-        out = os.path.splitext(base1)[0] + '_' + \
-            os.path.splitext(base2)[0] + '_diff.yuv'
+        out = _stem(self.filename) + '_' + _stem(self.filename_diff) + \
+            '_diff.yuv'
 
-        chroma = np.empty(self.width * self.height / 2, dtype=np.uint8)
-        chroma.fill(0x80)
+        fmt = self.reader
+        dtype = '<u%d' % fmt.container
+        mid = 1 << (fmt.bits - 1)
+        chroma = np.empty(self.width * self.height / 2, dtype=dtype)
+        chroma.fill(mid << fmt.shift)
         fd_out = open(out, 'wb')
-        with open(self.filename, 'rb') as fd_1, \
-                open(self.filename_diff, 'rb') as fd_2:
-            for i in xrange(self.num_frames):
-                self.__read_frame(fd_1)
-                data1 = self.yy.copy()
-                self.__read_frame(fd_2)
-                data2 = self.yy.copy()
-
-                data = 0x80 - np.abs(data1 - data2)
-                data = data.astype(np.uint8, copy=False)
-                data.tofile(fd_out)
+        progress = self.progress.run(self.num_frames, 'diff')
+        with self.open() as r1, self.open(self.filename_diff) as r2:
+            for i in self._indices():
+                try:
+                    frame1 = r1.read()
+                    frame2 = r2.read()
+                except EOFError:
+                    break
+
+                d = np.abs(frame1.yy.astype(np.int) - frame2.yy) >> fmt.shift
+                data = np.clip(mid - d, 0, fmt.peak >> fmt.shift)
+                (data << fmt.shift).astype(dtype).tofile(fd_out)
                 chroma.tofile(fd_out)
-                sys.stdout.write('.')
-                sys.stdout.flush()
+                progress.update()
         fd_out.close()
+        progress.finish()
 
-    def psnr(self):
+    def psnr(self, same=None, pairs=None):
         """
         PSNR calculations.
         Generator gives PSNR for
         [Y, Cb, Cr, BD]
         Final line is average for above
 
+        same, optional per-frame booleans (see hashindex.py), frames
+        known to be identical are neither read nor compared.
+        pairs, optional (reference, distorted) frame indices to compare
+        instead of frame i against frame i, see align.py.
+
         http://en.wikipedia.org/wiki/Peak_signal-to-noise_ratio
         BD-PSNR
         http://iphome.hhi.de/wiegand/assets/pdfs/2012_12_IEEE-HEVC-Performance.pdf
         p.1676
         """
-        def psnr(a, b):
-            m = ((a - b) ** 2).mean()
-            if m == 0:
-                return float("nan")
-
-            return 10 * np.log10(255 ** 2 / m)
-
         yy = []; cb = []; cr = []; bd = []
-        with open(self.filename, 'rb') as fd_1, \
-                open(self.filename_diff, 'rb') as fd_2:
-            for i in xrange(self.num_frames):
-                self.__read_frame(fd_1)
-                frame1 = self.__copy_planes()[:-1]    # skip whole frame
-                self.__read_frame(fd_2)
-                frame2 = self.__copy_planes()[:-1]    # skip whole frame
-
-                yy.append(psnr(frame1[0], frame2[0]))
-                cb.append(psnr(frame1[1], frame2[1]))
-                cr.append(psnr(frame1[2], frame2[2]))
-                bd.append((6 * yy[-1] + cb[-1] + cr[-1]) / 8.0)
-
+        nan = float("nan")
+        total = self.num_frames if pairs is None else len(pairs)
+        pairs = self._pairs(pairs)
+        progress = self.progress.run(total, 'psnr')
+        with self.open() as r1, self.open(self.filename_diff) as r2:
+            for i, (i1, i2) in enumerate(pairs):
+                if same is not None and i < len(same) and same[i]:
+                    p = [nan, nan, nan, nan]
+                else:
+                    try:
+                        frame1 = r1.read(i1)
+                        frame2 = r2.read(i2)
+                    except EOFError:
+                        break
+
+                    with self._stage('metric'):
+                        p = psnr_frame(frame1, frame2)
+                yy.append(p[0])
+                cb.append(p[1])
+                cr.append(p[2])
+                bd.append(p[3])
+
+                progress.update()
                 yield [yy[-1], cb[-1], cr[-1], bd[-1]]
 
+            progress.finish()
             yield ['-', '-', '-', '-', '-']
             yield [sum(yy)/len(yy), sum(cb)/len(cb), sum(cr)/len(cr), sum(bd)/len(bd)]
 
-    def ssim(self):
+    def ssim(self, pairs=None):
         """
         http://en.wikipedia.org/wiki/Structural_similarity
 
@@ -470,195 +1276,216 @@ class YCbCr:
         http://isit.u-clermont1.fr/~anvacava/code.html
         by antoine.vacavant@udamail.fr
         Usage by kind permission from author.
-        """
-        import scipy.ndimage
-        from numpy.ma.core import exp
-        from scipy.constants.constants import pi
-
-        def compute_ssim(img_mat_1, img_mat_2):
-            #Variables for Gaussian kernel definition
-            gaussian_kernel_sigma = 1.5
-            gaussian_kernel_width = 11
-            gaussian_kernel = np.zeros((gaussian_kernel_width, gaussian_kernel_width))
-
-            #Fill Gaussian kernel
-            for i in range(gaussian_kernel_width):
-                for j in range(gaussian_kernel_width):
-                    gaussian_kernel[i, j] = \
-                        (1 / (2 * pi * (gaussian_kernel_sigma ** 2))) *\
-                        exp(-(((i-5)**2)+((j-5)**2))/(2*(gaussian_kernel_sigma**2)))
-
-            #Convert image matrices to double precision (like in the Matlab version)
-            img_mat_1 = img_mat_1.astype(np.float)
-            img_mat_2 = img_mat_2.astype(np.float)
-
-            #Squares of input matrices
-            img_mat_1_sq = img_mat_1 ** 2
-            img_mat_2_sq = img_mat_2 ** 2
-            img_mat_12 = img_mat_1 * img_mat_2
-
-            #Means obtained by Gaussian filtering of inputs
-            img_mat_mu_1 = scipy.ndimage.filters.convolve(img_mat_1, gaussian_kernel)
-            img_mat_mu_2 = scipy.ndimage.filters.convolve(img_mat_2, gaussian_kernel)
-
-            #Squares of means
-            img_mat_mu_1_sq = img_mat_mu_1 ** 2
-            img_mat_mu_2_sq = img_mat_mu_2 ** 2
-            img_mat_mu_12 = img_mat_mu_1 * img_mat_mu_2
-
-            #Variances obtained by Gaussian filtering of inputs' squares
-            img_mat_sigma_1_sq = scipy.ndimage.filters.convolve(img_mat_1_sq, gaussian_kernel)
-            img_mat_sigma_2_sq = scipy.ndimage.filters.convolve(img_mat_2_sq, gaussian_kernel)
-
-            #Covariance
-            img_mat_sigma_12 = scipy.ndimage.filters.convolve(img_mat_12, gaussian_kernel)
-
-            #Centered squares of variances
-            img_mat_sigma_1_sq = img_mat_sigma_1_sq - img_mat_mu_1_sq
-            img_mat_sigma_2_sq = img_mat_sigma_2_sq - img_mat_mu_2_sq
-            img_mat_sigma_12 = img_mat_sigma_12 - img_mat_mu_12
-
-            #c1/c2 constants
-            #First use: manual fitting
-            c_1 = 6.5025
-            c_2 = 58.5225
-
-            #Second use: change k1,k2 & c1,c2 depend on L (width of color map)
-            l = 255
-            k_1 = 0.01
-            c_1 = (k_1 * l) ** 2
-            k_2 = 0.03
-            c_2 = (k_2 * l) ** 2
-
-            #Numerator of SSIM
-            num_ssim = (2 * img_mat_mu_12 + c_1) * (2 * img_mat_sigma_12 + c_2)
-            #Denominator of SSIM
-            den_ssim = (img_mat_mu_1_sq + img_mat_mu_2_sq + c_1) *\
-                (img_mat_sigma_1_sq + img_mat_sigma_2_sq + c_2)
-            #SSIM
-            ssim_map = num_ssim / den_ssim
-            index = np.average(ssim_map)
-
-            return index
 
+        pairs, see psnr()
+        """
         s = []
-        with open(self.filename, 'rb') as fd_1, \
-                open(self.filename_diff, 'rb') as fd_2:
-            for i in xrange(self.num_frames):
-                self.__read_frame(fd_1)
-                data1 = self.yy.copy()
-                self.__read_frame(fd_2)
-                data2 = self.yy.copy()
-
-                s.append(compute_ssim(np.reshape(data1, (self.height, self.width)),
-                                      np.reshape(data2, (self.height, self.width))))
-
+        total = self.num_frames if pairs is None else len(pairs)
+        pairs = self._pairs(pairs)
+        progress = self.progress.run(total, 'ssim')
+        with self.open() as r1, self.open(self.filename_diff) as r2:
+            for i1, i2 in pairs:
+                try:
+                    frame1 = r1.read(i1)
+                    frame2 = r2.read(i2)
+                except EOFError:
+                    break
+
+                with self._stage('metric'):
+                    s.append(ssim_plane(frame1.yy, frame2.yy, frame1.peak))
+
+                progress.update()
                 yield s[-1]
+            progress.finish()
             yield '--'
             yield sum(s)/len(s)
 
+    def _pairs(self, pairs):
+        """
+        Frame i against frame i unless aligned pairs are given
+        """
+        if pairs is None:
+            if self.num_frames is None:
+                return ((i, i) for i in itertools.count())
+            return [(i, i) for i in xrange(self.num_frames)]
+        return pairs
+
+    def open(self, alt_fname=False):
+        """
+        Return a new FrameReader, sequential or random access
+        """
+        return FrameReader(self, alt_fname or self.filename)
+
+    def map(self, alt_fname=False):
+        """
+        Return a new MappedReader, random access through mmap
+        """
+        return MappedReader(self, alt_fname or self.filename)
+
+    def metrics(self, ssim=True):
+        """
+        Per-frame SSE and PSNR of all planes plus luma SSIM (nan if
+        not computed) as a structured array of METRICS_DTYPE
+        """
+        blank = np.zeros(1, dtype=METRICS_DTYPE)
+        blank['ssim'] = np.nan
+        table = _rows(blank, self.num_frames)
+        n = 0
+        progress = self.progress.run(self.num_frames, 'metrics')
+        with self.open() as r1, self.open(self.filename_diff) as r2:
+            for i in self._indices():
+                try:
+                    frame1 = r1.read()
+                    frame2 = r2.read()
+                except EOFError:
+                    break
+                table = _rows(blank, i + 1, table)
+
+                with self._stage('metric'):
+                    metrics_row(table[i], frame1, frame2, ssim)
+                n = i + 1
+
+                progress.update()
+            progress.finish()
+        return table[:n]
+
+    def block_shapes(self, block=16):
+        """
+        (luma, chroma) block sizes and grid shapes for block x block
+        luma blocks
+        """
+        d = self.reader.chroma_div
+        b = (block, block)
+        cb = (max(block / d.height, 1), max(block / d.width, 1))
+        grid = lambda n, k: (n + k - 1) / k
+        luma = (grid(self.height, b[0]), grid(self.width, b[1]))
+        chroma = (grid(self.height / d.height, cb[0]),
+                  grid(self.width / d.width, cb[1]))
+        return b, cb, luma, chroma
+
+    def blocks(self, block=16, ssim=True):
+        """
+        Per-frame maps of SSE for all planes and luma SSIM (nan if not
+        computed), one value per block x block luma block. Returned as
+        a structured array, one row per frame, with sub-array fields.
+        See block_psnr() for PSNR maps.
+        """
+        b, cb, luma, chroma = self.block_shapes(block)
+        sse = '<u4' if block <= 256 and self.reader.peak < 256 else '<u8'
+        dtype = [('frame', '<u4'),
+                 ('sse_y', sse, luma),
+                 ('sse_cb', sse, chroma),
+                 ('sse_cr', sse, chroma),
+                 ('ssim', '<f2', luma)]
+        counts = block_counts(self.height, self.width, b[0], b[1])
+
+        blank = np.zeros(1, dtype=dtype)
+        blank['ssim'] = np.nan
+        table = _rows(blank, self.num_frames)
+        n = 0
+        progress = self.progress.run(self.num_frames, 'blocks')
+        with self.open() as r1, self.open(self.filename_diff) as r2:
+            for i in self._indices():
+                try:
+                    frame1 = r1.read()
+                    frame2 = r2.read()
+                except EOFError:
+                    break
+                table = _rows(blank, i + 1, table)
+                n = i + 1
+
+                with self._stage('metric'):
+                    row = table[i]
+                    row['frame'] = i
+                    row['sse_y'] = block_sse(frame1.yy, frame2.yy, *b)
+                    row['sse_cb'] = block_sse(frame1.cb, frame2.cb, *cb)
+                    row['sse_cr'] = block_sse(frame1.cr, frame2.cr, *cb)
+                    if ssim:
+                        m = ssim_map(frame1.yy, frame2.yy, frame1.peak)
+                        row['ssim'] = block_sum(m, *b) / counts
+
+                progress.update()
+            progress.finish()
+        return table[:n]
+
+    def frames(self, alt_fname=False):
+        """
+        Generator, yields an immutable Frame for each frame
+        """
+        with self.open(alt_fname) as reader:
+            for frame in reader:
+                yield frame
+
     def get_luma(self, alt_fname=False):
         """
-        Generator to get luminance-data for all frames
+        Generator to get luminance-data for all frames,
+        read-only 1D uint8 arrays
         """
-        if alt_fname:
-            fname = alt_fname
-        else:
-            fname = self.filename
-
-        with open(fname, 'rb') as fd_in:
-            for i in xrange(self.num_frames):
-                self.__read_frame(fd_in)
-                yield self.yy
+        for frame in self.frames(alt_fname):
+            yield frame.yy.reshape(-1)
 
     def split(self):
         """
         Split a file into separate frames.
         """
-        src_yuv = open(self.filename, 'rb')
+        progress = self.progress.run(self.num_frames, 'split')
+        with self.open() as reader:
+            for frame in reader:
+                fname = "frame" + "%d" % frame.index + ".yuv"
+                with open(fname, 'wb') as dst_yuv:
+                    frame.raw.tofile(dst_yuv)
+                progress.update()
+        progress.finish()
 
-        for i in xrange(self.num_frames):
-            data = src_yuv.read(self.frame_size_in)
-            fname = "frame" + "%d" % i + ".yuv"
-            dst_yuv = open(fname, 'wb')
-            dst_yuv.write(data)
-            sys.stdout.write('.')
-            sys.stdout.flush()
-            dst_yuv.close()
-        src_yuv.close()
+    def __chunks(self, size=STREAM_BUFFER):
+        """
+        The input as byte strings of size bytes, the last may be
+        shorter. Exact-size reads, also from pipes.
+        """
+        fd = self.streams.pop(self.filename, None) or open(self.filename, 'rb')
+        with fd:
+            for chunk in iter(lambda: fd.read(size), ''):
+                yield chunk
 
     def eight2ten(self):
         """
         8 bpp -> 10 bpp
         """
-        a_in = np.memmap(self.filename, mode='readonly')
-        a_out = np.memmap(self.filename_out, mode='write', shape=2 * len(a_in))
-        a_out[::2] = a_in << 2
-        a_out[1::2] = a_in >> 6
+        with open_output(self.filename_out) as fd_o:
+            for chunk in self.__chunks():
+                a_in = np.frombuffer(chunk, dtype=np.uint8)
+                (a_in.astype('<u2') << 2).tofile(fd_o)
 
     def ten2eight(self):
         """
         10 bpp -> 8 bpp
         """
-        fd_i = open(self.filename, 'rb')
-        fd_o = open(self.filename_out, 'wb')
+        with open_output(self.filename_out) as fd_o:
+            for chunk in self.__chunks():
+                a_in = np.frombuffer(chunk, dtype='<u2', count=len(chunk) / 2)
+                data = (2 + a_in.astype(np.uint)) >> 2
 
-        while True:
-            chunk = np.fromfile(fd_i, dtype=np.uint8, count=8192)
-            chunk = chunk.astype(np.uint)
-            if not chunk.any():
-                break
-            data = (2 + (chunk[1::2] << 8 | chunk[0::2])) >> 2
-
-            data = data.astype(np.uint8, casting='same_kind')
-            data.tofile(fd_o)
-
-        fd_i.close()
-        fd_o.close()
+                data = data.astype(np.uint8, casting='same_kind')
+                data.tofile(fd_o)
 
     def fliplr(self):
         """
         Flip left-right
         """
-        d = self.chroma_div
-        with open(self.filename, 'rb') as fd_in, \
-                open(self.filename_out, 'wb') as fd_out:
-            for i in xrange(self.num_frames):
-                self.__read_frame(fd_in)
-                x = self.yy.reshape([self.height, self.width])
-                self.yy = np.fliplr(x).reshape(-1)
-
-                x = self.cb.reshape([self.height / d.height, self.width / d.width])
-                self.cb = np.fliplr(x).reshape(-1)
-
-                x = self.cr.reshape([self.height / d.height, self.width / d.width])
-                self.cr = np.fliplr(x).reshape(-1)
-
-                self.__write_frame(fd_out)
-                sys.stdout.write('.')
-                sys.stdout.flush()
+        self.__execute(self.__fliplr, label='fliplr')
 
     def flipud(self):
         """
         Flip upside-down
         """
-        with open(self.filename, 'rb') as fd_in, \
-                open(self.filename_out, 'wb') as fd_out:
-            for i in xrange(self.num_frames):
-                self.__read_frame(fd_in)
-                self.yy = np.flipud(self.yy)
-                self.cb = np.flipud(self.cb)
-                self.cr = np.flipud(self.cr)
-                self.__write_frame(fd_out)
-                sys.stdout.write('.')
-                sys.stdout.flush()
+        self.__execute(self.__flipud, label='flipud')
 
     def draw_frame_number(self):
         """
         Draw frame-number in Luma-data
         """
         drawer = Font()
-        self.__execute(self.__add_frame_number, drawer)
+        self.__execute(self.__add_frame_number, drawer, label='fnum')
 
     def crop(self):
         """
@@ -667,45 +1494,132 @@ class YCbCr:
         c = self.crop_rect
         w = c[2] - c[0] + 1
         h = c[3] - c[1] + 1
-        # re-calculate output-layout
-        self.frame_size_out = self.reader.get_frame_size(w, h)
-        self.layout_out = self.reader.get_layout(w, h)
-
-        self.__execute(self.__crop)
+        # output for the cropped size
+        self.__execute(self.__crop, size=(w, h), label='crop')
 
-
-    def reduce_framerate(self, fin, fout):
+    def change_framerate(self, fin, fout, blend=False, workers=None):
         """
-        Reduce framerate by throwing frames away
+        Rational framerate conversion, frames are dropped or repeated
+        by timestamp, or blended, see framerate.py. fin and fout are
+        numbers or strings like '30000/1001'.
         input:  filename.yuv
-        output: filename_xx_fps.yuv
+        output: filename_out, default filename_xx_fps.yuv
         """
-        fname, fext = os.path.splitext(os.path.basename(self.filename))
-        fname_out = "%s_%d_fps%s" % (fname, fout, fext)
+        import framerate
+        fin, fout = framerate.parse_rate(fin), framerate.parse_rate(fout)
+        fext = os.path.splitext(self.filename)[1] or '.yuv'
+        fname_out = self.filename_out or "%s_%s_fps%s" % (
+            _stem(self.filename), framerate.format_rate(fout), fext)
 
         print "Writing result to", os.getcwd(), fname_out
 
-        with open(self.filename, 'rb') as fd_1, \
-                open(fname_out, 'wb') as fd_2:
-            for i in xrange(self.num_frames):
-                data = fd_1.read(self.frame_size_in)
-                if i%(fin/fout) == 0:
-                    fd_2.write(data)
-                sys.stdout.write('.')
-                sys.stdout.flush()
+        header = None
+        if fname_out.lower().endswith('.y4m'):
+            header = y4m.make_header(self.width, self.height,
+                                     self.yuv_format_in,
+                                     self.headers.get(self.filename))
+            header.params = ['F%d:%d' % (fout.numerator, fout.denominator)] + \
+                [p for p in header.params if not p.startswith('F')]
+
+        n_in = self.num_frames
+        n_out = None
+        if n_in is not None:
+            n_out = framerate.output_count(n_in, fin, fout)
+        stream = self.filename in self.streams
+        reader = self.open() if stream else self.map()
+        recent = {}
+
+        def fetch(i):
+            # streams only go forward, keep the frames still needed
+            if not stream:
+                if i >= n_in:
+                    raise EOFError()
+                return reader.read(i).raw
+            if i not in recent:
+                for k in [k for k in recent if k < i - 1]:
+                    del recent[k]
+                recent[i] = reader.read(i).raw
+            return recent[i]
+
+        def render(start):
+            stop = start + framerate.BATCH
+            if n_out is not None:
+                stop = min(stop, n_out)
+            src, weight = framerate.schedule(fin, fout, start, stop, blend,
+                                             n_in)
+            a, b = [], []
+            for i, w in zip(src, weight):
+                try:
+                    frame_a = fetch(i)
+                except EOFError:
+                    break    # a stream ended
+                try:
+                    frame_b = fetch(i + 1) if w else frame_a
+                except EOFError:
+                    frame_b = frame_a    # the last frame, as for files
+                a.append(frame_a)
+                b.append(frame_b)
+            if not blend or not a:
+                return a
+            return list(framerate.blend(np.vstack(a), np.vstack(b),
+                                        weight[:len(a)], self.reader))
+
+        starts = itertools.count(0, framerate.BATCH)
+        if n_out is not None:
+            starts = xrange(0, n_out, framerate.BATCH)
+        # copies are views of the map, only blends gain from threads
+        pool = None
+        if stream or workers == 1 or not blend or \
+                n_out <= framerate.POOL_BATCHES * framerate.BATCH:
+            batches = itertools.imap(render, starts)
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(workers)
+            batches = pool.imap(render, starts)
 
-    def __execute(self, func=lambda *a, **k: None, *args, **kwargs):
-        """
-        Wrapper around read/write frame
-        """
-        with open(self.filename, 'rb') as fd_in, \
-                open(self.filename_out, 'wb') as fd_out:
-            for i in xrange(self.num_frames):
-                self.__read_frame(fd_in)
-                func(i, *args, **kwargs)
-                self.__write_frame(fd_out)
-                sys.stdout.write('.')
-                sys.stdout.flush()
+        progress = self.progress.run(n_out, 'fr')
+        try:
+            with reader, open_output(fname_out) as fd_2:
+                if header is not None:
+                    fd_2.write(header.line())
+                for frames in batches:
+                    for raw in frames:
+                        if header is not None:
+                            fd_2.write(y4m.FRAME_LINE)
+                        raw.tofile(fd_2)
+                    progress.update(len(frames))
+                    if len(frames) < framerate.BATCH:
+                        break
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        progress.finish()
+
+    def __execute(self, func=lambda i, planes: planes, *args, **kwargs):
+        """
+        Wrapper around read/write frame. func gets the frame number
+        and the read-only planes of the frame, returns the planes
+        to write. The output size defaults to the input size.
+        """
+        size = kwargs.pop('size', (self.width, self.height))
+        frame_size = self.writer.get_frame_size(*size)
+        progress = self.progress.run(self.num_frames,
+                                     kwargs.pop('label', ''))
+        with self.open() as reader, \
+                open_output(self.filename_out) as fd_out:
+            if self.y4m_out:
+                header = y4m.make_header(size[0], size[1], self.yuv_format_out,
+                                         self.headers.get(self.filename))
+                fd_out.write(header.line())
+            for frame in reader:
+                with self._stage('transform'):
+                    planes = func(frame.index, frame.planes, *args, **kwargs)
+                if self.y4m_out:
+                    fd_out.write(y4m.FRAME_LINE)
+                self.__write_frame(fd_out, planes, size, frame_size)
+                progress.update()
+        progress.finish()
 
     def __check(self):
         """
@@ -720,6 +1634,16 @@ class YCbCr:
         if self.height & 0xF != 0:
             print >> sys.stderr, "[WARNING] - hight not divisable by 16"
 
+        if self.streams:
+            return    # sizes unknown until the end
+
+        if self.headers:
+            # y4m, frame counts instead of file sizes
+            if self.filename_diff and self.count_frames(self.filename) != \
+               self.count_frames(self.filename_diff):
+                print >> sys.stderr, "[WARNING] - # frames are not equal"
+            return
+
         size = os.path.getsize(self.filename)
         if not self.num_frames == size / float(self.frame_size_in):
             print >> sys.stderr, "[WARNING] - # frames not integer"
@@ -730,51 +1654,64 @@ class YCbCr:
                 print >> sys.stderr, "[WARNING] - file-sizes are not equal"
 
 
-    def __read_frame(self, fd):
+    def _stage(self, name, nbytes=0):
         """
-        Use extended indexing to read 1 frame into self.{y, cb, cr}
+        Context manager timing a block as stage name, no-op unless
+        a profiler is attached
         """
-        self.raw = np.fromfile(fd, dtype=np.uint8, count=self.frame_size_in)
-        self.raw = self.raw.astype(np.int, copy=False)
+        if self.profiler is None:
+            return _NO_STAGE
+        return self.profiler.stage(name, nbytes)
 
-        self.yy = self.raw[self.layout_in[0]]
-        self.cb = self.raw[self.layout_in[1]]
-        self.cr = self.raw[self.layout_in[2]]
-
-    def __write_frame(self, fd):
+    @_profiled('write', lambda self, fd, planes, size, frame_size: frame_size)
+    def __write_frame(self, fd, planes, size, frame_size):
         """
-        Use extended indexing to write 1 frame, including re-sampling and
-        format conversion
+        Write 1 frame of size (width, height) through the plane views
+        of the output format, including re-sampling, bit depth and
+        format conversion. Padding is written as zeros.
         """
-        self.__resample()
-        data = np.empty(self.frame_size_out, dtype=np.uint8)
+        yy, cb, cr = self.__resample(*planes)
+        data = np.zeros(frame_size, dtype=np.uint8)
 
-        data[self.layout_out[0]] = self.yy
-        data[self.layout_out[1]] = self.cb
-        data[self.layout_out[2]] = self.cr
+        views = self.writer.get_planes(data, *size)
+        for view, plane in zip(views, (yy, cb, cr)):
+            plane = convert_depth(plane, self.reader, self.writer)
+            view[...] = plane.reshape(view.shape)
 
         data.tofile(fd)
 
-    def __resample(self):
+    @_profiled('resample')
+    def __resample(self, yy, cb, cr):
         """
-        Handle 420 -> 422 and 422 -> 420
+        Chroma to the subsampling of the output format. 8-bit
+        420 -> 422 and 422 -> 420 are filtered, anything else is
+        scaled with resample_plane()
         """
+        d_in, d_out = self.reader.chroma_div, self.writer.chroma_div
+        if d_in == d_out:
+            return yy, cb, cr
+        if self.reader.peak != 255 or (d_in, d_out) not in \
+           (((2, 2), (2, 1)), ((2, 1), (2, 2))):
+            return (yy, resample_plane(cb, d_in, d_out),
+                    resample_plane(cr, d_in, d_out))
 
         if self.yuv_format_in in self.supported_420 and \
            self.yuv_format_out in self.supported_422:
-            cb = np.zeros(self.width * self.height / 2, dtype=np.int)
-            cr = np.zeros(self.width * self.height / 2, dtype=np.int)
+            cb_out = np.zeros(self.width * self.height / 2, dtype=np.int)
+            cr_out = np.zeros(self.width * self.height / 2, dtype=np.int)
 
-            self.cb = self.__conv420to422(self.cb, cb)
-            self.cr = self.__conv420to422(self.cr, cr)
+            cb = self.__conv420to422(cb.reshape(-1).astype(np.int), cb_out)
+            cr = self.__conv420to422(cr.reshape(-1).astype(np.int), cr_out)
 
         if self.yuv_format_in in self.supported_422 and \
            self.yuv_format_out in self.supported_420:
-            cb = np.zeros(self.width * self.height / 4, dtype=np.int)
-            cr = np.zeros(self.width * self.height / 4, dtype=np.int)
+            cb_out = np.zeros(self.width * self.height / 4, dtype=np.int)
+            cr_out = np.zeros(self.width * self.height / 4, dtype=np.int)
+
+            cb = self.__conv422to420(cb.reshape(-1).astype(np.int), cb_out)
+            cr = self.__conv422to420(cr.reshape(-1).astype(np.int), cr_out)
 
-            self.cb = self.__conv422to420(self.cb, cb)
-            self.cr = self.__conv422to420(self.cr, cr)
+        return yy, cb, cr
 
     def __conv420to422(self, src, dst):
         """
@@ -856,59 +1793,25 @@ class YCbCr:
                 dst[i+w*(j>>1)] = pel if pel < 255 else 255
         return dst
 
-    def __rgb2ycbcr(self, r, g, b):
+    def __fliplr(self, frame, planes):
         """
-        (r,g,b) -> (y, cb, cr)
-
-        Conversion to YCbCr color space.
-        CCIR 601 formulas from "Digital Pictures by Natravali and Haskell, page 120.
+        Mirror all planes left-right
         """
-        y = self.__clip2UInt8(0.257 * r + 0.504 * g + 0.098 * b + 16)
-        cb = self.__clip2UInt8(-0.148 * r - 0.291 * g + 0.439 * b + 128)
-        cr = self.__clip2UInt8(0.439 * r - 0.368 * g - 0.071 * b + 128)
+        return [np.fliplr(p) for p in planes]
 
-        return (y, cb, cr)
-
-    def __ycbcr2rgb(self, y, cb, cr):
+    def __flipud(self, frame, planes):
         """
-        (y,cb,cr) -> (r, g, b)
-
-        Conversion to RGB color space.
-        CCIR 601 formulas from "Digital Pictures by Natravali and Haskell, page 120.
+        Reverse the sample order of all planes
         """
-        y = y - 16
-        cb = cb - 128
-        cr = cr - 128
-
-        r = self.__clip2UInt8(1.164 * y + 1.596 * cr)
-        g = self.__clip2UInt8(1.164 * y - 0.392 * cb - 0.813 * cr)
-        b = self.__clip2UInt8(1.164 * y + 2.017 * cb)
-
-        return (r, g, b)
-
-    def __clip2UInt8(self, d):
-        "Clip d to interval 0-255"
-
-        if (d < 0):
-            return 0
-
-        if (d > 255):
-            return 255
-
-        return int(round(d))
+        return [np.flipud(p.reshape(-1)) for p in planes]
 
-    def __copy_planes(self):
-        """
-        Return a copy of the different color planes,
-        including whole frame
-        """
-        return self.yy.copy(), self.cb.copy(), self.cr.copy(), self.raw.copy()
-
-    def __add_frame_number(self, frame, D):
+    def __add_frame_number(self, frame, planes, D):
         """
         Draw frame-number in Luma-data
         """
-        self.yy = np.reshape(self.yy, (self.height, self.width))
+        yy = planes[0].copy()
+        fmt = self.reader
+        black = (16 << (fmt.bits - 8)) << fmt.shift
         num_digits = map(int, str(frame))
 
         for pos, nd in enumerate(num_digits):
@@ -918,11 +1821,11 @@ class YCbCr:
             for row, d in enumerate(digit):
                 for i in range(15, -1, -1):
                     if d & (1 << i):
-                        self.yy[row][pos*16:pos*16+16][15-i] = 16
+                        yy[row][pos*16:pos*16+16][15-i] = black
 
-        self.yy = self.yy.reshape(-1)
+        return yy, planes[1], planes[2]
 
-    def __crop(self, arg):
+    def __crop(self, frame, planes):
         """
         Crop color-planes
         Layout for 4:2:0
@@ -950,33 +1853,71 @@ class YCbCr:
         """
         d = self.chroma_div    # divisor
         r = self.crop_rect
+        yy, cb, cr = planes
+
+        yy = yy[r.ys:r.ye + 1, r.xs:r.xe + 1]
+        cb = cb[r.ys / d.height:
+                r.ye / d.height + 1,
+                r.xs / d.width:
+                r.xe / d.width + 1]
+        cr = cr[r.ys / d.height:
+                r.ye / d.height + 1,
+                r.xs / d.width:
+                r.xe / d.width + 1]
+
+        return yy, cb, cr
+
+def _show(filename, filename_out, yuv_format_in, yuv_format_out,
+          width, height, frame_size_in, frame_size_out, num_frames=None):
+    """
+    Print basic info, the file is stat'ed once. Sizes of streams are
+    unknown.
+    """
+    size = num = 'unknown (stream)'
+    if not is_stream(filename):
+        size = os.stat(filename).st_size
+        num = num_frames if num_frames is not None else size / frame_size_in
+    print
+    print "Filename (in):", filename
+    print "Filename (out):", filename_out
+    print "Format (in):", yuv_format_in
+    print "Format (out):", yuv_format_out
+    print "Width:", width
+    print "Height:", height
+    print "Filesize (bytes):", size
+    print "Num frames:", num
+    print "Size of 1 frame (in) (bytes):", frame_size_in
+    print "Size of 1 frame (out) (bytes):", frame_size_out
+    print
+
+
+def info(filename, width, height, yuv_format_in, pitch_align=1,
+         height_align=1, **kwargs):
+    """
+    Fast path for the info-command. Only stats the file, neither
+    numpy nor any frame data is touched. For y4m the header and the
+    FRAME markers are read.
+    """
+    header = None
+    if not is_stream(filename) and y4m.is_y4m(filename):
+        header = y4m.read_header(filename)
+    if header is not None:
+        width, height = header.width, header.height
+        yuv_format_in = header.yuv_format
+    frame_size = FORMATS[yuv_format_in](
+        width, height, pitch_align, height_align).get_frame_size()
+    num_frames = None
+    if header is not None:
+        num_frames = len(y4m.frame_offsets(filename, header, frame_size))
+    _show(filename, None, yuv_format_in, None, width, height,
+          frame_size, frame_size, num_frames)
 
-        self.yy = np.reshape(self.yy, (self.height, self.width))
-        self.yy = self.yy[r.ys:r.ye + 1, r.xs:r.xe + 1]
-
-        self.yy = self.yy.reshape(-1)
-
-        self.cb = self.cb.reshape([self.height / d.height,
-                                   self.width / d.width])
-        self.cb = self.cb[r.ys / d.height:
-                          r.ye / d.height + 1,
-                          r.xs / d.width:
-                          r.xe / d.width + 1]
-        self.cb = self.cb.reshape(-1)
-
-        self.cr = self.cr.reshape([self.height / d.height,
-                                   self.width / d.width])
-        self.cr = self.cr[r.ys / d.height:
-                          r.ye / d.height + 1,
-                          r.xs / d.width:
-                          r.xe / d.width + 1]
-        self.cr = self.cr.reshape(-1)
 
 def main():
     # Helper functions
 
     def __cmd_info(arg):
-        YCbCr(**vars(arg)).show()
+        info(**vars(arg))
 
     def __cmd_split(arg):
         yuv = YCbCr(**vars(arg))
@@ -993,10 +1934,30 @@ def main():
         yuv.show()
         yuv.diff()
 
+    def __aligned(yuv, window):
+        """
+        Aligned frame pairs, reported on stderr
+        """
+        import align
+        pairs, path = align.pairs(yuv, window)
+        if len(path):
+            print >> sys.stderr, "aligned: offset %d, %d repeated, %d dropped" % (
+                path[0], len(align.repeats(path)), len(align.dropped(path)))
+        return pairs
+
     def __cmd_psnr(arg):
+        use_index = vars(arg).pop('index')
+        window = vars(arg).pop('align')
         yuv = YCbCr(**vars(arg))
+        same = None
+        pairs = __aligned(yuv, window) if window else None
+        if use_index and pairs is None:
+            import hashindex
+            h1, _ = hashindex.load(yuv)
+            h2, _ = hashindex.load(yuv, yuv.filename_diff)
+            same = hashindex.identical(h1, h2)
         print "{:<5} {:<10} {:<10} {:<10} {:<10}".format('#', 'Y', 'Cb', 'Cr', 'BD')
-        x = (i for i in yuv.psnr())
+        x = (i for i in yuv.psnr(same, pairs))
         for i, n in enumerate(x):
             try:
                 print "{:<5} {:<10f} {:<10f} {:<10f} {:<10f}".format(i, *n)
@@ -1006,8 +1967,10 @@ def main():
                 print "{:<5} {:<10f} {:<10f} {:<10f} {:<10f}".format("avg", *n)
 
     def __cmd_ssim(arg):
+        window = vars(arg).pop('align')
         yuv = YCbCr(**vars(arg))
-        x = (i for i in yuv.ssim())
+        pairs = __aligned(yuv, window) if window else None
+        x = (i for i in yuv.ssim(pairs))
         for i, n in enumerate(x):
             try:
                 print "{:<5} {:<10f}".format(i, n)
@@ -1016,6 +1979,161 @@ def main():
                 n = x.next()
                 print "{:<5} {:<10f}".format("avg", n)
 
+    def __cmd_metrics(arg):
+        import store
+        output = vars(arg).pop('output') or store.sidecar(arg.filename_diff)
+        ssim = not vars(arg).pop('no_ssim')
+        csv_out = vars(arg).pop('csv')
+        json_out = vars(arg).pop('json')
+
+        yuv = YCbCr(**vars(arg))
+        table = yuv.metrics(ssim)
+        meta = store.make_meta(yuv, ssim)
+        store.save(output, table, meta)
+        print "Metrics written to", output
+
+        if csv_out:
+            with open(csv_out, 'wb') as fd:
+                store.write_csv(table, fd)
+        if json_out:
+            with open(json_out, 'wb') as fd:
+                store.write_json(table, meta, fd)
+
+    def __cmd_blocks(arg):
+        import store
+        block = vars(arg).pop('block')
+        output = vars(arg).pop('output') or arg.filename_diff + '.blocks.npz'
+        ssim = not vars(arg).pop('no_ssim')
+        worst = vars(arg).pop('worst')
+
+        yuv = YCbCr(**vars(arg))
+        table = yuv.blocks(block, ssim)
+        meta = store.make_meta(yuv, ssim)
+        meta['block'] = block
+        store.save(output, table, meta, name='blocks')
+        print "Block maps written to", output
+
+        if not worst:
+            return
+        b = yuv.block_shapes(block)[0]
+        psnr = block_psnr(table['sse_y'],
+                          block_counts(yuv.height, yuv.width, *b),
+                          yuv.reader.peak)
+        flat = np.where(np.isnan(psnr), np.inf, psnr).reshape(-1)
+        print "{:<6} {:<6} {:<6} {:<10} {:<10}".format('#', 'x', 'y', 'Y', 'SSIM')
+        for k in np.argsort(flat, kind='mergesort')[:worst]:
+            if not np.isfinite(flat[k]):
+                break
+            f, r, c = np.unravel_index(k, psnr.shape)
+            print "{:<6} {:<6} {:<6} {:<10f} {:<10f}".format(
+                f, c * block, r * block, psnr[f, r, c], table['ssim'][f, r, c])
+
+    def __number(v):
+        """
+        v as for {:f}, '-' for None (no frames) and nan
+        """
+        return '-' if v is None or v != v else '{:f}'.format(v)
+
+    def __cmd_batch(arg):
+        import manifest
+        import store
+        jobs = manifest.read(arg.manifest)
+        results = manifest.run(jobs, arg.jobs, arg.group_size, arg.force,
+                               arg.progress)
+        failed = 0
+        print "{:<40} {:<10} {:<10} {:<10}".format('distorted', 'BD', 'SSIM', '')
+        for job, avg in results:
+            name = os.path.basename(job['distorted'])
+            status = job['output']
+            if avg is None:
+                # done in an earlier run
+                avg = manifest.averages(store.load(job['output'])[0])
+                status += ' (done)'
+            if isinstance(avg, basestring):
+                failed += 1
+                print >> sys.stderr, "[ERROR] - %s: %s" % (job['distorted'], avg)
+            else:
+                print "{:<40} {:<10} {:<10} {:<10}".format(
+                    name, __number(avg['psnr_bd']), __number(avg['ssim']),
+                    status)
+        if failed:
+            sys.exit(1)
+
+    def __cmd_bdrate(arg):
+        import bdrate
+        anchor = vars(arg).pop('anchor')
+        test = vars(arg).pop('test')
+        workers = vars(arg).pop('workers')
+        yuv = YCbCr(**vars(arg))
+
+        files = [f for f, r in anchor + test]
+        psnr = bdrate.sequence_psnr(yuv, files, workers)
+
+        print "{:<30} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            '', 'kbps', 'Y', 'Cb', 'Cr', 'BD')
+        for (f, r), p in zip(anchor + test, psnr):
+            print "{:<30} {:>10.2f} {:>10f} {:>10f} {:>10f} {:>10f}".format(
+                os.path.basename(f)[-30:], r, *p)
+
+        n = len(anchor)
+        ret = bdrate.compare([r for f, r in anchor], psnr[:n],
+                             [r for f, r in test], psnr[n:])
+        print
+        print "{:<10} {:>12} {:>12}".format('', 'BD-rate %', 'BD-PSNR dB')
+        for plane in bdrate.PLANES:
+            print "{:<10} {:>12.3f} {:>12.4f}".format(plane, *ret[plane])
+
+    def __cmd_index(arg):
+        import hashindex
+        workers = vars(arg).pop('workers')
+        yuv = YCbCr(**vars(arg))
+
+        files = [yuv.filename]
+        if yuv.filename_diff:
+            files.append(yuv.filename_diff)
+        tables = []
+        for f in files:
+            table, built = hashindex.load(yuv, f, workers)
+            tables.append(table)
+            print "{:<40} {:>8} frames {}".format(
+                f, len(table), 'indexed' if built else 'up to date')
+            r = hashindex.repeats(table)
+            if r:
+                print "    repeated frames:", ' '.join(map(str, r))
+
+        if len(tables) == 2:
+            a, b = tables
+            i = hashindex.first_difference(a, b)
+            if i is None:
+                print "identical"
+                return
+            if i < min(len(a), len(b)):
+                print "first difference: frame %d (%s)" % (
+                    i, ', '.join(hashindex.planes_differing(a, b, i)))
+            else:
+                print "first difference: frame %d (length)" % i
+            print "identical frames: %d of %d" % (
+                hashindex.identical(a, b).sum(), max(len(a), len(b)))
+            d = hashindex.dropped(a, b)
+            if d and len(d) < len(a):
+                print "dropped frames:", ' '.join(map(str, d))
+
+    def __cmd_align(arg):
+        import align
+        window = vars(arg).pop('window')
+        verbose = vars(arg).pop('verbose')
+        yuv = YCbCr(**vars(arg))
+        pairs, path = align.pairs(yuv, window)
+        if not len(path):
+            return
+        print "offset:", path[0]
+        print "repeated:", ' '.join(map(str, align.repeats(path))) or '-'
+        print "dropped:", ' '.join(map(str, align.dropped(path))) or '-'
+        if verbose:
+            print "{:<8} {:<8}".format('dist', 'ref')
+            for r, d in pairs:
+                print "{:<8} {:<8}".format(d, r)
+
     def __cmd_get_luma(arg):
         yuv = YCbCr(**vars(arg))
         return yuv.get_luma()
@@ -1044,19 +2162,78 @@ def main():
         yuv = YCbCr(**vars(arg))
         yuv.crop()
 
+    def __cmd_torgb(arg):
+        import rgb
+        matrix = vars(arg).pop('matrix')
+        full_range = vars(arg).pop('full_range')
+        order = vars(arg).pop('order')
+        yuv = YCbCr(**vars(arg))
+        rgb.export_rgb(yuv, matrix, full_range, order)
+
+    def __cmd_fromrgb(arg):
+        import rgb
+        n = rgb.import_rgb(arg.filename, arg.width, arg.height,
+                           arg.yuv_format_out, arg.filename_out, arg.matrix,
+                           arg.full_range, arg.order, arg.num, arg.progress)
+        print "Frames written:", n
+
+    def __cmd_export(arg):
+        import export
+        import store
+        opts = dict((k, vars(arg).pop(k)) for k in (
+            'pattern', 'frames', 'worst', 'ref', 'metric', 'store', 'sheet',
+            'scale', 'columns', 'workers', 'matrix', 'full_range'))
+        if opts['pattern'] is None and opts['sheet'] is None:
+            print >> sys.stderr, "[ERROR] - Nothing to write, give a pattern or --sheet"
+            return
+        yuv = YCbCr(filename_diff=opts['ref'], **vars(arg))
+
+        if opts['worst']:
+            if opts['store']:
+                table = store.load(opts['store'])[0]
+            elif opts['ref']:
+                table = yuv.metrics(opts['metric'] == 'ssim')
+            else:
+                print >> sys.stderr, "[ERROR] - --worst needs --ref or --store"
+                return
+            frames = export.worst(table, opts['metric'], opts['worst'])
+            print "{:<6} {:<10}".format('#', opts['metric'])
+            for i in frames:
+                print "{:<6} {:<10f}".format(i, table[opts['metric']][i])
+        elif opts['frames']:
+            frames = export.parse_frames(opts['frames'], yuv.num_frames)
+        else:
+            frames = range(yuv.num_frames)
+
+        names = export.export(yuv, frames, opts['pattern'], opts['sheet'],
+                              opts['scale'], opts['columns'], opts['matrix'],
+                              opts['full_range'], opts['workers'])
+        print "Images written:", len(names)
+
+    def __cmd_edit(arg):
+        import edit
+        expr = vars(arg).pop('expr')
+        filename_out = vars(arg).pop('filename_out')
+        inputs = [arg.filename] + vars(arg).pop('add')
+        yuv = YCbCr(**vars(arg))
+        try:
+            n = edit.edit(yuv, inputs, expr, filename_out)
+        except ValueError as e:
+            print >> sys.stderr, "[ERROR] - %s" % e
+            return
+        print "Frames written:", n
+
     def __cmd_fr(arg):
         fin = arg.fr_in
         fout = arg.fr_out
-        del vars(arg)['fr_in']
-        del vars(arg)['fr_out']
-
-        if int(fout) >= int(fin):
-            print >> sys.stderr, "[ERROR] - New framerate must be less than original"
-            return
+        blend = arg.blend
+        workers = arg.workers
+        for k in ('fr_in', 'fr_out', 'blend', 'workers'):
+            del vars(arg)[k]
 
         yuv = YCbCr(**vars(arg))
         yuv.show()
-        yuv.reduce_framerate(int(fin), int(fout))
+        yuv.change_framerate(fin, fout, blend, workers)
 
     def coords(s):
         """
@@ -1069,161 +2246,496 @@ def main():
         except:
             raise argparse.ArgumentTypeError("Coordinates must be x,y,z,q")
 
-    # create the top-level parser
-    parser = argparse.ArgumentParser(
-        description='YCbCr tools',
-        epilog=' Be careful with those bits')
-    subparsers = parser.add_subparsers(
-        title='subcommands',
-        help='additional help')
-
-    # parent, common arguments for functions
-    parent_parser = argparse.ArgumentParser(add_help=False)
-    parent_parser.add_argument('filename', type=str, help='filename')
-    parent_parser.add_argument('width', type=int)
-    parent_parser.add_argument('height', type=int)
-    parent_parser.add_argument(
-        'yuv_format_in', type=str,
-        choices=['IYUV', 'UYVY', 'YV12', 'NV12', 'YVYU', 'YUY2', '422'],
-        help='valid input-formats')
-    parent_parser.add_argument(
-        '--num',
-        type=int,
-        default=None,
-        help='number of frames to process [0..n-1]')
-
-    # create parser for the 'info' command
-    parser_info = subparsers.add_parser(
-        'info',
-        help='Basic info about YCbCr file',
-        parents=[parent_parser])
-    parser_info.set_defaults(func=__cmd_info)
-
-    # create parser for the 'split' command
-    parser_split = subparsers.add_parser(
-        'split',
-        help='Split a YCbCr file into individual frames',
-        parents=[parent_parser])
-    parser_split.set_defaults(func=__cmd_split)
-
-    # create parser for the 'convert' command
-    parser_convert = subparsers.add_parser(
-        'convert',
-        help='YCbCr format conversion',
-        parents=[parent_parser])
-    parser_convert.add_argument(
-        'yuv_format_out', type=str,
-        choices=['IYUV', 'UYVY', 'YV12', 'NV12', 'YVYU', '422', 'YUY2'],
-        help='valid output-formats')
-    parser_convert.add_argument('filename_out', type=str,
-                                help='file to write to')
-    parser_convert.set_defaults(func=__cmd_convert)
-
-    # create parser for the 'diff' command
-    parser_diff = subparsers.add_parser(
-        'diff',
-        help='Create diff between two YCbCr files',
-        parents=[parent_parser])
-    parser_diff.add_argument('filename_diff', type=str, help='filename')
-    parser_diff.set_defaults(func=__cmd_diff)
-
-    # create parser for the 'psnr' command
-    parser_psnr = subparsers.add_parser(
-        'psnr',
-        help='Calculate PSNR for each frame and each plane',
-        parents=[parent_parser])
-    parser_psnr.add_argument('filename_diff', type=str, help='filename')
-    parser_psnr.set_defaults(func=__cmd_psnr)
-
-    # create parser for the 'ssim' command
-    parser_psnr = subparsers.add_parser(
-        'ssim',
-        help='Calculate ssim for each frame, luma data only',
-        parents=[parent_parser])
-    parser_psnr.add_argument('filename_diff', type=str, help='filename')
-    parser_psnr.set_defaults(func=__cmd_ssim)
-
-    # create parser for the 'get_luma' command
-    parser_info = subparsers.add_parser(
-        'get_luma',
-        help='Return luminance-data for each frame. Generator',
-        parents=[parent_parser])
-    parser_info.set_defaults(func=__cmd_get_luma)
-
-    # create parser for the '8to10' command
-    parser_8to10 = subparsers.add_parser('8to10',
-                                         help='YCbCr 8bpp -> 10bpp')
-    parser_8to10.add_argument('filename', type=str, help='filename')
-    parser_8to10.add_argument('filename_out', type=str,
-                              help='file to write to')
-    parser_8to10.set_defaults(func=__cmd_8to10)
-
-    # create parser for the '10to8' command
-    parser_10to8 = subparsers.add_parser('10to8',
-                                         help='YCbCr 10bpp -> 8bpp')
-    parser_10to8.add_argument('filename', type=str, help='filename')
-    parser_10to8.add_argument('filename_out', type=str,
-                              help='file to write to')
-    parser_10to8.set_defaults(func=__cmd_10to8)
-
-    # create parser for the 'fliplr' command
-    parser_fliplr = subparsers.add_parser(
-        'fliplr',
-        help='Flip left-right',
-        parents=[parent_parser])
-    parser_fliplr.add_argument('filename_out', type=str,
-                               help='file to write to')
-    parser_fliplr.set_defaults(func=__cmd_fliplr)
-
-    # create parser for the 'flipud' command
-    parser_flipud = subparsers.add_parser(
-        'flipud',
-        help='Flip upside-down',
-        parents=[parent_parser])
-    parser_flipud.add_argument('filename_out', type=str,
-                               help='file to write to')
-    parser_flipud.set_defaults(func=__cmd_flipud)
-
-    # create parser for the 'fnum' command
-    parser_fnum = subparsers.add_parser(
-        'fnum',
-        help='Add Frame number',
-        parents=[parent_parser])
-    parser_fnum.add_argument('filename_out', type=str,
-                             help='file to write to')
-    parser_fnum.set_defaults(func=__cmd_fnum)
-
-    # create parser for the 'crop' command
-    parser_crop = subparsers.add_parser(
-        'crop',
-        help='Crop',
-        parents=[parent_parser])
-    parser_crop.add_argument('filename_out', type=str,
-                             help='file to write to')
-    parser_crop.add_argument('crop_rect', type=coords,
-                             help='crop vector: \
-                             x_start, y_start, x_end, y_end. \
-                             Top-left corner has coordinates (0,0). \
-                             1st MB: 0,0,15,15 \
-                             2nd MB: 16,0,31,15')
-    parser_crop.set_defaults(func=__cmd_crop)
-
-    # create parser for the 'framerate' command
-    parser_fr = subparsers.add_parser(
-        'fr',
-        help='Descrease framerate by throwing away frames',
-        parents=[parent_parser])
-    parser_fr.add_argument('fr_in', type=int, help='Current framerate')
-    parser_fr.add_argument('fr_out', type=int, help='Target framerate')
-    parser_fr.set_defaults(func=__cmd_fr)
+    def build_parser(only=None):
+        """
+        Subcommands are registered lazily, only the one about to be
+        used unless only is None
+        """
+        def want(name):
+            return only is None or name == only
+
+        # create the top-level parser
+        parser = argparse.ArgumentParser(
+            description='YCbCr tools',
+            epilog=' Be careful with those bits')
+        parser.add_argument(
+            '--profile', type=str, default=None, metavar='FILE',
+            help='write per-stage timings to FILE (.json or .csv)')
+        parser.add_argument(
+            '--progress', type=str, default='auto',
+            choices=['auto'] + sorted(MODES),
+            help='progress reporting on stderr')
+        parser.add_argument(
+            '--cprofile', type=str, default=None, metavar='FILE',
+            help='write cProfile statistics to FILE')
+        parser.add_argument(
+            '--batch', action='store_true',
+            help='read one command per line from stdin, run all in this process')
+        subparsers = parser.add_subparsers(
+            title='subcommands',
+            help='additional help')
+
+        # parent, common arguments for functions
+        parent_parser = argparse.ArgumentParser(add_help=False)
+        parent_parser.add_argument('filename', type=str, help='filename')
+        parent_parser.add_argument('width', type=int,
+                                   help='0 to take it from a y4m header')
+        parent_parser.add_argument('height', type=int)
+        parent_parser.add_argument(
+            'yuv_format_in', type=str,
+            choices=formats(),
+            help='valid input-formats, a y4m header overrides it')
+        parent_parser.add_argument(
+            '--num',
+            type=int,
+            default=None,
+            help='number of frames to process [0..n-1]')
+        parent_parser.add_argument(
+            '--pitch-align', type=int, default=1, metavar='BYTES',
+            help='input rows padded to a multiple of BYTES, e.g. 64')
+        parent_parser.add_argument(
+            '--height-align', type=int, default=1, metavar='ROWS',
+            help='input planes padded to a multiple of ROWS luma rows')
+
+        # create parser for the 'info' command
+        if want('info'):
+            parser_info = subparsers.add_parser(
+                'info',
+                help='Basic info about YCbCr file',
+                parents=[parent_parser])
+            parser_info.set_defaults(func=__cmd_info)
+
+        # create parser for the 'split' command
+        if want('split'):
+            parser_split = subparsers.add_parser(
+                'split',
+                help='Split a YCbCr file into individual frames',
+                parents=[parent_parser])
+            parser_split.set_defaults(func=__cmd_split)
+
+        # create parser for the 'convert' command
+        if want('convert'):
+            parser_convert = subparsers.add_parser(
+                'convert',
+                help='YCbCr format conversion',
+                parents=[parent_parser])
+            parser_convert.add_argument(
+                'yuv_format_out', type=str,
+                choices=formats(),
+                help='valid output-formats')
+            parser_convert.add_argument('filename_out', type=str,
+                                        help='file to write to, .y4m for YUV4MPEG2')
+            parser_convert.set_defaults(func=__cmd_convert)
+
+        # create parser for the 'diff' command
+        if want('diff'):
+            parser_diff = subparsers.add_parser(
+                'diff',
+                help='Create diff between two YCbCr files',
+                parents=[parent_parser])
+            parser_diff.add_argument('filename_diff', type=str, help='filename')
+            parser_diff.set_defaults(func=__cmd_diff)
+
+        # create parser for the 'psnr' command
+        if want('psnr'):
+            parser_psnr = subparsers.add_parser(
+                'psnr',
+                help='Calculate PSNR for each frame and each plane',
+                parents=[parent_parser])
+            parser_psnr.add_argument('filename_diff', type=str, help='filename')
+            parser_psnr.add_argument(
+                '--index', action='store_true',
+                help='skip frames that are identical according to the '
+                     'hash index, built if needed')
+            parser_psnr.add_argument(
+                '--align', type=int, nargs='?', const=32, default=None,
+                metavar='WINDOW',
+                help='compare temporally aligned frames, dropped or '
+                     'repeated frames searched within WINDOW (32)')
+            parser_psnr.set_defaults(func=__cmd_psnr)
+
+        # create parser for the 'ssim' command
+        if want('ssim'):
+            parser_psnr = subparsers.add_parser(
+                'ssim',
+                help='Calculate ssim for each frame, luma data only',
+                parents=[parent_parser])
+            parser_psnr.add_argument('filename_diff', type=str, help='filename')
+            parser_psnr.add_argument(
+                '--align', type=int, nargs='?', const=32, default=None,
+                metavar='WINDOW',
+                help='compare temporally aligned frames, see psnr')
+            parser_psnr.set_defaults(func=__cmd_ssim)
+
+        # create parser for the 'metrics' command
+        if want('metrics'):
+            parser_metrics = subparsers.add_parser(
+                'metrics',
+                help='Per-frame SSE/PSNR/SSIM into a columnar .npz store',
+                parents=[parent_parser])
+            parser_metrics.add_argument('filename_diff', type=str,
+                                        help='filename')
+            parser_metrics.add_argument(
+                '--output', type=str, default=None,
+                help='store to write, default <filename_diff>.metrics.npz')
+            parser_metrics.add_argument('--no-ssim', action='store_true',
+                                        help='skip the SSIM column')
+            parser_metrics.add_argument('--csv', type=str, default=None,
+                                        help='also export as CSV')
+            parser_metrics.add_argument('--json', type=str, default=None,
+                                        help='also export as JSON')
+            parser_metrics.set_defaults(func=__cmd_metrics)
+
+        # create parser for the 'blocks' command
+        if want('blocks'):
+            parser_blocks = subparsers.add_parser(
+                'blocks',
+                help='Per-block PSNR/SSIM maps for each frame',
+                parents=[parent_parser])
+            parser_blocks.add_argument('filename_diff', type=str,
+                                       help='filename')
+            parser_blocks.add_argument('--block', type=int, default=16,
+                                       help='luma block size, 16 for '
+                                            'macroblocks, 64 for CTUs')
+            parser_blocks.add_argument(
+                '--output', type=str, default=None,
+                help='store to write, default <filename_diff>.blocks.npz')
+            parser_blocks.add_argument('--no-ssim', action='store_true',
+                                       help='skip the SSIM maps')
+            parser_blocks.add_argument('--worst', type=int, default=10,
+                                       help='list the n blocks with the '
+                                            'lowest luma PSNR')
+            parser_blocks.set_defaults(func=__cmd_blocks)
+
+        # create parser for the 'batch' command
+        if want('batch'):
+            parser_batch = subparsers.add_parser(
+                'batch',
+                help='Metrics for all pairs in a JSON/CSV manifest, '
+                     'resumable')
+            parser_batch.add_argument('manifest', type=str,
+                                      help='.json or .csv')
+            parser_batch.add_argument('--jobs', type=int, default=None,
+                                      help='worker processes, default one '
+                                           'per CPU')
+            parser_batch.add_argument('--group-size', type=int, default=8,
+                                      help='max pairs per worker sharing '
+                                           'one read of the reference')
+            parser_batch.add_argument('--force', action='store_true',
+                                      help='recompute pairs already done')
+            parser_batch.set_defaults(func=__cmd_batch)
+
+        # create parser for the 'bdrate' command
+        if want('bdrate'):
+            def encode(s):
+                fname, sep, rate = s.rpartition(':')
+                if not sep:
+                    raise argparse.ArgumentTypeError(
+                        'expected FILE:KBPS, got "%s"' % s)
+                return fname, float(rate)
+
+            parser_bdrate = subparsers.add_parser(
+                'bdrate',
+                help='BD-rate and BD-PSNR of a test against an anchor',
+                parents=[parent_parser])
+            parser_bdrate.add_argument('--anchor', type=encode, nargs='+',
+                                       required=True, metavar='FILE:KBPS',
+                                       help='anchor encodes and bitrates')
+            parser_bdrate.add_argument('--test', type=encode, nargs='+',
+                                       required=True, metavar='FILE:KBPS',
+                                       help='test encodes and bitrates')
+            parser_bdrate.add_argument('--workers', type=int, default=None,
+                                       help='threads comparing the encodes')
+            parser_bdrate.set_defaults(func=__cmd_bdrate)
+
+        # create parser for the 'index' command
+        if want('index'):
+            parser_index = subparsers.add_parser(
+                'index',
+                help='Per-frame hash index, compare two sequences',
+                parents=[parent_parser])
+            parser_index.add_argument('filename_diff', type=str, nargs='?',
+                                      default=None, help='compare with')
+            parser_index.add_argument('--workers', type=int, default=None,
+                                      help='hashing threads, default one '
+                                           'per CPU')
+            parser_index.set_defaults(func=__cmd_index)
+
+        # create parser for the 'align' command
+        if want('align'):
+            parser_align = subparsers.add_parser(
+                'align',
+                help='Find offset, dropped and repeated frames',
+                parents=[parent_parser])
+            parser_align.add_argument('filename_diff', type=str,
+                                      help='filename')
+            parser_align.add_argument('--window', type=int, default=32,
+                                      help='search range in frames')
+            parser_align.add_argument('--verbose', action='store_true',
+                                      help='print the frame mapping')
+            parser_align.set_defaults(func=__cmd_align)
+
+        # create parser for the 'get_luma' command
+        if want('get_luma'):
+            parser_info = subparsers.add_parser(
+                'get_luma',
+                help='Return luminance-data for each frame. Generator',
+                parents=[parent_parser])
+            parser_info.set_defaults(func=__cmd_get_luma)
+
+        # create parser for the '8to10' command
+        if want('8to10'):
+            parser_8to10 = subparsers.add_parser('8to10',
+                                                 help='YCbCr 8bpp -> 10bpp')
+            parser_8to10.add_argument('filename', type=str, help='filename')
+            parser_8to10.add_argument('filename_out', type=str,
+                                      help='file to write to')
+            parser_8to10.set_defaults(func=__cmd_8to10)
+
+        # create parser for the '10to8' command
+        if want('10to8'):
+            parser_10to8 = subparsers.add_parser('10to8',
+                                                 help='YCbCr 10bpp -> 8bpp')
+            parser_10to8.add_argument('filename', type=str, help='filename')
+            parser_10to8.add_argument('filename_out', type=str,
+                                      help='file to write to')
+            parser_10to8.set_defaults(func=__cmd_10to8)
+
+        # create parser for the 'fliplr' command
+        if want('fliplr'):
+            parser_fliplr = subparsers.add_parser(
+                'fliplr',
+                help='Flip left-right',
+                parents=[parent_parser])
+            parser_fliplr.add_argument('filename_out', type=str,
+                                       help='file to write to')
+            parser_fliplr.set_defaults(func=__cmd_fliplr)
+
+        # create parser for the 'flipud' command
+        if want('flipud'):
+            parser_flipud = subparsers.add_parser(
+                'flipud',
+                help='Flip upside-down',
+                parents=[parent_parser])
+            parser_flipud.add_argument('filename_out', type=str,
+                                       help='file to write to')
+            parser_flipud.set_defaults(func=__cmd_flipud)
+
+        # create parser for the 'fnum' command
+        if want('fnum'):
+            parser_fnum = subparsers.add_parser(
+                'fnum',
+                help='Add Frame number',
+                parents=[parent_parser])
+            parser_fnum.add_argument('filename_out', type=str,
+                                     help='file to write to')
+            parser_fnum.set_defaults(func=__cmd_fnum)
+
+        # create parser for the 'crop' command
+        if want('crop'):
+            parser_crop = subparsers.add_parser(
+                'crop',
+                help='Crop',
+                parents=[parent_parser])
+            parser_crop.add_argument('filename_out', type=str,
+                                     help='file to write to, .y4m for YUV4MPEG2')
+            parser_crop.add_argument('crop_rect', type=coords,
+                                     help='crop vector: \
+                                     x_start, y_start, x_end, y_end. \
+                                     Top-left corner has coordinates (0,0). \
+                                     1st MB: 0,0,15,15 \
+                                     2nd MB: 16,0,31,15')
+            parser_crop.set_defaults(func=__cmd_crop)
+
+        # colour conversion options, torgb, fromrgb and export
+        colour_parser = argparse.ArgumentParser(add_help=False)
+        colour_parser.add_argument('--matrix', type=str, default='601',
+                                   choices=['601', '709', '2020'],
+                                   help='YCbCr matrix, BT.601 by default')
+        colour_parser.add_argument('--full-range', action='store_true',
+                                   help='full range YCbCr, not 16-235')
+        rgb_parser = argparse.ArgumentParser(add_help=False,
+                                             parents=[colour_parser])
+        rgb_parser.add_argument('--order', type=str, default='rgb',
+                                choices=['rgb', 'bgr'],
+                                help='sample order of the RGB file')
+
+        # create parser for the 'torgb' command
+        if want('torgb'):
+            parser_torgb = subparsers.add_parser(
+                'torgb',
+                help='Convert to raw RGB, rgb24 or rgb48le (above 8 bits)',
+                parents=[parent_parser, rgb_parser])
+            parser_torgb.add_argument('filename_out', type=str,
+                                      help='file to write to')
+            parser_torgb.set_defaults(func=__cmd_torgb)
+
+        # create parser for the 'fromrgb' command
+        if want('fromrgb'):
+            parser_fromrgb = subparsers.add_parser(
+                'fromrgb',
+                help='Convert raw RGB to a YCbCr format',
+                parents=[rgb_parser])
+            parser_fromrgb.add_argument('filename', type=str,
+                                        help='raw RGB file')
+            parser_fromrgb.add_argument('width', type=int)
+            parser_fromrgb.add_argument('height', type=int)
+            parser_fromrgb.add_argument(
+                'yuv_format_out', type=str,
+                choices=formats(),
+                help='valid output-formats, 8-bit formats read rgb24, '
+                     'deeper ones rgb48le')
+            parser_fromrgb.add_argument('filename_out', type=str,
+                                        help='file to write to')
+            parser_fromrgb.add_argument('--num', type=int, default=None,
+                                        help='number of frames to process')
+            parser_fromrgb.set_defaults(func=__cmd_fromrgb)
+
+        # create parser for the 'export' command
+        if want('export'):
+            parser_export = subparsers.add_parser(
+                'export',
+                help='Frames as PNG/PPM/PGM images and a contact sheet',
+                parents=[parent_parser, colour_parser])
+            parser_export.add_argument(
+                'pattern', type=str, nargs='?', default=None,
+                help='image names, e.g. out/frame%%05d.png; .ppm for RGB, '
+                     '.pgm for luma')
+            parser_export.add_argument(
+                '--frames', type=str, default=None, metavar='LIST',
+                help='e.g. 0-99:10,150,200- (default all frames)')
+            parser_export.add_argument(
+                '--worst', type=int, default=None, metavar='N',
+                help='the N frames with the lowest --metric against --ref')
+            parser_export.add_argument('--ref', type=str, default=None,
+                                       help='reference for --worst')
+            parser_export.add_argument(
+                '--metric', type=str, default='psnr_y',
+                choices=['psnr_y', 'psnr_cb', 'psnr_cr', 'psnr_bd', 'ssim'])
+            parser_export.add_argument(
+                '--store', type=str, default=None,
+                help='take the metric from a metrics store instead of '
+                     'computing it')
+            parser_export.add_argument('--sheet', type=str, default=None,
+                                       help='contact sheet image to write')
+            parser_export.add_argument('--scale', type=int, default=8,
+                                       help='sheet thumbnails are 1/SCALE '
+                                            'of the frame size')
+            parser_export.add_argument('--columns', type=int, default=8,
+                                       help='thumbnails per sheet row')
+            parser_export.add_argument('--workers', type=int, default=None,
+                                       help='threads, default one per CPU')
+            parser_export.set_defaults(func=__cmd_export)
+
+        # create parser for the 'edit' command
+        if want('edit'):
+            parser_edit = subparsers.add_parser(
+                'edit',
+                help='Select, reorder, repeat and concatenate frames',
+                parents=[parent_parser])
+            parser_edit.add_argument('filename_out', type=str,
+                                     help='file to write to, .y4m for '
+                                          'YUV4MPEG2')
+            parser_edit.add_argument(
+                'expr', type=str,
+                help='frame list, e.g. 0-99,1@0-49,5*25,99-0:2; N@ takes '
+                     'frames from input N (0 is filename)')
+            parser_edit.add_argument('--add', type=str, nargs='+',
+                                     default=[], metavar='FILE',
+                                     help='more inputs of the same format, '
+                                          'numbered from 1')
+            parser_edit.set_defaults(func=__cmd_edit)
+
+        # create parser for the 'framerate' command
+        if want('fr'):
+            parser_fr = subparsers.add_parser(
+                'fr',
+                help='Change framerate, dropping/repeating or blending frames',
+                parents=[parent_parser])
+            parser_fr.add_argument('fr_in', type=str,
+                                   help='Current framerate, e.g. 60 or '
+                                        '30000/1001')
+            parser_fr.add_argument('fr_out', type=str, help='Target framerate')
+            parser_fr.add_argument('--blend', action='store_true',
+                                   help='mix neighbouring frames instead of '
+                                        'dropping/repeating')
+            parser_fr.add_argument('--output', dest='filename_out', type=str,
+                                   default=None,
+                                   help='file to write to, .y4m for '
+                                        'YUV4MPEG2, default '
+                                        '<filename>_<fr_out>_fps')
+            parser_fr.add_argument('--workers', type=int, default=None,
+                                   help='threads, default one per CPU')
+            parser_fr.set_defaults(func=__cmd_fr)
+
+        return parser
+
+    def run(args):
+        profile = vars(args).pop('profile')
+        cprofile = vars(args).pop('cprofile')
+        vars(args).pop('batch')
+        vars(args)['progress'] = get_progress(args.progress)
+        if profile:
+            vars(args)['profiler'] = Profiler()
+
+        # frame data on stdout, everything else goes to stderr
+        stdout = sys.stdout
+        if vars(args).get('filename_out') == '-':
+            sys.stdout = sys.stderr
+        try:
+            t1 = time.clock()
+            if cprofile:
+                import cProfile
+                cProfile.runctx('args.func(args)', globals(), locals(), cprofile)
+            else:
+                args.func(args)
+            t2 = time.clock()
+            print "\nTime: ", round(t2 - t1, 4)
+        finally:
+            sys.stdout = stdout
+
+        if profile:
+            args.profiler.dump(profile)
+
+    commands = ('info', 'split', 'convert', 'diff', 'psnr', 'ssim',
+                'metrics', 'blocks', 'batch', 'bdrate', 'index', 'align',
+                'get_luma', '8to10', '10to8', 'fliplr', 'flipud', 'fnum',
+                'crop', 'torgb', 'fromrgb', 'export', 'edit', 'fr')
+
+    def find_command(argv):
+        for a in argv:
+            if a in commands:
+                return a
+        return None
+
+    argv = sys.argv[1:]
+
+    if '--batch' in argv:
+        # long-lived mode, one command per line on stdin. Options given
+        # on the command line apply to every line.
+        import shlex
+        prefix = [a for a in argv if a != '--batch']
+        parsers = {}
+        for line in iter(sys.stdin.readline, ''):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            cmd_argv = prefix + shlex.split(line)
+            cmd = find_command(cmd_argv)
+            if cmd not in parsers:
+                parsers[cmd] = build_parser(cmd)
+            try:
+                run(parsers[cmd].parse_args(cmd_argv))
+            except SystemExit:
+                pass    # argparse has already reported the error
+            except Exception as e:
+                print >> sys.stderr, "[ERROR] - %s: %s" % (line, e)
+            sys.stdout.flush()
+        return
 
     # let parse_args() do the job of calling the appropriate function
     # after argument parsing is complete
-    args = parser.parse_args()
-    t1 = time.clock()
-    args.func(args)
-    t2 = time.clock()
-    print "\nTime: ", round(t2 - t1, 4)
+    run(build_parser(find_command(argv)).parse_args(argv))
 
 if __name__ == '__main__':
     main()